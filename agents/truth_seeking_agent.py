@@ -1,18 +1,24 @@
 import os
+import json
 import asyncio
-from typing import List
-from pydantic_ai import Agent, RunContext
-from deps.dependencies import get_dependencies, AgentDependencies, cleanup_dependencies
-from models.recipe_context import Evidence
+import hashlib
+from typing import Awaitable, Callable, List, Optional
+from pydantic_ai import Agent, ModelRetry, RunContext, TextOutput
+from deps.dependencies import AgentDependencies, job_dependencies
+from models.recipe_context import Evidence, EvidenceQuery
+from models.evidence_parser import parse_evidence, IncrementalEvidenceParser
 from prompts.agent import AgentPrompt
 from tools.web_search_tool import OptimizedBatchSearchTool
-import logfire
+from extensions.metrics import metrics, AGENT_TOKENS_TOTAL, AGENT_REQUESTS_TOTAL, OUTPUT_REPAIRS_TOTAL
+from extensions.rate_limiter import model_limiter
+from prompts.recipe_serializer import count_tokens
 
+# Fraction of agent runs traced by logfire; 0 skips the pydantic-ai instrumentation entirely
+LOGFIRE_SAMPLE_RATE = float(
+    os.getenv("LOGFIRE_SAMPLE_RATE", "0" if os.getenv("ENVIRONMENT") == "production" else "1")
+)
 
-if os.getenv("ENVIRONMENT") != "production":
-    import logfire
-    logfire.configure()
-logfire.instrument_pydantic_ai()
+AGENT_MODEL = "groq:moonshotai/kimi-k2-instruct-0905"
 
 SYSTEM_PROMPT = AgentPrompt.system_prompt + """
 
@@ -22,96 +28,222 @@ EFFICIENCY RULES:
 - Batch related searches together
 """
 
-truth_agent = Agent(
-    "groq:moonshotai/kimi-k2-instruct-0905",
-    deps_type=AgentDependencies,    
-    system_prompt=SYSTEM_PROMPT,
-    retries=1,
-)
+# Identifies the model and prompt behind stored evidence, so it is regenerated when either changes
+AGENT_VERSION = hashlib.sha1(f"{AGENT_MODEL}\n{SYSTEM_PROMPT}".encode("utf-8")).hexdigest()[:12]
 
 
-optimized_tool = OptimizedBatchSearchTool(
-    max_results=10,
-    max_workers=20
-)
 
+def evidence_output(text: str) -> List[EvidenceQuery]:
+    """
+    Output function of the agent: salvage every valid query group and
+    evidence item from the text, and only ask the model to retry when
+    nothing could be recovered.
+    """
+    result = parse_evidence(text)
+    if not result.queries:
+        raise ModelRetry(
+            "Your answer did not contain any valid evidence. Reply with only the JSON list of "
+            "query objects, each with a query and evidence_items (notes, source_link, link_status)."
+        )
+    if not result.complete:
+        print(
+            f"Salvaged agent output: {len(result.queries)} queries kept, "
+            f"{result.dropped_groups} groups and {result.dropped_items} items dropped"
+        )
+        metrics.inc(OUTPUT_REPAIRS_TOTAL, kind="repaired")
+        metrics.inc(OUTPUT_REPAIRS_TOTAL, result.dropped_groups, kind="dropped_groups")
+        metrics.inc(OUTPUT_REPAIRS_TOTAL, result.dropped_items, kind="dropped_items")
+    return result.queries
+
+
+def _configure_logfire() -> None:
+    import logfire
+    # Head sampling applies in every environment; ENVIRONMENT only picks the default rate.
+    # Workers without a Logfire token run normally and export nothing.
+    logfire.configure(
+        send_to_logfire="if-token-present",
+        sampling=logfire.SamplingOptions(head=LOGFIRE_SAMPLE_RATE),
+    )
+    if LOGFIRE_SAMPLE_RATE > 0:
+        logfire.instrument_pydantic_ai()
 
 
-@truth_agent.tool
 async def optimized_search(
     ctx: RunContext[AgentDependencies],
     queries: List[str]
 ) -> List[dict]:
     """
     MOST EFFICIENT parallel search with auto-optimization and batching.
-    Automatically optimizes queries and distributes across thread pool.
+    Automatically optimizes queries and runs them concurrently on the event loop.
     
     Args:
         queries: List of search queries (will be auto-optimized)
         
     Returns:
-        List of optimized search results
+        One result set per query, in order, labeled with its query. A query
+        that is a near-duplicate of an earlier one names it in "duplicate_of".
     """
-    return await optimized_tool(ctx, queries, optimize=True)
+    return await get_search_tool()(ctx, queries, optimize=True)
+
+
+# Built on first use, so importing this module has no side effects and
+# a preloading worker can fork before any client or exporter exists
+_truth_agent: Optional[Agent] = None
+_optimized_tool: Optional[OptimizedBatchSearchTool] = None
+
+
+def get_agent() -> Agent:
+    """The truth seeking agent; configures logfire and builds it on first call."""
+    global _truth_agent
+    if _truth_agent is None:
+        _configure_logfire()
+        agent = Agent(
+            AGENT_MODEL,
+            deps_type=AgentDependencies,
+            output_type=TextOutput(evidence_output),
+            system_prompt=SYSTEM_PROMPT,
+            retries=1,
+        )
+        agent.tool(optimized_search)
+        _truth_agent = agent
+    return _truth_agent
+
+
+def get_search_tool() -> OptimizedBatchSearchTool:
+    """The shared search tool (its HTTP client is still opened lazily per event loop)."""
+    global _optimized_tool
+    if _optimized_tool is None:
+        _optimized_tool = OptimizedBatchSearchTool(
+            max_results=10,
+            max_concurrency=20
+        )
+    return _optimized_tool
+
+
+async def close_search_client() -> None:
+    """Close the search tool's HTTP client; call before closing a per-job event loop."""
+    if _optimized_tool is not None:
+        await _optimized_tool.client.aclose()
 
-    """Benchmark different search methods."""
-    deps = await get_dependencies()
-    
-    test_queries = [
-        "salmon omega-3 diabetes",
-        "low glycemic index fish",
-        "protein blood sugar control",
-        "healthy fats diabetes diet"
-    ]
-    
-    print("\n" + "="*60)
-    print("BENCHMARKING SEARCH METHODS")
-    print("="*60)
-    
-    # Test 1: Sequential (simulated)
-    print("\n1. Sequential Search (baseline):")
-    print(f"   Estimated time: ~{len(test_queries) * 1.5:.1f}s (1.5s per query)")
-    
-    # Test 2: Batch with ThreadPoolExecutor
-    print("\n2. Batch Search (ThreadPoolExecutor):")
-    start = asyncio.get_event_loop().time()
-    results = await batch_tool.parallel_tool.search_parallel(test_queries)
-    elapsed = asyncio.get_event_loop().time() - start
-    print(f"   Actual time: {elapsed:.2f}s")
-    print(f"   Speedup: {(len(test_queries) * 1.5) / elapsed:.1f}x faster")
-    
-    # Test 3: Optimized batch
-    print("\n3. Optimized Batch Search:")
-    start = asyncio.get_event_loop().time()
-    results = await optimized_tool(None, test_queries, optimize=True)
-    elapsed = asyncio.get_event_loop().time() - start
-    print(f"   Actual time: {elapsed:.2f}s")
-    print(f"   Speedup: {(len(test_queries) * 1.5) / elapsed:.1f}x faster")
-    
-    print("\n" + "="*60 + "\n")
 
-async def analyze_recipe(recipe_text: str) -> str:
+def init_agent() -> None:
+    """Build the agent and search tool now instead of on the first job."""
+    get_agent()
+    get_search_tool()
+
+
+def __getattr__(name: str):
+    # Module attributes kept for callers importing truth_agent / optimized_tool
+    if name == "truth_agent":
+        return get_agent()
+    if name == "optimized_tool":
+        return get_search_tool()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+async def _run_agent(
+    recipe_text: str,
+    deps: AgentDependencies,
+    on_evidence: Optional[Callable[[EvidenceQuery], Awaitable[None]]],
+):
+    """
+    Run the agent, streaming when on_evidence is set; returns (output, usage).
+
+    A streamed answer is final, so when it holds no valid evidence the
+    model cannot retry within the stream: the conversation continues with
+    a non-streamed run instead.
+    """
+    if on_evidence is None:
+        result = await get_agent().run(recipe_text, deps=deps)
+        return result.output, result.usage()
+
+    async def deliver(query: EvidenceQuery, previous: Optional[asyncio.Task]):
+        # Groups are delivered in order, without holding up the stream
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        await on_evidence(query)
+
+    parser = IncrementalEvidenceParser()
+    deliveries: List[asyncio.Task] = []
+    retry: Optional[ModelRetry] = None
+    try:
+        async with get_agent().run_stream(recipe_text, deps=deps) as result:
+            try:
+                async for delta in result.stream_text(delta=True, debounce_by=None):
+                    for query in parser.feed(delta):
+                        previous = deliveries[-1] if deliveries else None
+                        deliveries.append(asyncio.create_task(deliver(query, previous)))
+                output = await result.get_output()
+            except ModelRetry as e:
+                # Raised by evidence_output once the stream is complete
+                retry = e
+    finally:
+        # Groups parsed before a failure are still delivered
+        for outcome in await asyncio.gather(*deliveries, return_exceptions=True):
+            if isinstance(outcome, Exception):
+                print(f"Failed to deliver streamed evidence: {outcome}")
+
+    if retry is not None:
+        print("Streamed output had no valid evidence, retrying without streaming")
+        # Continues the conversation, so the searches already made are not repeated
+        fallback = await get_agent().run(retry.message, message_history=result.all_messages(), deps=deps)
+        return fallback.output, result.usage() + fallback.usage()
+    return output, result.usage()
+
+
+async def _run_agent_limited(
+    recipe_text: str,
+    deps: AgentDependencies,
+    on_evidence: Optional[Callable[[EvidenceQuery], Awaitable[None]]],
+):
+    """
+    Run the agent within the model's fleet-wide rate limit: one request and
+    the prompt tokens up front, the rest of the usage charged afterwards.
+    """
+    limiter = model_limiter(AGENT_MODEL)
+    redis_client = getattr(deps, "redis_client", None)
+    estimate = count_tokens(recipe_text)
+    async with limiter.acquire(redis_client, requests=1, tokens=estimate):
+        output, usage = await _run_agent(recipe_text, deps, on_evidence)
+    await limiter.charge(
+        redis_client,
+        requests=(usage.requests or 1) - 1,
+        tokens=(usage.total_tokens or 0) - estimate,
+    )
+    return output, usage
+
+
+async def analyze_recipe(
+    recipe_text: str,
+    deps: Optional[AgentDependencies] = None,
+    on_evidence: Optional[Callable[[EvidenceQuery], Awaitable[None]]] = None,
+) -> List[EvidenceQuery]:
     """
     Analyze a recipe using the truth seeking agent.
     
     Args:
         recipe_text: The full text of the recipe and user context.
+        deps: Dependencies to run with. When omitted, pooled or per-run
+            dependencies are acquired for this call.
+        on_evidence: When set, the output is streamed and this is awaited
+            with every query group as soon as it is complete.
         
     Returns:
-        The JSON analysis result string.
+        The validated evidence (partial when the output had to be repaired).
     """
-    deps = await get_dependencies()
-    try:
-        result = await truth_agent.run(recipe_text, deps=deps)
-        return result.output
-    finally:
-        await cleanup_dependencies(deps)
+    if deps is not None:
+        output, usage = await _run_agent_limited(recipe_text, deps, on_evidence)
+    else:
+        async with job_dependencies() as deps:
+            output, usage = await _run_agent_limited(recipe_text, deps, on_evidence)
+
+    metrics.inc(AGENT_TOKENS_TOTAL, usage.input_tokens or 0, kind="input")
+    metrics.inc(AGENT_TOKENS_TOTAL, usage.output_tokens or 0, kind="output")
+    metrics.inc(AGENT_REQUESTS_TOTAL, usage.requests or 0)
+    return output
+
 
 async def main():
-    # Only import cleanup if running as script to avoid circular import issues if implemented elsewhere
-    # But since we have cleanup_dependencies in deps, we can use it.
-    from deps.dependencies import  cleanup_dependencies 
-    
     recipe_text = """
 Title: Baked Lemon Herb Salmon
 
@@ -139,7 +271,7 @@ Preparation Steps:
 Nutrition (per serving): Calories: 280, Protein: 25g, Carbs: 2g, Fat: 18g
 """  
     
-    print("Starting analysis with ThreadPoolExecutor...")
+    print("Starting analysis with async search client...")
     start_time = asyncio.get_event_loop().time()
     
     # Construct the full prompt context for the test
@@ -153,7 +285,7 @@ Nutrition (per serving): Calories: 280, Protein: 25g, Carbs: 2g, Fat: 18g
     print(f"\n{'='*60}")
     print(f"⚡ EXECUTION TIME: {elapsed:.2f} seconds")
     print(f"{'='*60}\n")
-    print(output)
+    print(json.dumps([query.model_dump(mode="json") for query in output], indent=2))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,237 @@
+"""
+Offline stand-ins for the services the pipeline talks to: the Tavily
+search API, the Groq model, MongoDB, Redis and the evidence link hosts.
+"""
+import re
+import json
+import asyncio
+import random
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+import httpx
+import mongomock
+import fakeredis
+from pydantic_ai.messages import ModelMessage, ModelResponse, TextPart, ToolCallPart, ToolReturnPart, UserPromptPart
+from pydantic_ai.models.function import AgentInfo, DeltaToolCall, FunctionModel
+from deps.dependencies import AgentDependencies
+
+WORDS = (
+    "protein fiber glycemic insulin omega sodium potassium cholesterol antioxidant vitamin mineral "
+    "metabolism satiety inflammation digestion cardiovascular blood sugar weight pressure calcium "
+    "iron magnesium legumes grains vegetables seafood poultry dairy nuts seeds olive oil baking "
+    "grilling steaming frying study trial participants intake daily serving recommended guideline"
+).split()
+
+INGREDIENTS = [
+    "salmon fillet", "chicken breast", "gram flour", "chickpeas", "lentils", "brown rice", "quinoa",
+    "spinach", "broccoli", "sweet potato", "olive oil", "greek yogurt", "oats", "almonds", "tofu",
+    "eggs", "paneer", "whole wheat pasta", "black beans", "avocado", "tomatoes", "onion", "garlic",
+    "ginger", "turmeric", "cumin", "honey", "butter", "cheddar cheese", "mushrooms", "bell pepper",
+]
+METHODS = ["Air-fry", "Bake", "Grill", "Steam", "Simmer", "Stir-fry", "Roast"]
+CUISINES = ["Indian", "Mediterranean", "Mexican", "Thai", "Italian", "Japanese", "American"]
+TYPES = ["breakfast", "lunch", "dinner", "snack"]
+
+
+def make_meals(count: int, seed: int = 7) -> List[dict]:
+    """Synthetic meal documents shaped like the crawler's output."""
+    rng = random.Random(seed)
+    meals = []
+    for i in range(count):
+        ingredients = rng.sample(INGREDIENTS, rng.randint(5, 10))
+        method = rng.choice(METHODS)
+        meals.append({
+            "_id": f"bench-{i:06d}",
+            "title": f"{method}d {ingredients[0]} with {ingredients[1]}",
+            "type": rng.choice(TYPES),
+            "description": f"A {rng.choice(CUISINES).lower()} style dish with {', '.join(ingredients[:3])}.",
+            "prep_time": f"{rng.randint(5, 30)} min",
+            "cook_time": f"{rng.randint(10, 60)} min",
+            "cuisine_style": rng.choice(CUISINES),
+            "ingredients": [{"item": item, "portion": f"{rng.randint(1, 300)} g"} for item in ingredients],
+            "preparation_steps": [
+                {"step": str(n + 1), "description": f"{method} the {item} until done."}
+                for n, item in enumerate(ingredients[:4])
+            ],
+            "nutrition": {
+                "calories": f"{rng.randint(150, 900)} kcal",
+                "protein": f"{rng.randint(2, 50)}g",
+                "carbs": f"{rng.randint(5, 100)}g",
+                "fat": f"{rng.randint(2, 45)}g",
+            },
+            "allergens": rng.sample(["gluten", "dairy", "nuts", "eggs", "soy"], rng.randint(0, 2)),
+            "why_this_meal": ["balanced", "quick"],
+        })
+    return meals
+
+
+class FakeSearchBackend:
+    """
+    Drop-in replacement for AsyncTavilySearch.
+
+    Returns deterministic result pages for every query after a random
+    latency around `latency` seconds (uniform within +/- `jitter`).
+    """
+
+    def __init__(self, latency: float = 0.3, jitter: float = 0.5, results: int = 10, seed: int = 11):
+        self.latency = latency
+        self.jitter = jitter
+        self.results = results
+        self._rng = random.Random(seed)
+        self.calls = 0
+
+    def _page(self, query: str, rank: int) -> Dict[str, Any]:
+        rng = random.Random(f"{query}:{rank}")
+        terms = query.lower().split()
+        sentences = []
+        for _ in range(12):
+            words = rng.sample(WORDS, 10) + rng.sample(terms, min(len(terms), rng.randint(0, 3)))
+            rng.shuffle(words)
+            sentences.append(" ".join(words).capitalize() + ".")
+        slug = re.sub(r"[^a-z0-9]+", "-", query.lower()).strip("-")
+        return {
+            "title": f"{query.title()} - result {rank}",
+            "url": f"https://example.org/{slug}/{rank}",
+            "content": " ".join(sentences),
+            "score": round(1 - rank / (self.results + 1), 3),
+        }
+
+    async def search(self, query: str, timeout: Optional[float] = None, **params) -> Dict[str, Any]:
+        self.calls += 1
+        await asyncio.sleep(self.latency * self._rng.uniform(1 - self.jitter, 1 + self.jitter))
+        count = params.get("max_results", self.results)
+        return {"query": query, "results": [self._page(query, rank) for rank in range(count)]}
+
+    async def aclose(self) -> None:
+        pass
+
+
+def _recipe_queries(prompt: str) -> List[str]:
+    """Five evidence queries derived from the recipe input, like the agent's step 2."""
+    title = re.search(r"^Title: (.+)$", prompt, re.M)
+    ingredients = re.findall(r"^- (?:\d+ g )?(.+)$", prompt, re.M)
+    subject = title.group(1) if title else "recipe"
+    items = (ingredients or [subject])[:3]
+    return [
+        f"{subject} nutrition benefits",
+        f"{items[0]} blood sugar control",
+        f"{items[min(1, len(items) - 1)]} heart health evidence",
+        f"{items[-1]} weight management study",
+        f"{subject} dietary guidelines",
+    ]
+
+
+def _scripted_turn(messages: List[ModelMessage]):
+    """The scripted agent's next step: ("search", queries) or ("answer", evidence JSON)."""
+    returns = [
+        part for part in messages[-1].parts
+        if isinstance(part, ToolReturnPart) and part.tool_name == "optimized_search"
+    ]
+    if not returns:
+        prompt = next(
+            part.content for message in messages for part in message.parts
+            if isinstance(part, UserPromptPart)
+        )
+        return "search", _recipe_queries(str(prompt))
+
+    evidence = []
+    for result in returns[0].content:
+        if result.get("duplicate_of"):
+            continue
+        items = result.get("results", [])[:5]
+        evidence.append({
+            "query": items[0]["title"].split(" - ")[0] if items else "",
+            "evidence_items": [
+                {
+                    "notes": " ".join(item["content"].split(". ")[:2]),
+                    "source_link": item["url"],
+                    "link_status": True,
+                }
+                for item in items
+            ],
+        })
+    return "answer", json.dumps(evidence)
+
+
+def scripted_model(latency: float = 0.5, chunk_size: int = 64) -> FunctionModel:
+    """
+    FunctionModel that behaves like the truth-seeking agent: one
+    optimized_search call with five queries, then the evidence JSON built
+    from the results it was shown. Streamed runs receive the answer in
+    chunks of `chunk_size` characters spread over `latency`.
+    """
+
+    async def respond(messages: List[ModelMessage], info: AgentInfo) -> ModelResponse:
+        await asyncio.sleep(latency)
+        kind, content = _scripted_turn(messages)
+        if kind == "search":
+            return ModelResponse(parts=[ToolCallPart("optimized_search", {"queries": content})])
+        return ModelResponse(parts=[TextPart(content)])
+
+    async def stream(messages: List[ModelMessage], info: AgentInfo):
+        kind, content = _scripted_turn(messages)
+        if kind == "search":
+            await asyncio.sleep(latency)
+            yield {0: DeltaToolCall(name="optimized_search", json_args=json.dumps({"queries": content}))}
+            return
+        chunks = [content[i:i + chunk_size] for i in range(0, len(content), chunk_size)]
+        for chunk in chunks:
+            await asyncio.sleep(latency / len(chunks))
+            yield chunk
+
+    return FunctionModel(respond, stream_function=stream, model_name="scripted-truth-agent")
+
+
+def _bulk_write(collection, operations, ordered=True, **kwargs):
+    """pymongo bulk_write for mongomock, which rejects pymongo 4.x operation objects."""
+    upserted = modified = 0
+    for op in operations:
+        update = collection.update_many if type(op).__name__ == "UpdateMany" else collection.update_one
+        result = update(op._filter, op._doc, upsert=op._upsert)
+        modified += result.modified_count
+        upserted += result.upserted_id is not None
+    return type("BulkWriteResult", (), {"upserted_count": upserted, "modified_count": modified})()
+
+
+def install_offline_stores():
+    """
+    Point every module-level Mongo collection and sync Redis client of the
+    pipeline at in-memory stand-ins.
+
+    Returns:
+        The mongomock database.
+    """
+    import jobs
+    import extensions.meal_status as meal_status
+    import extensions.evidence_cache as evidence_cache
+    from extensions.context_writer import context_writer
+
+    mongomock.collection.Collection.bulk_write = _bulk_write
+    db = mongomock.MongoClient().recipe_crawler
+    jobs.meals_collection = meal_status.meals_collection = db.meals
+    jobs.recipe_contexts_collection = evidence_cache.recipe_contexts_collection = db.recipe_contexts
+    jobs.evidence_categories_collection = db.evidence_categories
+    evidence_cache.evidence_cache_collection = db.evidence_cache
+    evidence_cache.redis_client = fakeredis.FakeRedis(decode_responses=True)
+    context_writer.collection = db.recipe_contexts
+    return db
+
+
+def offline_dependencies(link_latency: float = 0.02):
+    """
+    job_dependencies replacement backed by fakeredis and an HTTP transport
+    that answers every link check with 200 after `link_latency` seconds.
+    """
+    redis_client = fakeredis.FakeAsyncRedis()
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(link_latency)
+        return httpx.Response(200)
+
+    http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    @asynccontextmanager
+    async def job_dependencies():
+        yield AgentDependencies(mongo_db=None, redis_client=redis_client, http_client=http_client)
+
+    return job_dependencies
@@ -0,0 +1,215 @@
+"""
+Offline end-to-end benchmark of the meal pipeline.
+
+Runs the real jobs.process_meals path (serialization, agent run, search
+tool with cache and ranking, link checks, grounding, context writes)
+against a fake search backend, a scripted model and in-memory Mongo and
+Redis, so results only depend on this code and the configured latencies.
+
+Usage:
+    python -m benchmarks.run_pipeline                  # run and compare with the baseline
+    python -m benchmarks.run_pipeline --save-baseline  # record a new baseline
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import platform
+import resource
+from typing import Dict, List
+
+# The pipeline modules read these at import time; nothing is contacted
+os.environ.setdefault("GROQ_API_KEY", "offline-benchmark")
+os.environ.setdefault("TAVILY_API_KEY", "offline-benchmark")
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/0")
+os.environ.setdefault("LOGFIRE_SEND_TO_LOGFIRE", "false")
+os.environ.setdefault("LOGFIRE_IGNORE_NO_CONFIG", "1")
+os.environ.setdefault("LOGFIRE_CONSOLE", "false")
+# The rate limiter runs (against the fake Redis) without real provider quotas
+for quota in ("TAVILY_RATE_LIMIT_RPM", "GROQ_RATE_LIMIT_RPM", "GROQ_RATE_LIMIT_TPM"):
+    os.environ.setdefault(quota, "1000000000")
+# Every run starts from an empty persistent search index
+os.environ.setdefault("SEARCH_INDEX_DIR", tempfile.mkdtemp(prefix="search-index-"))
+
+import numpy as np
+import jobs
+from agents.truth_seeking_agent import truth_agent, optimized_tool
+from tools.web_search_tool import OptimizedBatchSearchTool
+from benchmarks.fakes import FakeSearchBackend, make_meals, scripted_model, install_offline_stores, offline_dependencies
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# Metrics compared against the baseline, and whether higher is better
+COMPARED_METRICS = {
+    "job_latency_ms.p50": False,
+    "job_latency_ms.p95": False,
+    "job_latency_ms.p99": False,
+    "meals_per_minute": True,
+    "search_fanout_ms.p50": False,
+    "search_fanout_ms.p95": False,
+    "ranking_ms.p50": False,
+    "ranking_ms.p95": False,
+    "max_rss_mb": False,
+}
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "count": 0}
+    p50, p95, p99 = np.percentile(np.array(samples) * 1000, [50, 95, 99])
+    return {"p50": round(float(p50), 2), "p95": round(float(p95), 2), "p99": round(float(p99), 2), "count": len(samples)}
+
+
+def _timed(func, samples: List[float]):
+    """Wrap a sync or async callable, appending its duration in seconds to samples."""
+    if asyncio.iscoroutinefunction(func):
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                samples.append(time.perf_counter() - start)
+    else:
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                samples.append(time.perf_counter() - start)
+    return wrapper
+
+
+async def run_benchmark(config: dict) -> dict:
+    """Run the pipeline over synthetic meals and collect the metrics."""
+    db = install_offline_stores()
+    meals = make_meals(config["meals"], seed=config["seed"])
+    db.meals.insert_many(meals)
+
+    optimized_tool.client = FakeSearchBackend(latency=config["search_latency"], seed=config["seed"])
+    jobs.job_dependencies = offline_dependencies(link_latency=config["link_latency"])
+    jobs.AGENT_STREAMING = config.get("streaming", False)
+
+    job_samples, fanout_samples, ranking_samples = [], [], []
+    jobs.process_meal_async = _timed(jobs.process_meal_async, job_samples)
+    OptimizedBatchSearchTool.__call__ = _timed(OptimizedBatchSearchTool.__call__, fanout_samples)
+    optimized_tool.ranker.rank_batch = _timed(optimized_tool.ranker.rank_batch, ranking_samples)
+
+    meal_ids = [meal["_id"] for meal in meals]
+    outcomes = {}
+    start = time.perf_counter()
+    with truth_agent.override(model=scripted_model(latency=config["model_latency"])):
+        # Same batching as the async worker
+        for i in range(0, len(meal_ids), config["batch_size"]):
+            batch = meal_ids[i:i + config["batch_size"]]
+            outcomes.update(await jobs.process_meals(batch, max_in_flight=config["max_in_flight"]))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "meals": len(meal_ids),
+        "failed": sum(1 for ok in outcomes.values() if not ok),
+        "contexts_written": db.recipe_contexts.count_documents({}),
+        "wall_seconds": round(elapsed, 2),
+        "meals_per_minute": round(len(meal_ids) / elapsed * 60, 1),
+        "job_latency_ms": _percentiles(job_samples),
+        "search_fanout_ms": _percentiles(fanout_samples),
+        "ranking_ms": _percentiles(ranking_samples),
+        "search_calls": optimized_tool.client.calls,
+        # ru_maxrss is reported in KiB on Linux and bytes on macOS
+        "max_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1
+        ),
+    }
+
+
+def _lookup(results: dict, dotted: str):
+    value = results
+    for part in dotted.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    Print every compared metric next to its baseline value.
+
+    Returns:
+        Descriptions of metrics that regressed by more than `tolerance`.
+    """
+    regressions = []
+    print(f"\n{'metric':<24}{'baseline':>12}{'current':>12}{'change':>10}")
+    for metric, higher_is_better in COMPARED_METRICS.items():
+        old, new = _lookup(baseline["results"], metric), _lookup(results, metric)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        flag = "  REGRESSION" if worse > tolerance else ""
+        print(f"{metric:<24}{old:>12}{new:>12}{change:>+10.1%}{flag}")
+        if flag:
+            regressions.append(f"{metric}: {old} -> {new} ({change:+.1%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of the meal pipeline.")
+    parser.add_argument("--meals", type=int, default=200, help="number of synthetic meals")
+    parser.add_argument("--batch-size", type=int, default=16, help="meals per worker batch (WORKER_BATCH_SIZE)")
+    parser.add_argument("--max-in-flight", type=int, default=8, help="concurrent meals (WORKER_MAX_IN_FLIGHT)")
+    parser.add_argument("--search-latency", type=float, default=0.3, help="mean search latency in seconds")
+    parser.add_argument("--model-latency", type=float, default=0.5, help="latency of each model turn in seconds")
+    parser.add_argument("--link-latency", type=float, default=0.02, help="latency of each link check in seconds")
+    parser.add_argument("--streaming", action="store_true", help="stream agent output (AGENT_STREAMING)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression (0.2 = 20%%)")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    config = {
+        "meals": args.meals,
+        "batch_size": args.batch_size,
+        "max_in_flight": args.max_in_flight,
+        "search_latency": args.search_latency,
+        "model_latency": args.model_latency,
+        "link_latency": args.link_latency,
+        "seed": args.seed,
+    }
+    if args.streaming:
+        config["streaming"] = True
+    print(f"Running offline pipeline benchmark: {config}")
+    results = asyncio.run(run_benchmark(config))
+    report = {"config": config, "python": platform.python_version(), "results": results}
+    print(json.dumps(report, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print("No baseline yet; run with --save-baseline to record one.")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("config") != config:
+        print("Baseline was recorded with a different configuration; not comparing.")
+        return
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("\nRegressions beyond tolerance:\n  " + "\n  ".join(regressions))
+        sys.exit(1)
+    print("\nNo regressions beyond tolerance.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Worker startup benchmark.
+
+Measures what a job pays before it can start: a cold process importing
+and initializing the job code, versus a work horse forked from a worker
+that preloaded it (worker.preload_jobs), versus one forked without
+preloading (the plain RQ worker before WORKER_PRELOAD).
+
+Usage:
+    python -m benchmarks.startup [--runs N]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import statistics
+
+# The job modules read these at import time; nothing is contacted
+os.environ.setdefault("GROQ_API_KEY", "offline-benchmark")
+os.environ.setdefault("TAVILY_API_KEY", "offline-benchmark")
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/0")
+os.environ.setdefault("LOGFIRE_SEND_TO_LOGFIRE", "false")
+os.environ.setdefault("LOGFIRE_IGNORE_NO_CONFIG", "1")
+os.environ.setdefault("LOGFIRE_CONSOLE", "false")
+
+# What a work horse does before running process_meal
+JOB_STARTUP = """
+import time
+start = time.perf_counter()
+from rq.utils import import_attribute
+import_attribute("jobs.process_meal")
+from agents.truth_seeking_agent import init_agent
+from prompts.recipe_serializer import count_tokens
+init_agent()
+count_tokens("warm up")
+elapsed = time.perf_counter() - start
+"""
+
+
+def _cold_start() -> float:
+    """Job startup in a fresh interpreter, including interpreter startup."""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", JOB_STARTUP], check=True, cwd=os.getcwd())
+    return time.perf_counter() - start
+
+
+def _forked_start() -> float:
+    """Job startup in a child forked from this process (like an RQ work horse)."""
+    read_fd, write_fd = os.pipe()
+    start = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        scope = {}
+        exec(JOB_STARTUP, scope)
+        os.write(write_fd, b"ok")
+        os._exit(0)
+    os.close(write_fd)
+    os.read(read_fd, 2)
+    elapsed = time.perf_counter() - start
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    return elapsed
+
+
+def _summary(samples) -> dict:
+    return {
+        "median_ms": round(statistics.median(samples) * 1000, 1),
+        "max_ms": round(max(samples) * 1000, 1),
+        "runs": len(samples),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure per-job startup overhead of the worker modes.")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    results = {
+        "cold_process": _summary([_cold_start() for _ in range(args.runs)]),
+        # Nothing imported in the parent: every work horse imports the job code
+        "fork_without_preload": _summary([_forked_start() for _ in range(args.runs)]),
+    }
+
+    from worker import preload_jobs
+    results["preload_seconds"] = round(preload_jobs(), 2)
+    results["fork_after_preload"] = _summary([_forked_start() for _ in range(args.runs)])
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
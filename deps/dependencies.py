@@ -1,14 +1,28 @@
 import os
-from dataclasses import dataclass
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 import redis.asyncio as redis
 import httpx
-from typing import Optional
+from typing import AsyncIterator, Dict, Optional
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+# Pool tuning (shared by per-run dependencies and the worker-lifetime pool)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+# Seconds between pool health checks (0 checks on every acquire)
+DEPS_HEALTHCHECK_INTERVAL = float(os.getenv("DEPS_HEALTHCHECK_INTERVAL", "30"))
+
 
 @dataclass
 class AgentDependencies:
@@ -16,32 +30,62 @@ class AgentDependencies:
     mongo_db: AsyncIOMotorDatabase
     redis_client: redis.Redis
     http_client: httpx.AsyncClient
+    # Per-run: content of every document the search tool returned, keyed by canonical URL
+    retrieved_documents: Dict[str, str] = field(default_factory=dict)
+    # Per-run: number of live (uncached) searches made by the search tool
+    search_calls: int = 0
+
+
+def _create_mongo_client() -> AsyncIOMotorClient:
+    return AsyncIOMotorClient(
+        os.getenv("MONGO_URI"),
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+    )
+
+
+async def _create_redis_client() -> redis.Redis:
+    return await redis.from_url(
+        os.getenv("REDIS_URL"),
+        decode_responses=True,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        socket_keepalive=True,
+        health_check_interval=int(DEPS_HEALTHCHECK_INTERVAL),
+    )
+
+
+def _create_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        timeout=30.0,
+        follow_redirects=True,
+        headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'},
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+    )
+
 
 async def get_dependencies() -> AgentDependencies:
     """
     Factory function to create dependencies.
     Uses environment variables from .env file for configuration.
     """
-    # Get configuration from environment (same as our extensions)
-    MONGO_URI = os.getenv("MONGO_URI")
     MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "recipe_crawler")
-    REDIS_URL = os.getenv("REDIS_URL")
-    
+
     # Create async MongoDB client
-    mongo_client = AsyncIOMotorClient(MONGO_URI)
-    
+    mongo_client = _create_mongo_client()
+
     # Create async Redis client
-    redis_client = await redis.from_url(REDIS_URL, decode_responses=True)
-    
+    redis_client = await _create_redis_client()
+
     # Create HTTP client for external requests
-    http_client = httpx.AsyncClient(
-        timeout=30.0,
-        follow_redirects=True,
-        headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
-    )
-    
+    http_client = _create_http_client()
+
     return AgentDependencies(
-        mongo_db=mongo_client[MONGO_DB_NAME],  
+        mongo_db=mongo_client[MONGO_DB_NAME],
         redis_client=redis_client,
         http_client=http_client
     )
@@ -54,4 +98,158 @@ async def cleanup_dependencies(deps: AgentDependencies) -> None:
     """
     await deps.http_client.aclose()
     await deps.redis_client.close()
-    # Motor client closes automatically
\ No newline at end of file
+    # Motor client closes automatically
+
+
+class DependencyPool:
+    """
+    Worker-lifetime pool of the clients behind AgentDependencies.
+
+    The Mongo, Redis and HTTP clients are created once per event loop and
+    reused by every run, so jobs keep warm connections. A periodic health
+    check reports unreachable servers and drops idle Redis connections; the
+    drivers reconnect by themselves, so clients in use by running jobs are
+    never closed under them.
+    """
+
+    def __init__(self, healthcheck_interval: float = DEPS_HEALTHCHECK_INTERVAL):
+        self.healthcheck_interval = healthcheck_interval
+        self._mongo_client: Optional[AsyncIOMotorClient] = None
+        self._redis_client: Optional[redis.Redis] = None
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._last_check = 0.0
+
+    @property
+    def started(self) -> bool:
+        return self._loop is not None
+
+    async def start(self) -> None:
+        """
+        Create all pooled clients on the running event loop, closing the
+        clients of a previous loop first.
+        """
+        # Claim the pool for this loop before the first await, so concurrent
+        # callers wait on the lock instead of opening clients of their own
+        self._loop = asyncio.get_running_loop()
+        self._lock = asyncio.Lock()
+        old_clients = self._mongo_client, self._redis_client, self._http_client
+        self._mongo_client = self._redis_client = self._http_client = None
+        async with self._lock:
+            await _close_clients(*old_clients)
+            self._mongo_client = _create_mongo_client()
+            self._redis_client = await _create_redis_client()
+            self._http_client = _create_http_client()
+            self._last_check = time.monotonic()
+
+    async def close(self) -> None:
+        """Close all pooled clients."""
+        await _close_clients(self._mongo_client, self._redis_client, self._http_client)
+        self._mongo_client = self._redis_client = self._http_client = None
+        self._loop = self._lock = None
+
+    async def acquire(self) -> AgentDependencies:
+        """
+        Return dependencies backed by the pooled clients.
+
+        Each call returns a new AgentDependencies instance, so per-run state
+        never leaks between concurrent jobs while the connections are shared.
+        """
+        if self._loop is not asyncio.get_running_loop():
+            # Clients are bound to the loop that created them, so a pool
+            # used from a new loop is rebuilt instead of reused
+            await self.start()
+        elif self._http_client is None:
+            # Being rebuilt for this loop by another caller
+            async with self._lock:
+                pass
+        elif time.monotonic() - self._last_check >= self.healthcheck_interval:
+            async with self._lock:
+                if time.monotonic() - self._last_check >= self.healthcheck_interval:
+                    await self._health_check()
+
+        return AgentDependencies(
+            mongo_db=self._mongo_client[os.getenv("MONGO_DB_NAME", "recipe_crawler")],
+            redis_client=self._redis_client,
+            http_client=self._http_client
+        )
+
+    async def _health_check(self) -> None:
+        """
+        Ping the pooled servers. Failures are reported and left to the
+        drivers to recover from: pymongo reconnects on its own, and idle
+        Redis connections are dropped so the next commands open new ones.
+        """
+        try:
+            await self._mongo_client.admin.command('ping')
+        except Exception as e:
+            print(f"MongoDB pool unhealthy: {e}")
+
+        try:
+            await self._redis_client.ping()
+        except Exception as e:
+            print(f"Redis pool unhealthy, dropping idle connections: {e}")
+            try:
+                await self._redis_client.connection_pool.disconnect(inuse_connections=False)
+            except Exception:
+                pass
+
+        if self._http_client.is_closed:
+            self._http_client = _create_http_client()
+
+        self._last_check = time.monotonic()
+
+
+async def _close_clients(
+    mongo_client: Optional[AsyncIOMotorClient],
+    redis_client: Optional[redis.Redis],
+    http_client: Optional[httpx.AsyncClient],
+) -> None:
+    """Close pooled clients, ignoring errors from clients of a loop that is gone."""
+    if http_client is not None:
+        try:
+            await http_client.aclose()
+        except Exception as e:
+            print(f"Error closing HTTP client: {e}")
+    if redis_client is not None:
+        try:
+            await redis_client.close()
+        except Exception as e:
+            print(f"Error closing Redis client: {e}")
+    if mongo_client is not None:
+        mongo_client.close()
+
+
+# Process-wide pool, started by the worker's startup hook
+dependency_pool = DependencyPool()
+
+
+async def init_dependency_pool() -> None:
+    """Worker startup hook: open the pooled connections."""
+    if not dependency_pool.started:
+        await dependency_pool.start()
+
+
+async def close_dependency_pool() -> None:
+    """Worker shutdown hook: close the pooled connections."""
+    if dependency_pool.started:
+        await dependency_pool.close()
+
+
+@asynccontextmanager
+async def job_dependencies() -> AsyncIterator[AgentDependencies]:
+    """
+    Dependencies for a single job.
+    Uses the worker pool when it is running, otherwise creates per-run
+    dependencies and cleans them up afterwards.
+    """
+    if dependency_pool.started:
+        yield await dependency_pool.acquire()
+        return
+
+    deps = await get_dependencies()
+    try:
+        yield deps
+    finally:
+        await cleanup_dependencies(deps)
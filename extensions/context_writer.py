@@ -0,0 +1,151 @@
+import os
+import time
+import threading
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+from pymongo import UpdateOne
+from extensions.mongo import recipe_contexts_collection
+
+# Flush once this many contexts are buffered, or when the oldest is this old
+CONTEXT_WRITE_BATCH_SIZE = int(os.getenv("CONTEXT_WRITE_BATCH_SIZE", "50"))
+CONTEXT_WRITE_FLUSH_SECONDS = float(os.getenv("CONTEXT_WRITE_FLUSH_SECONDS", "2"))
+
+# evidence_status of a context: still being streamed, or final
+EVIDENCE_PARTIAL = "partial"
+EVIDENCE_COMPLETE = "complete"
+
+
+def utc_timestamp() -> str:
+    """Current UTC time in the ISO format stored in updated_at."""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class RecipeContextWriter:
+    """
+    Write-behind buffer for recipe_contexts.
+
+    Finished results are buffered and flushed as one unordered bulk_write,
+    either when the buffer is full or when it has waited long enough. Each
+    flush only $sets the fields that differ from the stored documents, so
+    unchanged evidence is never rewritten. Callbacks given with a context
+    run once a flush has persisted it.
+    """
+
+    def __init__(
+        self,
+        collection=recipe_contexts_collection,
+        batch_size: int = CONTEXT_WRITE_BATCH_SIZE,
+        flush_interval: float = CONTEXT_WRITE_FLUSH_SECONDS,
+    ):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer: Dict[str, dict] = {}
+        self._callbacks: Dict[str, List[Callable[[], None]]] = {}
+        self._oldest = None
+        self._lock = threading.Lock()
+
+    def add(self, meal_id: str, fields: dict, on_written: Optional[Callable[[], None]] = None) -> None:
+        """
+        Buffer the fields of one recipe context; flushes when due.
+
+        Args:
+            on_written: Called (in the flushing thread) once the context is
+                stored; kept with the context when a flush fails.
+        """
+        with self._lock:
+            self._buffer.setdefault(meal_id, {}).update(fields)
+            if on_written is not None:
+                self._callbacks.setdefault(meal_id, []).append(on_written)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            due = (
+                len(self._buffer) >= self.batch_size
+                or time.monotonic() - self._oldest >= self.flush_interval
+            )
+        if due:
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Write all buffered contexts.
+
+        Returns:
+            Number of documents inserted or updated.
+        """
+        with self._lock:
+            batch, self._buffer, self._oldest = self._buffer, {}, None
+            callbacks, self._callbacks = self._callbacks, {}
+        if not batch:
+            return 0
+
+        fields = {name for values in batch.values() for name in values}
+        projection = {name: 1 for name in fields}
+        projection.update({"meal_id": 1, "_id": 0})
+        existing = {
+            doc["meal_id"]: doc
+            for doc in self.collection.find({"meal_id": {"$in": list(batch)}}, projection)
+        }
+
+        now = utc_timestamp()
+        operations = []
+        for meal_id, values in batch.items():
+            current = existing.get(meal_id)
+            changed = {
+                name: value for name, value in values.items()
+                if current is None or current.get(name) != value
+            }
+            if not changed:
+                continue
+            changed["updated_at"] = now
+            operations.append(UpdateOne({"meal_id": meal_id}, {"$set": changed}, upsert=True))
+
+        written = 0
+        if operations:
+            try:
+                result = self.collection.bulk_write(operations, ordered=False)
+            except Exception:
+                # Keep the batch for the next flush (newer values win); replays are diffed away
+                with self._lock:
+                    for meal_id, values in batch.items():
+                        self._buffer[meal_id] = {**values, **self._buffer.get(meal_id, {})}
+                    for meal_id, pending in callbacks.items():
+                        self._callbacks[meal_id] = pending + self._callbacks.get(meal_id, [])
+                    if self._oldest is None:
+                        self._oldest = time.monotonic()
+                raise
+            written = result.upserted_count + result.modified_count
+
+        for pending in callbacks.values():
+            for callback in pending:
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"Context write callback failed: {e}")
+        return written
+
+    def append_partial(self, meal_id: str, title: str, query: dict) -> None:
+        """
+        Immediately append one streamed query group to a context, bypassing
+        the buffer. The first group of a run replaces any final evidence.
+        """
+        now = utc_timestamp()
+        result = self.collection.update_one(
+            {"meal_id": meal_id, "evidence_status": EVIDENCE_PARTIAL},
+            {"$push": {"evidence": query}, "$set": {"updated_at": now}}
+        )
+        if not result.matched_count:
+            self.collection.update_one(
+                {"meal_id": meal_id},
+                {"$set": {"title": title, "evidence": [query], "evidence_status": EVIDENCE_PARTIAL, "updated_at": now}},
+                upsert=True
+            )
+
+    def partial_evidence(self, meal_id: str) -> list:
+        """Query groups streamed by an earlier, unfinished run of a meal."""
+        doc = self.collection.find_one({"meal_id": meal_id, "evidence_status": EVIDENCE_PARTIAL}, {"evidence": 1})
+        return (doc or {}).get("evidence") or []
+
+
+# Process-wide writer shared by every job of a worker
+context_writer = RecipeContextWriter()
@@ -0,0 +1,280 @@
+import os
+import re
+import hashlib
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set
+import numpy as np
+from extensions.mongo import evidence_cache_collection, recipe_contexts_collection
+from extensions.redis import redis_client
+from extensions.metrics import metrics, EVIDENCE_CACHE_TOTAL
+from extensions.context_writer import EVIDENCE_PARTIAL
+
+# Estimated Jaccard similarity above which another recipe's evidence is reused
+EVIDENCE_CACHE_THRESHOLD = float(os.getenv("EVIDENCE_CACHE_THRESHOLD", "0.8"))
+# MinHash signature length = LSH bands x rows per band
+EVIDENCE_CACHE_BANDS = int(os.getenv("EVIDENCE_CACHE_BANDS", "16"))
+EVIDENCE_CACHE_ROWS = int(os.getenv("EVIDENCE_CACHE_ROWS", "4"))
+
+STATS_KEY = "evidence_cache:stats"
+
+_MERSENNE_PRIME = np.uint64((1 << 31) - 1)
+_WORD = re.compile(r"[a-z]+")
+# Words in ingredient lines that do not change what the ingredient is
+_INGREDIENT_NOISE = {
+    "a", "an", "and", "or", "of", "to", "for", "taste", "about", "each", "into", "plus", "optional",
+    "g", "kg", "mg", "ml", "l", "oz", "lb", "lbs", "cup", "cups", "tbsp", "tsp", "tablespoon",
+    "tablespoons", "teaspoon", "teaspoons", "pinch", "clove", "cloves", "piece", "pieces", "slice",
+    "fresh", "chopped", "minced", "sliced", "diced", "grated", "large", "small", "medium", "thinly",
+    "finely", "roughly", "whole", "dried", "ground", "garnish", "serving", "serve",
+}
+
+
+def _singular(word: str) -> str:
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def _bucket(value, step: float) -> Optional[int]:
+    match = re.search(r"\d+(\.\d+)?", str(value)) if value is not None else None
+    return int(float(match.group()) // step) if match else None
+
+
+def recipe_features(meal: dict) -> Set[str]:
+    """
+    Canonical feature set of a recipe: normalized ingredient names,
+    bucketed nutrition and cuisine. Titles and wording are ignored, so
+    re-imports of the same recipe produce the same set.
+    """
+    features = set()
+    for ing in meal.get("ingredients") or []:
+        text = ing.get("item", "") if isinstance(ing, dict) else str(ing)
+        words = [_singular(w) for w in _WORD.findall(text.lower()) if w not in _INGREDIENT_NOISE]
+        if words:
+            features.add("ing:" + " ".join(words))
+            features.update("word:" + w for w in words)
+
+    nutrition = meal.get("nutrition") or {}
+    if isinstance(nutrition, dict):
+        for key, step in (("calories", 50), ("protein", 5), ("carbs", 5), ("fat", 5)):
+            bucket = _bucket(nutrition.get(key), step)
+            if bucket is not None:
+                features.add(f"{key}:{bucket}")
+
+    cuisine = " ".join(str(meal.get("cuisine_style") or "").lower().split())
+    if cuisine:
+        features.add("cuisine:" + cuisine)
+    return features
+
+
+def _feature_hashes(features: Set[str]) -> np.ndarray:
+    return np.array(
+        [int.from_bytes(hashlib.blake2b(f.encode("utf-8"), digest_size=4).digest(), "little") for f in sorted(features)],
+        dtype=np.uint64
+    )
+
+
+def _permutations(n: int):
+    rng = np.random.default_rng(1)  # fixed seed: signatures must match across workers
+    a = rng.integers(1, int(_MERSENNE_PRIME), size=n, dtype=np.uint64)
+    b = rng.integers(0, int(_MERSENNE_PRIME), size=n, dtype=np.uint64)
+    return a, b
+
+
+@dataclass
+class CachedEvidence:
+    """Evidence of a previously processed recipe that matches a new one."""
+    meal_id: str
+    similarity: float
+    exact: bool
+    evidence: list
+
+
+class EvidenceCache:
+    """
+    Content-addressed cache of generated evidence.
+
+    Recipes are keyed by a fingerprint of their canonical features for
+    exact duplicates, and by MinHash/LSH bands for near duplicates, so a
+    re-imported recipe reuses the evidence of the first copy instead of
+    running the agent again. Only evidence generated by the same agent
+    version is reused.
+
+    Evidence is staged in memory while its recipe context waits in the
+    write-behind buffer, and registered in Mongo only once the context is
+    stored; lookups see both, so duplicates within one batch are reused
+    too.
+
+    Hit counters are kept in memory and added to the fleet-wide stats in
+    Redis by flush_stats.
+    """
+
+    def __init__(
+        self,
+        threshold: float = EVIDENCE_CACHE_THRESHOLD,
+        bands: int = EVIDENCE_CACHE_BANDS,
+        rows: int = EVIDENCE_CACHE_ROWS,
+    ):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = rows
+        self._a, self._b = _permutations(bands * rows)
+        # Fingerprint -> (meal_id, agent_version, signature, evidence) of evidence not stored yet
+        self._staged: Dict[str, tuple] = {}
+        # Lookup outcomes not yet added to STATS_KEY
+        self._stats = Counter()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(features: Set[str]) -> str:
+        return hashlib.sha256("\n".join(sorted(features)).encode("utf-8")).hexdigest()
+
+    def signature(self, features: Set[str]) -> np.ndarray:
+        """MinHash signature: min over features of every (a*x + b) mod p permutation."""
+        hashes = _feature_hashes(features)
+        if not len(hashes):
+            return np.full(self.bands * self.rows, _MERSENNE_PRIME, dtype=np.uint64)
+        return ((np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME).min(axis=0)
+
+    def band_keys(self, signature: np.ndarray) -> List[str]:
+        rows = signature.reshape(self.bands, self.rows)
+        return [
+            f"{i}:{hashlib.blake2b(row.tobytes(), digest_size=8).hexdigest()}"
+            for i, row in enumerate(rows)
+        ]
+
+    def _evidence_for(self, meal_id) -> Optional[list]:
+        context = recipe_contexts_collection.find_one(
+            {"meal_id": meal_id, "evidence_status": {"$ne": EVIDENCE_PARTIAL}}, {"evidence": 1}
+        )
+        return (context or {}).get("evidence") or None
+
+    def _lookup_staged(self, meal_id, fingerprint: str, signature: np.ndarray, agent_version: str) -> Optional[CachedEvidence]:
+        """Best match among the staged evidence (exact fingerprint first)."""
+        with self._lock:
+            staged = list(self._staged.items())
+        best = None
+        for staged_fingerprint, (staged_id, staged_version, staged_signature, evidence) in staged:
+            if staged_id == meal_id or staged_version != agent_version:
+                continue
+            if staged_fingerprint == fingerprint:
+                return CachedEvidence(staged_id, 1.0, True, evidence)
+            similarity = float(np.mean(staged_signature == signature))
+            if similarity >= self.threshold and (best is None or similarity > best.similarity):
+                best = CachedEvidence(staged_id, similarity, False, evidence)
+        return best
+
+    def lookup(self, meal: dict, agent_version: str) -> Optional[CachedEvidence]:
+        """
+        Find reusable evidence for a meal (exact fingerprint first, then LSH).
+
+        Args:
+            meal: The meal document.
+            agent_version: Version of the agent that would generate the
+                evidence; evidence of other versions is not reused.
+        """
+        features = recipe_features(meal)
+        if not features:
+            return None
+
+        fingerprint = self.fingerprint(features)
+        signature = self.signature(features)
+        # Evidence generated by this process whose context is not stored yet
+        staged = self._lookup_staged(meal["_id"], fingerprint, signature, agent_version)
+        if staged is not None and staged.exact:
+            self._record("exact_hits")
+            return staged
+
+        entry = evidence_cache_collection.find_one({"_id": fingerprint, "agent_version": agent_version}, {"meal_id": 1})
+        if entry and entry["meal_id"] != meal["_id"]:
+            evidence = self._evidence_for(entry["meal_id"])
+            if evidence:
+                self._record("exact_hits")
+                return CachedEvidence(entry["meal_id"], 1.0, True, evidence)
+
+        best = None
+        candidates = evidence_cache_collection.find(
+            {"bands": {"$in": self.band_keys(signature)}, "agent_version": agent_version, "meal_id": {"$ne": meal["_id"]}},
+            {"meal_id": 1, "signature": 1}
+        ).limit(50)
+        for candidate in candidates:
+            similarity = float(np.mean(np.asarray(candidate["signature"], dtype=np.uint64) == signature))
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (candidate["meal_id"], similarity)
+
+        if staged is not None and (best is None or staged.similarity >= best[1]):
+            self._record("near_hits")
+            return staged
+        if best is not None:
+            evidence = self._evidence_for(best[0])
+            if evidence:
+                self._record("near_hits")
+                return CachedEvidence(best[0], best[1], False, evidence)
+
+        self._record("misses")
+        return None
+
+    def stage(self, meal: dict, evidence: list, agent_version: str) -> None:
+        """Make evidence generated for a meal reusable before its context is stored."""
+        features = recipe_features(meal)
+        if features:
+            with self._lock:
+                self._staged[self.fingerprint(features)] = (
+                    meal["_id"], agent_version, self.signature(features), evidence
+                )
+
+    def register(self, meal: dict, agent_version: str) -> None:
+        """Index a meal whose evidence, generated by agent_version, is stored in recipe_contexts."""
+        features = recipe_features(meal)
+        if not features:
+            return
+        fingerprint = self.fingerprint(features)
+        signature = self.signature(features)
+        evidence_cache_collection.update_one(
+            {"_id": fingerprint},
+            {"$set": {
+                "meal_id": meal["_id"],
+                "agent_version": agent_version,
+                "signature": [int(v) for v in signature],
+                "bands": self.band_keys(signature),
+                "updated_at": datetime.now(timezone.utc),
+            }},
+            upsert=True
+        )
+        with self._lock:
+            if self._staged.get(fingerprint, (None,))[0] == meal["_id"]:
+                del self._staged[fingerprint]
+
+    def _record(self, counter: str) -> None:
+        metrics.inc(EVIDENCE_CACHE_TOTAL, result=counter)
+        with self._lock:
+            self._stats[counter] += 1
+
+    def flush_stats(self) -> None:
+        """Add the counters recorded since the last flush to the fleet-wide stats, in one round trip."""
+        with self._lock:
+            pending, self._stats = self._stats, Counter()
+        if not pending:
+            return
+        try:
+            with redis_client.pipeline(transaction=False) as pipe:
+                for counter, count in pending.items():
+                    pipe.hincrby(STATS_KEY, counter, count)
+                pipe.execute()
+        except Exception as e:
+            print(f"Evidence cache stats update failed: {e}")
+
+    @staticmethod
+    def stats() -> dict:
+        """Fleet-wide hit counters and hit rate."""
+        counters = {k: int(v) for k, v in (redis_client.hgetall(STATS_KEY) or {}).items()}
+        lookups = sum(counters.get(k, 0) for k in ("exact_hits", "near_hits", "misses"))
+        hits = counters.get("exact_hits", 0) + counters.get("near_hits", 0)
+        counters["hit_rate"] = hits / lookups if lookups else 0.0
+        return counters
+
+
+evidence_cache = EvidenceCache()
@@ -0,0 +1,136 @@
+import re
+import hashlib
+from typing import Dict, Iterable, List, Optional, Tuple
+from prompts.recipe_serializer import serialize_recipe, RECIPE_QUERY_PREFIX
+
+# Bump when the features below change, so stored categories are regenerated
+CATEGORY_VERSION = 1
+
+CATEGORY_QUERY_PREFIX = "Based on this recipe category, please perform evidence collection.\n\n"
+
+# Cooking method, detected in the title, description and steps
+COOKING_METHODS = {
+    "air-fried": ["air fry", "air-fry", "air fried", "air-fried", "air fryer"],
+    "deep-fried": ["deep fry", "deep-fry", "deep fried", "deep-fried"],
+    "stir-fried": ["stir fry", "stir-fry", "stir fried", "stir-fried", "wok"],
+    "pan-fried": ["pan fry", "pan-fry", "pan fried", "pan-fried", "saute", "sauté", "skillet"],
+    "baked": ["bake", "baked", "baking", "oven"],
+    "roasted": ["roast", "roasted"],
+    "grilled": ["grill", "grilled", "barbecue", "bbq", "broil"],
+    "steamed": ["steam", "steamed"],
+    "boiled": ["boil", "boiled", "simmer", "poach"],
+    "slow-cooked": ["slow cook", "slow-cook", "slow cooker", "braise", "stew"],
+    "raw": ["no-cook", "no cook", "raw", "salad", "smoothie", "blend"],
+}
+
+# Main ingredient classes, detected in the ingredient names
+INGREDIENT_CLASSES = {
+    "red meat": ["beef", "lamb", "pork", "mutton", "veal", "bacon", "sausage", "ham"],
+    "poultry": ["chicken", "turkey", "duck"],
+    "seafood": ["fish", "salmon", "tuna", "cod", "shrimp", "prawn", "crab", "mackerel", "sardine"],
+    "egg": ["egg"],
+    "dairy": ["milk", "cheese", "yogurt", "yoghurt", "cream", "butter", "paneer", "ghee"],
+    "legumes": ["lentil", "chickpea", "bean", "pea", "dal", "tofu", "tempeh", "gram flour", "besan"],
+    "whole grains": ["oat", "quinoa", "brown rice", "whole wheat", "wholemeal", "barley", "millet", "buckwheat"],
+    "refined grains": ["white rice", "pasta", "spaghetti", "noodle", "white bread", "all-purpose flour", "maida"],
+    "nuts and seeds": ["almond", "walnut", "cashew", "peanut", "chia", "flax", "sesame", "seed"],
+    "added sugar": ["sugar", "honey", "syrup", "jaggery", "chocolate"],
+}
+ANIMAL_CLASSES = {"red meat", "poultry", "seafood"}
+
+_NUMBER = re.compile(r"\d+(\.\d+)?")
+
+
+def _matches(text: str, keywords: List[str]) -> bool:
+    # Whole words, allowing simple inflections ("oats", "simmering")
+    return any(re.search(r"\b" + re.escape(k) + r"(s|es|ed|ing)?\b", text) for k in keywords)
+
+
+def _amount(value) -> Optional[float]:
+    match = _NUMBER.search(str(value)) if value is not None else None
+    return float(match.group()) if match else None
+
+
+def category_features(meal: dict) -> List[str]:
+    """
+    Category a meal belongs to, as sorted feature labels: cooking methods,
+    main ingredient classes, nutrition profile, diet, cuisine and meal type.
+    Two meals with the same labels share the same evidence.
+    """
+    features = set()
+
+    steps = " ".join(
+        str(step.get("description", "")) if isinstance(step, dict) else str(step)
+        for step in meal.get("preparation_steps") or []
+    )
+    method_text = " ".join([str(meal.get("title") or ""), str(meal.get("description") or ""), steps]).lower()
+    features.update(f"method:{m}" for m, keywords in COOKING_METHODS.items() if _matches(method_text, keywords))
+
+    ingredient_text = " | ".join(
+        str(ing.get("item", "")) if isinstance(ing, dict) else str(ing)
+        for ing in meal.get("ingredients") or []
+    ).lower()
+    classes = {c for c, keywords in INGREDIENT_CLASSES.items() if _matches(ingredient_text, keywords)}
+    features.update(f"ingredient:{c}" for c in classes)
+    if ingredient_text and not classes & ANIMAL_CLASSES:
+        features.add("diet:vegetarian")
+
+    nutrition = meal.get("nutrition") or {}
+    if isinstance(nutrition, dict):
+        calories, protein = _amount(nutrition.get("calories")), _amount(nutrition.get("protein"))
+        carbs, fat = _amount(nutrition.get("carbs")), _amount(nutrition.get("fat"))
+        if calories is not None:
+            features.add("nutrition:low-calorie" if calories < 400 else "nutrition:high-calorie" if calories > 700 else "nutrition:moderate-calorie")
+        if protein is not None and protein >= 20:
+            features.add("nutrition:high-protein")
+        if carbs is not None and carbs <= 20:
+            features.add("nutrition:low-carb")
+        if fat is not None:
+            features.add("nutrition:low-fat" if fat <= 10 else "nutrition:high-fat" if fat >= 30 else "nutrition:moderate-fat")
+
+    for label, field in (("cuisine", "cuisine_style"), ("type", "type")):
+        value = " ".join(str(meal.get(field) or "").lower().split())
+        if value:
+            features.add(f"{label}:{value}")
+    return sorted(features)
+
+
+def category_key(features: List[str]) -> str:
+    return hashlib.sha1("|".join(features).encode("utf-8")).hexdigest()[:20]
+
+
+def category_signature(features: List[str], members: Iterable[dict], agent_version: str = "") -> str:
+    """
+    Changes whenever the evidence of a category would: its features (or
+    their definitions), the recipes of its members, or the agent model and
+    prompt (agent_version).
+    """
+    fingerprints = sorted(serialize_recipe(meal).fingerprint for meal in members)
+    payload = "|".join([f"v{CATEGORY_VERSION}", agent_version, *features, *fingerprints])
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def group_meals(meals: Iterable[dict]) -> Dict[str, Tuple[List[str], List[dict]]]:
+    """
+    Group meals by category.
+
+    Returns:
+        Mapping of category key to (features, member meals).
+    """
+    groups: Dict[str, Tuple[List[str], List[dict]]] = {}
+    for meal in meals:
+        features = category_features(meal)
+        groups.setdefault(category_key(features), (features, []))[1].append(meal)
+    return groups
+
+
+def serialize_category(features: List[str], representative: dict) -> str:
+    """Agent input for a category: its labels plus one member recipe as an example."""
+    labels = ", ".join(f.split(":", 1)[1] for f in features) or "uncategorized"
+    example = serialize_recipe(representative).text[len(RECIPE_QUERY_PREFIX):]
+    return f"{CATEGORY_QUERY_PREFIX}Category: {labels}\n\nExample recipe:\n{example}"
+
+
+def is_fresh(category: dict, signature: str) -> bool:
+    """Whether the stored evidence of a category can be fanned out as is."""
+    return bool(category and category.get("evidence") and category.get("signature") == signature)
@@ -0,0 +1,21 @@
+from datetime import datetime, timezone
+from typing import Iterable
+from extensions.mongo import meals_collection
+
+# Processing state stored on each meal document in `context_status`.
+# Meals without the field (or null) have never been picked up by the trigger.
+QUEUED = "queued"
+DONE = "done"
+FAILED = "failed"
+
+
+def mark_meals(meal_ids: Iterable[str], status: str) -> int:
+    """Set the processing state of several meals with one update_many."""
+    meal_ids = list(meal_ids)
+    if not meal_ids:
+        return 0
+    fields = {"context_status": status}
+    if status == QUEUED:
+        fields["context_queued_at"] = datetime.now(timezone.utc)
+    result = meals_collection.update_many({"_id": {"$in": meal_ids}}, {"$set": fields})
+    return result.modified_count
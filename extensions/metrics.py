@@ -0,0 +1,274 @@
+import os
+import json
+import time
+import fcntl
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Sequence, Tuple
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Port of the Prometheus text endpoint (0 disables it)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# Prometheus text file shared by every process of a worker (empty disables it)
+METRICS_FILE = os.getenv("METRICS_FILE", "")
+
+# Seconds, from a fast Redis call up to a slow agent run
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# Metric names used across the pipeline
+STAGE_SECONDS = "recipe_pipeline_stage_seconds"
+JOBS_TOTAL = "recipe_pipeline_jobs_total"
+FAILURES_TOTAL = "recipe_pipeline_failures_total"
+INPUT_TOKENS = "recipe_pipeline_input_tokens"
+AGENT_TOKENS_TOTAL = "recipe_agent_tokens_total"
+AGENT_REQUESTS_TOTAL = "recipe_agent_model_requests_total"
+SEARCH_CALLS_PER_JOB = "recipe_search_calls_per_job"
+SEARCH_QUERIES_TOTAL = "recipe_search_queries_total"
+SEARCH_ERRORS_TOTAL = "recipe_search_errors_total"
+SEARCH_FANOUT_SECONDS = "recipe_search_fanout_seconds"
+RANKING_SECONDS = "recipe_ranking_seconds"
+SEARCH_CONTEXT_CHARS = "recipe_search_context_chars"
+EVIDENCE_CACHE_TOTAL = "recipe_evidence_cache_lookups_total"
+OUTPUT_REPAIRS_TOTAL = "recipe_agent_output_repairs_total"
+WORKER_STARTUP_SECONDS = "recipe_worker_startup_seconds"
+STREAM_DEAD_LETTERS_TOTAL = "recipe_stream_dead_letters_total"
+RATE_LIMIT_WAIT_SECONDS = "recipe_rate_limit_wait_seconds"
+RATE_LIMIT_THROTTLED_TOTAL = "recipe_rate_limit_throttled_total"
+
+HELP = {
+    STAGE_SECONDS: "Duration of each pipeline stage per job.",
+    JOBS_TOTAL: "Finished jobs by outcome.",
+    FAILURES_TOTAL: "Failed pipeline stages by stage and error type.",
+    INPUT_TOKENS: "Tokens of the serialized recipe sent to the agent.",
+    AGENT_TOKENS_TOTAL: "Model tokens used by agent runs.",
+    AGENT_REQUESTS_TOTAL: "Model requests made by agent runs.",
+    SEARCH_CALLS_PER_JOB: "Live (uncached) searches made per agent run.",
+    SEARCH_QUERIES_TOTAL: "Search queries by cache result (index: served by the local search index; collapsed: merged into a near-duplicate query).",
+    SEARCH_ERRORS_TOTAL: "Failed live searches.",
+    SEARCH_FANOUT_SECONDS: "Duration of one optimized_search call.",
+    RANKING_SECONDS: "Duration of one batched BM25 ranking pass.",
+    SEARCH_CONTEXT_CHARS: "Characters of page content returned to the agent per optimized_search call.",
+    EVIDENCE_CACHE_TOTAL: "Evidence cache lookups by result.",
+    OUTPUT_REPAIRS_TOTAL: "Agent outputs salvaged by the repair parser, by what was fixed.",
+    WORKER_STARTUP_SECONDS: "Time to import and initialize the job code in a worker process.",
+    STREAM_DEAD_LETTERS_TOTAL: "Stream jobs moved to the dead-letter stream, by reason.",
+    RATE_LIMIT_WAIT_SECONDS: "Time spent waiting for rate limit tokens and a concurrency slot.",
+    RATE_LIMIT_THROTTLED_TOTAL: "Provider calls rejected as overloaded (429, 5xx, timeout).",
+}
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class MetricsRegistry:
+    """
+    Process-local counters and histograms in the Prometheus data model.
+
+    Exposed as Prometheus text over HTTP (async worker) and/or merged into
+    a shared file, so short-lived RQ work horses can report too.
+    """
+
+    def __init__(self, path: str = METRICS_FILE):
+        # Shared metrics file (empty disables it); a supervisor may set it before forking
+        self.path = path
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        # name -> labels -> [bucket counts..., sum, count]
+        self._histograms: Dict[str, Dict[Labels, list]] = {}
+        self._buckets: Dict[str, Sequence[float]] = {}
+        self._help: Dict[str, str] = dict(HELP)
+        # A forked process (work horse, supervised worker) reports only its own
+        # metrics, and must not inherit a lock held by a parent thread
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self) -> None:
+        self._lock = threading.Lock()
+        self._counters.clear()
+        self._histograms.clear()
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """Increment a counter."""
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets: Sequence[float] = DEFAULT_BUCKETS, **labels) -> None:
+        """Record one observation in a histogram."""
+        key = _labels(labels)
+        with self._lock:
+            buckets = self._buckets.setdefault(name, tuple(buckets))
+            series = self._histograms.setdefault(name, {})
+            values = series.setdefault(key, [0] * (len(buckets) + 2))
+            index = bisect_left(buckets, value)
+            if index < len(buckets):
+                values[index] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    @contextmanager
+    def timer(self, name: str, failures: Optional[str] = None, **labels):
+        """
+        Time a block into a histogram (in seconds).
+
+        Args:
+            failures: Counter incremented with the exception type when the
+                block raises.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            if failures:
+                self.inc(failures, error=type(e).__name__, **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> dict:
+        """JSON-serializable copy of every series."""
+        with self._lock:
+            return {
+                "help": dict(self._help),
+                "buckets": {name: list(b) for name, b in self._buckets.items()},
+                "counters": {
+                    name: [[list(map(list, labels)), value] for labels, value in series.items()]
+                    for name, series in self._counters.items()
+                },
+                "histograms": {
+                    name: [[list(map(list, labels)), list(values)] for labels, values in series.items()]
+                    for name, series in self._histograms.items()
+                },
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    @staticmethod
+    def merge(total: dict, snapshot: dict) -> dict:
+        """Add a snapshot into an accumulated snapshot (in place)."""
+        for key in ("help", "buckets"):
+            total.setdefault(key, {}).update(snapshot.get(key, {}))
+        for kind in ("counters", "histograms"):
+            merged = total.setdefault(kind, {})
+            for name, series in snapshot.get(kind, {}).items():
+                index = {json.dumps(entry[0]): entry for entry in merged.setdefault(name, [])}
+                for labels, value in series:
+                    entry = index.get(json.dumps(labels))
+                    if entry is None:
+                        merged[name].append([labels, value])
+                    elif kind == "counters":
+                        entry[1] += value
+                    else:
+                        entry[1] = [a + b for a, b in zip(entry[1], value)]
+        return total
+
+    @staticmethod
+    def render(snapshot: dict) -> str:
+        """Prometheus text exposition format of a snapshot."""
+        lines = []
+        helps = snapshot.get("help", {})
+        for name, series in sorted(snapshot.get("counters", {}).items()):
+            if name in helps:
+                lines.append(f"# HELP {name} {helps[name]}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in series:
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        for name, series in sorted(snapshot.get("histograms", {}).items()):
+            buckets = snapshot["buckets"][name]
+            if name in helps:
+                lines.append(f"# HELP {name} {helps[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, values in series:
+                cumulative = 0
+                for bound, count in zip(buckets, values):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels, ('le', str(bound)))} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {values[-1]}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {values[-2]}")
+                lines.append(f"{name}_count{_format_labels(labels)} {values[-1]}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _load(path: str) -> dict:
+        try:
+            with open(f"{path}.json") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def flush_to_file(self, path: Optional[str] = None) -> None:
+        """
+        Merge this process's metrics into the shared metrics file (self.path
+        by default) and reset them. The file is rewritten atomically under
+        an exclusive lock.
+        """
+        path = path or self.path
+        if not path:
+            return
+        snapshot = self.snapshot()
+        self.reset()
+        with open(f"{path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            total = self.merge(self._load(path), snapshot)
+            for suffix, content in ((".json", json.dumps(total)), ("", self.render(total))):
+                tmp = f"{path}{suffix}.tmp"
+                with open(tmp, "w") as f:
+                    f.write(content)
+                os.replace(tmp, f"{path}{suffix}")
+
+    def exposition(self) -> str:
+        """Current metrics of this process plus the shared file, as Prometheus text."""
+        snapshot = self.snapshot()
+        if self.path:
+            with open(f"{self.path}.lock", "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_SH)
+                snapshot = self.merge(self._load(self.path), snapshot)
+        return self.render(snapshot)
+
+    def start_http_server(self, port: int = METRICS_PORT) -> Optional[ThreadingHTTPServer]:
+        """Serve /metrics from a daemon thread (no-op when port is 0)."""
+        if not port:
+            return None
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.exposition().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Serving metrics on :{port}/metrics")
+        return server
+
+
+# Process-wide registry
+metrics = MetricsRegistry()
@@ -1,5 +1,5 @@
 import os
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -9,8 +9,8 @@ load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI")
 MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "recipe_crawler")
 
-# Create MongoDB client
-client = MongoClient(MONGO_URI)
+# Create MongoDB client; connect on first use so worker processes can fork after import
+client = MongoClient(MONGO_URI, connect=False)
 
 # Get database
 db = client[MONGO_DB_NAME]
@@ -18,6 +18,26 @@ db = client[MONGO_DB_NAME]
 # Export commonly used collections
 meals_collection = db.meals
 recipe_contexts_collection = db.recipe_contexts
+trigger_state_collection = db.trigger_state
+evidence_cache_collection = db.evidence_cache
+evidence_categories_collection = db.evidence_categories
+
+
+def ensure_indexes():
+    """Create the indexes the trigger and jobs rely on (idempotent)."""
+    recipe_contexts_collection.create_index([("meal_id", ASCENDING)], name="meal_id_1")
+    # Lets the trigger find new/failed/stale meals without scanning the catalog
+    meals_collection.create_index(
+        [("context_status", ASCENDING), ("_id", ASCENDING)], name="context_status_1__id_1"
+    )
+    meals_collection.create_index(
+        [("context_status", ASCENDING), ("context_queued_at", ASCENDING)],
+        name="context_status_1_context_queued_at_1"
+    )
+    # Members of a category are fanned out by category_key
+    meals_collection.create_index([("category_key", ASCENDING)], name="category_key_1")
+    # LSH band lookups for near-duplicate recipes
+    evidence_cache_collection.create_index([("bands", ASCENDING)], name="bands_1")
 
 # Test connection
 def test_connection():
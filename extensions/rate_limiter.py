@@ -0,0 +1,296 @@
+import os
+import time
+import random
+import asyncio
+import weakref
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, List, Optional, TypeVar
+import httpx
+import redis
+from dotenv import load_dotenv
+from extensions.metrics import metrics, RATE_LIMIT_WAIT_SECONDS, RATE_LIMIT_THROTTLED_TOTAL
+
+# Load environment variables
+load_dotenv()
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+# Fleet-wide quotas
+TAVILY_RATE_LIMIT_RPM = float(os.getenv("TAVILY_RATE_LIMIT_RPM", "1000"))
+GROQ_RATE_LIMIT_RPM = float(os.getenv("GROQ_RATE_LIMIT_RPM", "1000"))
+GROQ_RATE_LIMIT_TPM = float(os.getenv("GROQ_RATE_LIMIT_TPM", "250000"))
+# Seconds of quota a bucket may hand out at once after being idle
+RATE_LIMIT_BURST_SECONDS = float(os.getenv("RATE_LIMIT_BURST_SECONDS", "2"))
+# Retries of a throttled (429) search, with jittered exponential backoff
+RATE_LIMIT_RETRIES = int(os.getenv("RATE_LIMIT_RETRIES", "2"))
+RATE_LIMIT_BACKOFF = float(os.getenv("RATE_LIMIT_BACKOFF", "1"))
+# Recent latency above this multiple of the long-run latency counts as congestion
+RATE_LIMIT_LATENCY_TOLERANCE = float(os.getenv("RATE_LIMIT_LATENCY_TOLERANCE", "2"))
+
+# Refills the bucket from Redis' clock, then takes `cost` tokens or returns the
+# seconds to wait for them. With force set the tokens are always taken, so a
+# bucket can go into debt (charging actual usage after the fact).
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= cost or ARGV[4] == '1' then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+return tostring(wait)
+"""
+
+T = TypeVar("T")
+
+# TOKEN_BUCKET_SCRIPT registered once per Redis client (registering hashes the script)
+_bucket_scripts: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def _bucket_script(redis_client):
+    script = _bucket_scripts.get(redis_client)
+    if script is None:
+        script = _bucket_scripts[redis_client] = redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+    return script
+
+
+class TokenBucket:
+    """
+    Token bucket shared by every worker through Redis.
+
+    Without a Redis client, or when Redis fails, it lets calls through:
+    the adaptive concurrency limit still protects the provider.
+    """
+
+    def __init__(self, name: str, per_minute: float):
+        self.key = f"ratelimit:{name}"
+        self.rate = per_minute / 60
+        self.capacity = max(self.rate * RATE_LIMIT_BURST_SECONDS, 1)
+
+    async def _take(self, redis_client, cost: float, force: bool) -> float:
+        result = await _bucket_script(redis_client)(keys=[self.key], args=[self.rate, self.capacity, cost, "1" if force else "0"])
+        return float(result)
+
+    async def acquire(self, redis_client, cost: float = 1) -> float:
+        """Wait until `cost` tokens are available and take them; returns the seconds waited."""
+        if redis_client is None or cost <= 0:
+            return 0.0
+        # More than a full bucket can never be granted at once
+        cost = min(cost, self.capacity)
+        waited = 0.0
+        while True:
+            try:
+                wait = await self._take(redis_client, cost, force=False)
+            except redis.RedisError as e:
+                print(f"Rate limiter unavailable, not limiting: {e}")
+                return waited
+            if wait <= 0:
+                return waited
+            # Jitter keeps waiting workers from retrying in lockstep
+            delay = wait * random.uniform(1, 1.2)
+            await asyncio.sleep(delay)
+            waited += delay
+
+    async def charge(self, redis_client, cost: float) -> None:
+        """Take tokens without waiting (actual usage known only afterwards)."""
+        if redis_client is None or cost == 0:
+            return
+        try:
+            await self._take(redis_client, cost, force=True)
+        except redis.RedisError as e:
+            print(f"Rate limiter unavailable, not charging: {e}")
+
+
+class AdaptiveConcurrency:
+    """
+    Per-process concurrency limit adjusted with AIMD: it grows by one per
+    window of successful calls with normal latency, and is cut
+    multiplicatively on throttling or server errors (halved) and when the
+    recent average latency inflates past the long-run average (by 10%),
+    at most once per observed latency.
+
+    Waiters are plain futures of the running loop, so the limiter works
+    across the event loops of successive RQ jobs.
+
+    Args:
+        latency_tolerance: Recent latency above this multiple of the
+            long-run latency counts as congestion; None ignores latency (for
+            calls whose duration depends on the work, like agent runs).
+    """
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = 64,
+                 latency_tolerance: Optional[float] = RATE_LIMIT_LATENCY_TOLERANCE):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        # Fast and slow moving averages of the call latency
+        self.recent_latency: Optional[float] = None
+        self.baseline_latency: Optional[float] = None
+        self._last_decrease = 0.0
+        self._waiters: List[asyncio.Future] = []
+
+    async def enter(self) -> None:
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # Pass on a wake-up this waiter can no longer use
+                if waiter.done() and not waiter.cancelled():
+                    self._wake()
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.in_flight += 1
+
+    def leave(self) -> None:
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.pop(0)
+            # Waiters of a finished event loop (a previous RQ job) are dropped
+            if not waiter.done() and not waiter.get_loop().is_closed():
+                waiter.set_result(None)
+                free -= 1
+
+    def _increase(self) -> None:
+        self.limit = min(self.maximum, self.limit + 1 / max(self.limit, 1))
+        # A slot may have opened up for the calls waiting
+        self._wake()
+
+    def _decrease(self, factor: float, latency: float) -> None:
+        now = time.monotonic()
+        # Calls that were already in flight report the same congestion
+        if now - self._last_decrease < max(latency, 0.1):
+            return
+        self._last_decrease = now
+        self.limit = max(self.minimum, self.limit * factor)
+
+    def record(self, latency: float, overloaded: bool) -> None:
+        """Adjust the limit from one finished call."""
+        if overloaded:
+            self._decrease(0.5, latency)
+            return
+        if self.latency_tolerance is None:
+            self._increase()
+            return
+        if self.baseline_latency is None:
+            self.recent_latency = self.baseline_latency = latency
+        self.recent_latency += (latency - self.recent_latency) * 0.2
+        self.baseline_latency += (latency - self.baseline_latency) * 0.01
+        if self.recent_latency > self.baseline_latency * self.latency_tolerance:
+            self._decrease(0.9, latency)
+        else:
+            self._increase()
+
+
+def status_code(error: Exception) -> Optional[int]:
+    """HTTP status behind a provider error, if any."""
+    if type(error).__name__ == "UsageLimitExceededError":
+        return 429
+    code = getattr(error, "status_code", None)
+    if code is None and isinstance(error, httpx.HTTPStatusError):
+        code = error.response.status_code
+    return code
+
+
+def is_overload(error: Exception) -> bool:
+    """Throttling, server errors and timeouts mean the provider is at capacity."""
+    code = status_code(error)
+    return (code is not None and (code == 429 or code >= 500)) or isinstance(error, (httpx.TimeoutException, asyncio.TimeoutError))
+
+
+class RateLimiter:
+    """
+    Fleet-wide token buckets plus a per-process adaptive concurrency limit
+    for one provider (or model).
+    """
+
+    def __init__(self, name: str, buckets: Dict[str, float], concurrency: int, max_concurrency: int = 64,
+                 latency_tolerance: Optional[float] = RATE_LIMIT_LATENCY_TOLERANCE):
+        self.name = name
+        self.buckets = {kind: TokenBucket(f"{name}:{kind}", per_minute) for kind, per_minute in buckets.items()}
+        self.concurrency = AdaptiveConcurrency(concurrency, maximum=max_concurrency, latency_tolerance=latency_tolerance)
+
+    @asynccontextmanager
+    async def acquire(self, redis_client, **costs):
+        """
+        Hold a slot for one call: waits for the bucket tokens (e.g.
+        requests=1, tokens=500) and a concurrency slot, and feeds the
+        outcome of the call back into the concurrency limit.
+        """
+        if not RATE_LIMIT_ENABLED:
+            yield
+            return
+        start = time.perf_counter()
+        for kind, cost in costs.items():
+            await self.buckets[kind].acquire(redis_client, cost)
+        await self.concurrency.enter()
+        metrics.observe(RATE_LIMIT_WAIT_SECONDS, time.perf_counter() - start, limiter=self.name)
+
+        call_start = time.perf_counter()
+        overloaded = False
+        try:
+            yield
+        except Exception as e:
+            overloaded = is_overload(e)
+            if overloaded:
+                metrics.inc(RATE_LIMIT_THROTTLED_TOTAL, limiter=self.name, status=str(status_code(e) or "timeout"))
+                if status_code(e) == 429 and "requests" in self.buckets:
+                    # The quota is spent fleet-wide: empty the bucket for everyone
+                    await self.buckets["requests"].charge(redis_client, self.buckets["requests"].capacity)
+            raise
+        finally:
+            self.concurrency.leave()
+            self.concurrency.record(time.perf_counter() - call_start, overloaded)
+
+    async def charge(self, redis_client, **costs) -> None:
+        """Charge usage only known after the call (extra requests, actual tokens)."""
+        if RATE_LIMIT_ENABLED:
+            for kind, cost in costs.items():
+                await self.buckets[kind].charge(redis_client, cost)
+
+    async def call(self, redis_client, func: Callable[[], Awaitable[T]], retries: int = RATE_LIMIT_RETRIES, **costs) -> T:
+        """Run func under the limiter, retrying throttled calls with backoff."""
+        for attempt in range(retries + 1):
+            try:
+                async with self.acquire(redis_client, **costs):
+                    return await func()
+            except Exception as e:
+                if attempt == retries or status_code(e) != 429:
+                    raise
+            await asyncio.sleep(RATE_LIMIT_BACKOFF * 2 ** attempt * random.uniform(1, 1.5))
+
+
+search_limiter = RateLimiter("tavily", {"requests": TAVILY_RATE_LIMIT_RPM}, concurrency=20)
+
+_model_limiters: Dict[str, RateLimiter] = {}
+
+
+def model_limiter(model_name: str) -> RateLimiter:
+    """Limiter of one Groq model (quotas are per model)."""
+    if model_name not in _model_limiters:
+        _model_limiters[model_name] = RateLimiter(
+            model_name,
+            {"requests": GROQ_RATE_LIMIT_RPM, "tokens": GROQ_RATE_LIMIT_TPM},
+            concurrency=int(os.getenv("WORKER_MAX_IN_FLIGHT", "8")),
+            # A run's duration depends on how many searches it makes
+            latency_tolerance=None,
+        )
+    return _model_limiters[model_name]
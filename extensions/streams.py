@@ -0,0 +1,197 @@
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, List, Tuple
+import redis
+from bson import json_util
+from dotenv import load_dotenv
+from extensions.metrics import metrics, STREAM_DEAD_LETTERS_TOTAL
+
+# Load environment variables
+load_dotenv()
+
+# "rq" keeps the RQ queues, "streams" moves the trigger and workers to the stream below
+JOB_BACKEND = os.getenv("JOB_BACKEND", "rq")
+JOB_STREAM = os.getenv("JOB_STREAM", "recipe_jobs")
+JOB_STREAM_GROUP = os.getenv("JOB_STREAM_GROUP", "workers")
+# Seconds an entry may go without a heartbeat before another consumer reclaims it
+STREAM_VISIBILITY_TIMEOUT = float(os.getenv("STREAM_VISIBILITY_TIMEOUT", "120"))
+# Seconds a stream job may run before its batch is failed (the RQ jobs' timeout)
+STREAM_JOB_TIMEOUT = int(os.getenv("STREAM_JOB_TIMEOUT", "600"))
+# Deliveries after which an entry that keeps killing its consumer is dead-lettered
+STREAM_MAX_DELIVERIES = int(os.getenv("STREAM_MAX_DELIVERIES", "3"))
+# Approximate cap on the dead-letter stream
+STREAM_DEAD_LETTER_MAXLEN = int(os.getenv("STREAM_DEAD_LETTER_MAXLEN", "100000"))
+# Jobs added per enqueue script call
+STREAM_ENQUEUE_CHUNK = 500
+
+# Adds each job unless its id is already active (queued or running), atomically
+ENQUEUE_SCRIPT = """
+local added = {}
+for i = 1, #ARGV, 2 do
+    if redis.call('SADD', KEYS[2], ARGV[i]) == 1 then
+        redis.call('XADD', KEYS[1], '*', 'id', ARGV[i], 'job', ARGV[i + 1])
+        added[#added + 1] = ARGV[i]
+    end
+end
+return added
+"""
+
+
+def _str(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+@dataclass
+class StreamJob:
+    """One claimed stream entry."""
+    entry_id: str
+    job_id: str
+    func_name: str
+    arg: Any
+    deliveries: int = 1
+    timeout: int = STREAM_JOB_TIMEOUT
+
+
+class JobStream:
+    """
+    Job queue on a Redis stream with a consumer group (Redis >= 6.2).
+
+    Jobs are JSON entries (`bson.json_util`, so ObjectId arguments round
+    trip) with a deterministic job id; an `:active` set keeps a job from
+    being enqueued twice while it is queued or running. Consumers claim
+    batches with XREADGROUP and acknowledge them when done. Entries left
+    unacknowledged by a dead consumer for STREAM_VISIBILITY_TIMEOUT are
+    reclaimed with XAUTOCLAIM, and after STREAM_MAX_DELIVERIES they go to
+    the `:dead` stream. Failed jobs are dead-lettered too.
+    """
+
+    def __init__(self, conn, key: str = JOB_STREAM, group: str = JOB_STREAM_GROUP):
+        self.conn = conn
+        self.key = key
+        self.group = group
+        self.active_key = f"{key}:active"
+        self.dead_key = f"{key}:dead"
+        self._enqueue_script = conn.register_script(ENQUEUE_SCRIPT)
+
+    def ensure_group(self) -> None:
+        """Create the consumer group (and stream) if missing; reads from the start."""
+        try:
+            self.conn.xgroup_create(self.key, self.group, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def enqueue(self, func_name: str, jobs: List[Tuple[Any, str]]) -> List[Tuple[Any, str]]:
+        """
+        Add (arg, job_id) jobs for func_name ("module.function").
+
+        Returns:
+            The (arg, job_id) pairs that were added; the rest were already active.
+        """
+        added = set()
+        for start in range(0, len(jobs), STREAM_ENQUEUE_CHUNK):
+            args = []
+            for arg, job_id in jobs[start:start + STREAM_ENQUEUE_CHUNK]:
+                args += [job_id, json_util.dumps({"func": func_name, "arg": arg})]
+            added.update(_str(job_id) for job_id in self._enqueue_script(keys=[self.key, self.active_key], args=args))
+        return [(arg, job_id) for arg, job_id in jobs if job_id in added]
+
+    def _parse(self, entry_id, fields, deliveries: int = 1) -> StreamJob:
+        fields = {_str(k): _str(v) for k, v in fields.items()}
+        job = json_util.loads(fields["job"])
+        return StreamJob(_str(entry_id), fields["id"], job["func"], job["arg"], deliveries)
+
+    def _reclaim(self, consumer: str, count: int) -> List[StreamJob]:
+        """Take over entries whose consumer stopped heartbeating."""
+        result = self.conn.xautoclaim(
+            self.key, self.group, consumer,
+            min_idle_time=int(STREAM_VISIBILITY_TIMEOUT * 1000), start_id="0-0", count=count
+        )
+        entries = [(entry_id, fields) for entry_id, fields in result[1]]
+        if not entries:
+            return []
+
+        with self.conn.pipeline() as pipe:
+            for entry_id, _ in entries:
+                pipe.xpending_range(self.key, self.group, min=entry_id, max=entry_id, count=1)
+            pending = pipe.execute()
+
+        jobs, poisoned, missing = [], [], []
+        for (entry_id, fields), info in zip(entries, pending):
+            if not fields:
+                # Deleted while pending (older Redis returns it with no fields)
+                missing.append(_str(entry_id))
+                continue
+            job = self._parse(entry_id, fields, info[0]["times_delivered"] if info else 1)
+            (poisoned if job.deliveries > STREAM_MAX_DELIVERIES else jobs).append(job)
+
+        if missing:
+            self.conn.xack(self.key, self.group, *missing)
+        if poisoned:
+            print(f"Dead-lettering {len(poisoned)} jobs delivered more than {STREAM_MAX_DELIVERIES} times")
+            self.dead_letter(poisoned, "max deliveries exceeded")
+        return jobs
+
+    def claim(self, consumer: str, count: int, block_ms: int) -> List[StreamJob]:
+        """
+        Claim up to count jobs for consumer: stale entries of dead consumers
+        first, then new entries (blocking up to block_ms for the first one).
+        """
+        jobs = self._reclaim(consumer, count)
+        if len(jobs) < count:
+            response = self.conn.xreadgroup(
+                self.group, consumer, {self.key: ">"},
+                count=count - len(jobs), block=None if jobs else block_ms
+            )
+            for _, entries in response or []:
+                jobs.extend(self._parse(entry_id, fields) for entry_id, fields in entries)
+        return jobs
+
+    def heartbeat(self, consumer: str, entry_ids: List[str]) -> None:
+        """Reset the idle time of entries still being worked on, so they are not reclaimed."""
+        if entry_ids:
+            self.conn.xclaim(self.key, self.group, consumer, min_idle_time=0, message_ids=entry_ids, justid=True)
+
+    def ack(self, jobs: List[StreamJob]) -> None:
+        """Acknowledge and remove finished jobs; they can be enqueued again."""
+        if not jobs:
+            return
+        entry_ids = [job.entry_id for job in jobs]
+        with self.conn.pipeline() as pipe:
+            pipe.xack(self.key, self.group, *entry_ids)
+            pipe.xdel(self.key, *entry_ids)
+            pipe.srem(self.active_key, *[job.job_id for job in jobs])
+            pipe.execute()
+
+    def dead_letter(self, jobs: List[StreamJob], reason: str) -> None:
+        """Copy jobs to the dead-letter stream with the reason, then acknowledge them."""
+        if not jobs:
+            return
+        with self.conn.pipeline() as pipe:
+            for job in jobs:
+                pipe.xadd(
+                    self.dead_key,
+                    {
+                        "id": job.job_id,
+                        "job": json_util.dumps({"func": job.func_name, "arg": job.arg}),
+                        "reason": reason,
+                        "deliveries": job.deliveries,
+                        "failed_at": int(time.time()),
+                    },
+                    maxlen=STREAM_DEAD_LETTER_MAXLEN,
+                    approximate=True,
+                )
+            pipe.execute()
+        metrics.inc(STREAM_DEAD_LETTERS_TOTAL, len(jobs), reason=reason)
+        self.ack(jobs)
+
+    def backlog(self) -> Tuple[int, float]:
+        """Entries not yet acknowledged, and the age in seconds of the oldest one."""
+        depth = self.conn.xlen(self.key)
+        first = self.conn.xrange(self.key, count=1)
+        if not first:
+            return depth, 0.0
+        # Entry ids start with their creation time in milliseconds
+        created_ms = int(_str(first[0][0]).split("-")[0])
+        return depth, max(time.time() - created_ms / 1000, 0.0)
@@ -1,116 +1,406 @@
 import os
 import asyncio
-import json
+import hashlib
 import traceback
-from extensions.mongo import meals_collection, recipe_contexts_collection
-from agents.truth_seeking_agent import analyze_recipe
+from typing import Awaitable, Callable, Dict, List, Optional
+from extensions.mongo import meals_collection, recipe_contexts_collection, evidence_categories_collection
+from agents.truth_seeking_agent import analyze_recipe, close_search_client, AGENT_VERSION
+from deps.dependencies import job_dependencies, init_dependency_pool, close_dependency_pool
+from tools.link_checker import verify_evidence_links
+from tools.grounding import score_evidence_grounding
+from tools.search_index import search_index
+from prompts.recipe_serializer import serialize_recipe, with_collected_queries, RECIPE_PROJECTION
+from extensions.meal_status import mark_meals, DONE, FAILED
+from extensions.context_writer import context_writer, utc_timestamp, EVIDENCE_COMPLETE
+from extensions.metrics import (
+    metrics,
+    STAGE_SECONDS,
+    JOBS_TOTAL,
+    FAILURES_TOTAL,
+    INPUT_TOKENS,
+    SEARCH_CALLS_PER_JOB,
+    COUNT_BUCKETS,
+    TOKEN_BUCKETS,
+)
+from extensions.evidence_cache import evidence_cache
+from extensions.evidence_categories import category_features, category_key, category_signature, serialize_category, is_fresh
 
-def process_meal(meal_id: str):
+# Max number of meals analyzed at the same time by the concurrent worker mode
+MAX_IN_FLIGHT = int(os.getenv("WORKER_MAX_IN_FLIGHT", "8"))
+# Stream agent output and save each query group as soon as it is complete
+AGENT_STREAMING = os.getenv("AGENT_STREAMING", "false").lower() in ("1", "true", "yes")
+
+# (pid, loop) running the sync job entry points of this process
+_job_loop: Optional[tuple] = None
+
+
+def meal_job_id(meal_id) -> str:
     """
-    Process a single meal:
-    - Fetch meal from MongoDB
-    - Format structured text for the agent
-    - Call the async analyze_recipe agent
-    - Save the parsed evidence back to MongoDB
+    Deterministic RQ job id for a meal, so enqueueing the same meal twice
+    targets the same job instead of creating a duplicate.
+    """
+    raw = str(meal_id)
+    if ':' in raw or len(raw) > 100:
+        raw = hashlib.sha1(raw.encode('utf-8')).hexdigest()
+    return f"meal-{raw}"
+
+
+def save_recipe_context(
+    meal_id: str,
+    meal: dict,
+    parsed_data,
+    evidence_source: Optional[dict] = None,
+    on_written: Optional[Callable[[], None]] = None,
+) -> None:
+    """
+    Buffer the parsed evidence for the next recipe_contexts bulk write.
+
+    Args:
+        evidence_source: Set when the evidence was not generated for this
+            meal: reused from a duplicate recipe ({"meal_id", "similarity",
+            "exact"}) or shared by its category ({"category"}).
+        on_written: Called once the context is stored.
+    """
+    context_writer.add(meal_id, {
+        "title": meal.get('title'),
+        "evidence": parsed_data,
+        "evidence_status": EVIDENCE_COMPLETE,
+        "evidence_source": evidence_source,
+    }, on_written)
+
+
+async def fetch_meals(meal_ids: List[str]) -> Dict[str, dict]:
+    """
+    Fetch all meal documents of a batch with a single $in query.
+
+    Returns:
+        Mapping of meal _id to meal document (missing meals are absent).
+    """
+    if not meal_ids:
+        return {}
+    cursor_docs = await asyncio.to_thread(
+        lambda: list(meals_collection.find({"_id": {"$in": list(meal_ids)}}, RECIPE_PROJECTION))
+    )
+    return {meal["_id"]: meal for meal in cursor_docs}
+
+
+async def generate_evidence(
+    query: str,
+    label: str,
+    on_evidence: Optional[Callable[[dict], Awaitable[None]]] = None,
+) -> Optional[list]:
+    """
+    Run the agent on a query and verify its evidence.
+
+    Args:
+        query: Agent input.
+        label: What is being processed, for log messages.
+        on_evidence: When set, the agent output is streamed and this is
+            awaited with every query group (links verified and grounding
+            scored) as soon as it is complete.
+
+    Returns:
+        The parsed evidence, or None if the agent output was unusable.
+    """
+    async with job_dependencies() as deps:
+        streamed = None
+        if on_evidence is not None:
+            async def streamed(evidence_query):
+                group = [evidence_query.model_dump(mode="json")]
+                await verify_evidence_links(group, deps.http_client, deps.redis_client)
+                score_evidence_grounding(group, deps.retrieved_documents)
+                await on_evidence(group[0])
+
+        with metrics.timer(STAGE_SECONDS, failures=FAILURES_TOTAL, stage="agent"):
+            evidence = await analyze_recipe(query, deps=deps, on_evidence=streamed)
+        metrics.observe(SEARCH_CALLS_PER_JOB, deps.search_calls, buckets=COUNT_BUCKETS)
+
+        if not evidence:
+            print(f"No output from agent for {label}")
+            metrics.inc(FAILURES_TOTAL, stage="agent", error="EmptyOutput")
+            return None
+
+        # Output is already validated (and salvaged) by the agent's output function
+        with metrics.timer(STAGE_SECONDS, stage="parse"):
+            parsed_data = [item.model_dump(mode="json") for item in evidence]
+
+        # Verify every source link instead of trusting the agent's link_status
+        with metrics.timer(STAGE_SECONDS, failures=FAILURES_TOTAL, stage="link_check"):
+            await verify_evidence_links(parsed_data, deps.http_client, deps.redis_client)
+
+        # Score how well each note is supported by the retrieved content
+        with metrics.timer(STAGE_SECONDS, failures=FAILURES_TOTAL, stage="grounding"):
+            score_evidence_grounding(parsed_data, deps.retrieved_documents)
+    return parsed_data
+
+
+async def process_meal_async(meal_id: str, meal: Optional[dict] = None) -> bool:
+    """
+    Process a single meal inside an already running event loop.
+
+    Args:
+        meal_id: The meal _id.
+        meal: The meal document if it was already fetched (e.g. by fetch_meals).
+
+    Returns:
+        True if evidence was saved, False otherwise.
     """
     print(f"Processing meal: {meal_id}")
 
+    with metrics.timer(STAGE_SECONDS, stage="total"):
+        outcome = await _process_meal(meal_id, meal)
+    metrics.inc(JOBS_TOTAL, outcome=outcome)
+    return outcome in ("done", "reused")
+
+
+async def _process_meal(meal_id: str, meal: Optional[dict]) -> str:
+    """Pipeline of process_meal_async; returns the job outcome label."""
     try:
         # 1. Fetch meal from MongoDB
-        meal = meals_collection.find_one({"_id": meal_id})
+        if meal is None:
+            with metrics.timer(STAGE_SECONDS, failures=FAILURES_TOTAL, stage="fetch"):
+                meal = await asyncio.to_thread(meals_collection.find_one, {"_id": meal_id}, RECIPE_PROJECTION)
         if not meal:
             print(f"Meal not found: {meal_id}")
-            return
-
-        # 2. Format structured text for the agent
-        recipe_text = f"Title: {meal.get('title', 'Unknown')}\n"
-        recipe_text += f"Type: {meal.get('type', 'Unknown')}\n"
-        recipe_text += f"Description: {meal.get('description', '')}\n"
-        recipe_text += f"Prep Time: {meal.get('prep_time', '')}\n"
-        recipe_text += f"Cook Time: {meal.get('cook_time', '')}\n"
-        recipe_text += f"Cuisine Style: {meal.get('cuisine_style', '')}\n"
-        recipe_text += f"Image URL: {meal.get('image_url', '')}\n\n"
-
-        # Ingredients
-        ingredients = meal.get('ingredients', [])
-        ing_text = ""
-        if isinstance(ingredients, list):
-            for ing in ingredients:
-                item = ing.get('item', 'Unknown')
-                portion = ing.get('portion', '')
-                ing_text += f"- {{'item': '{item}', 'portion': '{portion}'}}\n"
-        recipe_text += f"Ingredients:\n{ing_text}\n"
-
-        # Preparation Steps
-        prep_steps = meal.get('preparation_steps', [])
-        step_text = ""
-        if isinstance(prep_steps, list):
-            for step in prep_steps:
-                s = step.get('step', '')
-                desc = step.get('description', '')
-                # Only include description if present
-                step_text += f"- {{'step': '{s}', 'description': '{desc}'}}\n"
-        recipe_text += f"Preparation Steps:\n{step_text}\n"
-
-        # Nutrition
-        nutrition = meal.get('nutrition', {})
-        nutrition_text = ""
-        if nutrition:
-            for key in ['calories', 'protein', 'carbs', 'fat']:
-                val = nutrition.get(key, None)
-                if val is not None:
-                    nutrition_text += f"- {key.capitalize()}: {val}\n"
-        recipe_text += f"Nutrition:\n{nutrition_text}\n"
-
-        # Allergens
-        allergens = meal.get('allergens', None)
-        if not allergens:
-            allergens = None
-        recipe_text += f"Allergens: {allergens}\n"
-
-        # Why this meal
-        why_this_meal = meal.get('why_this_meal', [])
-        if not why_this_meal:
-            why_this_meal = []
-        why_text = ", ".join(why_this_meal) if why_this_meal else "None"
-        recipe_text += f"Why This Meal: {why_text}\n"
-
-        # Add default query wrapper
-        full_query = f"Based on this recipe, please perform evidence collection.\n\n{recipe_text}"
-
-        # 3. Call Agent (async)
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        json_output = loop.run_until_complete(analyze_recipe(full_query))
+            return "not_found"
+
+        # 2. Serialize the recipe for the agent
+        with metrics.timer(STAGE_SECONDS, failures=FAILURES_TOTAL, stage="serialize"):
+            recipe = serialize_recipe(meal)
+        full_query = recipe.text
+        metrics.observe(INPUT_TOKENS, recipe.token_count, buckets=TOKEN_BUCKETS)
+        print(f"Recipe input for meal {meal_id}: {recipe.token_count} tokens")
+
+        # Duplicate or near-duplicate recipes reuse the evidence already generated
+        with metrics.timer(STAGE_SECONDS, failures=FAILURES_TOTAL, stage="cache_lookup"):
+            cached = await asyncio.to_thread(evidence_cache.lookup, meal, AGENT_VERSION)
+        if cached is not None:
+            print(f"Reusing evidence of meal {cached.meal_id} for meal {meal_id} (similarity {cached.similarity:.2f})")
+            await asyncio.to_thread(
+                save_recipe_context, meal_id, meal, cached.evidence,
+                {"meal_id": cached.meal_id, "similarity": cached.similarity, "exact": cached.exact}
+            )
+            return "reused"
+
+        # 3. Run the agent and check its evidence
+        collected, on_evidence = [], None
+        if AGENT_STREAMING:
+            # Resume from the query groups an interrupted run already saved
+            collected = await asyncio.to_thread(context_writer.partial_evidence, meal_id)
+            if collected:
+                print(f"Resuming meal {meal_id} with {len(collected)} queries already collected")
+                full_query = with_collected_queries(full_query, [group.get("query") for group in collected])
+
+            async def on_evidence(group: dict):
+                await asyncio.to_thread(context_writer.append_partial, meal_id, meal.get("title"), group)
+
+        parsed_data = await generate_evidence(full_query, f"meal {meal_id}", on_evidence)
+        if parsed_data is None:
+            return "failed"
+        if collected:
+            seen = {group.get("query") for group in collected}
+            parsed_data = collected + [group for group in parsed_data if group.get("query") not in seen]
+
+        # 4. Save to recipe_contexts collection (write-behind); duplicates can
+        # reuse the evidence right away, other workers once it is stored
+        with metrics.timer(STAGE_SECONDS, failures=FAILURES_TOTAL, stage="save"):
+            evidence_cache.stage(meal, parsed_data, AGENT_VERSION)
+            await asyncio.to_thread(
+                save_recipe_context, meal_id, meal, parsed_data, None, lambda: evidence_cache.register(meal, AGENT_VERSION)
+            )
+
+        print(f"Successfully processed meal {meal_id}")
+        return "done"
+
+    except Exception as e:
+        traceback.print_exc()
+        print(f"Failed to process meal {meal_id}: {str(e)}")
+        return "failed"
+
+
+async def process_meals(meal_ids: List[str], max_in_flight: int = MAX_IN_FLIGHT) -> Dict[str, bool]:
+    """
+    Process a batch of meals concurrently in the current event loop.
+
+    Args:
+        meal_ids: The meal _ids to process.
+        max_in_flight: Maximum number of meals analyzed at the same time.
+
+    Returns:
+        Mapping of meal _id to whether it was processed successfully.
+    """
+    meals = await fetch_meals(meal_ids)
+    semaphore = asyncio.Semaphore(max(1, max_in_flight))
+
+    async def _run(meal_id: str) -> bool:
+        meal = meals.get(meal_id)
+        if meal is None:
+            print(f"Meal not found: {meal_id}")
+            return False
+        async with semaphore:
+            return await process_meal_async(meal_id, meal)
+
+    outcomes = dict(zip(meal_ids, await asyncio.gather(*(_run(meal_id) for meal_id in meal_ids))))
+
+    # Persist the batch before it is reported as done
+    with metrics.timer(STAGE_SECONDS, failures=FAILURES_TOTAL, stage="flush"):
+        await asyncio.to_thread(context_writer.flush)
+    await asyncio.to_thread(evidence_cache.flush_stats)
+
+    # Record processing state so the trigger does not pick these meals up again
+    await asyncio.to_thread(mark_meals, [m for m, ok in outcomes.items() if ok], DONE)
+    await asyncio.to_thread(mark_meals, [m for m, ok in outcomes.items() if not ok], FAILED)
+    return outcomes
+
+
+def _run_job(coro):
+    """
+    Run a job coroutine on this process's job loop.
+
+    The loop, and the dependency pool opened on it, are kept between jobs
+    so a SimpleWorker reuses its connections; a forked work horse runs one
+    job and exits with them.
+    """
+    global _job_loop
+    if _job_loop is None or _job_loop[0] != os.getpid():
+        # A loop inherited through fork belongs to the parent
+        _job_loop = (os.getpid(), asyncio.new_event_loop())
+        asyncio.set_event_loop(_job_loop[1])
+        _job_loop[1].run_until_complete(init_dependency_pool())
+    asyncio.set_event_loop(_job_loop[1])
+    return _job_loop[1].run_until_complete(coro)
+
+
+def close_job_loop() -> None:
+    """Worker shutdown hook: close the job loop of this process and the clients open on it."""
+    global _job_loop
+    if _job_loop is None or _job_loop[0] != os.getpid():
+        return
+    loop = _job_loop[1]
+    _job_loop = None
+    try:
+        loop.run_until_complete(close_search_client())
+        loop.run_until_complete(close_dependency_pool())
+    finally:
         loop.close()
 
-        if not json_output:
-            print(f"No output from agent for meal {meal_id}")
-            return
-
-        # 4. Parse agent output
-        try:
-            parsed_data = json.loads(json_output)
-        except json.JSONDecodeError:
-            print(f"Failed to parse agent output for meal {meal_id}: {json_output}")
-            return
-
-        # 5. Save to recipe_contexts collection
-        recipe_contexts_collection.update_one(
-            {"meal_id": meal_id},
-            {
-                "$set": {
-                    "meal_id": meal_id,
-                    "title": meal.get('title'),
-                    "evidence": parsed_data,
-                    "updated_at": os.popen('date -u +"%Y-%m-%dT%H:%M:%SZ"').read().strip()
-                }
-            },
-            upsert=True
+
+def process_meal(meal_id: str):
+    """
+    Process a single meal:
+    - Fetch meal from MongoDB
+    - Serialize the recipe for the agent
+    - Reuse evidence of a duplicate recipe, or call the async analyze_recipe agent
+    - Save the parsed evidence back to MongoDB
+    """
+    ok = _run_job(process_meal_async(meal_id))
+    # The work horse exits after this job, so nothing may stay buffered
+    with metrics.timer(STAGE_SECONDS, failures=FAILURES_TOTAL, stage="flush"):
+        context_writer.flush()
+        search_index.flush()
+    evidence_cache.flush_stats()
+    mark_meals([meal_id], DONE if ok else FAILED)
+    metrics.flush_to_file()
+
+
+async def process_category_async(key: str) -> Dict[str, bool]:
+    """
+    Generate the evidence of one category and fan it out to its members.
+
+    The agent only runs when the category has no evidence yet or its
+    signature changed; otherwise the stored evidence is reused. Unchanged
+    member contexts are diffed away by the context writer. Meals edited
+    since they were grouped leave the category and are processed on their
+    own.
+
+    Returns:
+        Mapping of member meal _id to whether its context was saved.
+    """
+    members = await asyncio.to_thread(
+        lambda: list(meals_collection.find({"category_key": key}, RECIPE_PROJECTION))
+    )
+    moved = [meal for meal in members if category_key(category_features(meal)) != key]
+    members = [meal for meal in members if category_key(category_features(meal)) == key]
+
+    outcomes = {}
+    if moved:
+        moved_ids = [meal["_id"] for meal in moved]
+        print(f"Processing {len(moved)} meals edited since they were grouped into category {key} individually")
+        await asyncio.to_thread(
+            meals_collection.update_many, {"_id": {"$in": moved_ids}}, {"$unset": {"category_key": ""}}
         )
+        outcomes.update(zip(moved_ids, await asyncio.gather(*(process_meal_async(meal["_id"], meal) for meal in moved))))
+    if not members:
+        print(f"Category {key} has no members")
+        return outcomes
+    outcomes.update(await _process_category_members(key, members))
+    return outcomes
+
 
-        print(f"Successfully processed and saved meal {meal_id}")
+async def _process_category_members(key: str, members: List[dict]) -> Dict[str, bool]:
+    """Generate (or reuse) the evidence of a category and save it for every member."""
+    features = category_features(members[0])
+    signature = category_signature(features, members, AGENT_VERSION)
+    try:
+        category = await asyncio.to_thread(evidence_categories_collection.find_one, {"_id": key})
+        if is_fresh(category, signature):
+            evidence = category["evidence"]
+        else:
+            print(f"Generating evidence for category {key} ({len(members)} meals): {', '.join(features)}")
+            evidence = await generate_evidence(serialize_category(features, members[0]), f"category {key}")
+            if evidence is None:
+                return {meal["_id"]: False for meal in members}
+            await asyncio.to_thread(
+                evidence_categories_collection.update_one,
+                {"_id": key},
+                {"$set": {
+                    "features": features,
+                    "signature": signature,
+                    "evidence": evidence,
+                    "updated_at": utc_timestamp(),
+                }},
+                upsert=True
+            )
 
+        for meal in members:
+            await asyncio.to_thread(save_recipe_context, meal["_id"], meal, evidence, {"category": key})
     except Exception as e:
         traceback.print_exc()
-        print(f"Failed to process meal {meal_id}: {str(e)}")
+        print(f"Failed to process category {key}: {str(e)}")
+        return {meal["_id"]: False for meal in members}
+
+    print(f"Successfully processed category {key} ({len(members)} meals)")
+    return {meal["_id"]: True for meal in members}
+
+
+async def process_categories(keys: List[str], max_in_flight: int = MAX_IN_FLIGHT) -> Dict[str, bool]:
+    """
+    Process a batch of categories concurrently in the current event loop.
+
+    Returns:
+        Mapping of category key to whether all of its members were saved.
+    """
+    semaphore = asyncio.Semaphore(max(1, max_in_flight))
+
+    async def _run(key: str) -> Dict[str, bool]:
+        async with semaphore:
+            return await process_category_async(key)
+
+    results = dict(zip(keys, await asyncio.gather(*(_run(key) for key in keys))))
+
+    await asyncio.to_thread(context_writer.flush)
+    meal_outcomes = {meal_id: ok for outcome in results.values() for meal_id, ok in outcome.items()}
+    await asyncio.to_thread(mark_meals, [m for m, ok in meal_outcomes.items() if ok], DONE)
+    await asyncio.to_thread(mark_meals, [m for m, ok in meal_outcomes.items() if not ok], FAILED)
+    return {key: bool(outcome) and all(outcome.values()) for key, outcome in results.items()}
+
+
+def process_category(key: str):
+    """
+    Process one category of meals: run the agent once (if its evidence is
+    missing or stale) and save the evidence for every member meal.
+    """
+    _run_job(process_categories([key], max_in_flight=1))
+    # The work horse exits after this job, so nothing may stay buffered
+    search_index.flush()
+    metrics.flush_to_file()
@@ -1,6 +1,5 @@
 import os
 import sys
-from pymongo import MongoClient
 from dotenv import load_dotenv
 
 # Add project root to sys.path
@@ -9,58 +8,39 @@ sys.path.append(os.getcwd())
 # Load environment variables
 load_dotenv()
 
-def migrate():
-    print("Starting migration: 001_migrate_evidence_structure")
-    
-    MONGO_URI = os.getenv("MONGO_URI")
-    MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "recipe_crawler")
-    
-    if not MONGO_URI:
-        print("Error: MONGO_URI not set")
-        return
+from migrations.framework import Migration, MigrationRunner, get_database, main
+
 
-    client = MongoClient(MONGO_URI)
-    db = client[MONGO_DB_NAME]
-    collection = db.recipe_contexts
-    
-    # logic to find documents that need migration
-    # We look for documents where 'evidence' is an array, 
-    # and the first element (if partial) has 'notes' field directly (old structure)
-    # New structure has 'query' and 'evidence_items'
-    
-    cursor = collection.find({"evidence": {"$type": "array", "$ne": []}})
-    
-    count = 0
-    updated_count = 0
-    
-    for doc in cursor:
-        count += 1
-        evidence = doc.get("evidence", [])
-        
+class MigrateEvidenceStructure(Migration):
+    """
+    Wraps old flat evidence lists (items with 'notes' directly) into a
+    single "legacy" query group of the new query/evidence_items structure.
+    """
+    name = "001_migrate_evidence_structure"
+    collection = "recipe_contexts"
+    # Old structure: the first element has 'notes' directly and no 'evidence_items'
+    filter = {
+        "evidence.0.notes": {"$exists": True},
+        "evidence.0.evidence_items": {"$exists": False},
+    }
+    projection = {"evidence": 1}
+
+    def update(self, doc):
+        evidence = doc.get("evidence") or []
         if not evidence:
-            continue
-            
-        first_item = evidence[0]
-        
-        # Check if it's the old structure (has 'notes' directly)
-        if "notes" in first_item and "evidence_items" not in first_item:
-            print(f"Migrating document {doc['_id']}")
-            
-            # Wrap all old items into a single "legacy" query group
-            new_structure = [
-                {
-                    "query": "legacy_migration_data",
-                    "evidence_items": evidence
-                }
-            ]
-            
-            collection.update_one(
-                {"_id": doc["_id"]},
-                {"$set": {"evidence": new_structure}}
-            )
-            updated_count += 1
-            
-    print(f"Migration complete. Scanned {count} docs, updated {updated_count} docs.")
+            return None
+        return {"$set": {"evidence": [{"query": "legacy_migration_data", "evidence_items": evidence}]}}
+
+
+MIGRATION = MigrateEvidenceStructure()
+
+
+def migrate():
+    print(f"Starting migration: {MIGRATION.name}")
+    db = get_database()
+    if db is None:
+        return
+    MigrationRunner(db, MIGRATION).run()
 
 if __name__ == "__main__":
-    migrate()
+    main([MIGRATION])
@@ -1,6 +1,5 @@
 import os
 import sys
-from pymongo import MongoClient
 from dotenv import load_dotenv
 
 # Add project root to sys.path
@@ -9,37 +8,34 @@ sys.path.append(os.getcwd())
 # Load environment variables
 load_dotenv()
 
+from migrations.framework import Migration, MigrationRunner, get_database, main
+
+FIELDS = ("user_scenarios", "user_details")
+
+
+class AddUserContextFields(Migration):
+    """Adds empty user_scenarios and user_details lists where missing."""
+    name = "002_add_user_context_fields"
+    collection = "recipe_contexts"
+    filter = {"$or": [{field: {"$exists": False}} for field in FIELDS]}
+    projection = {field: 1 for field in FIELDS}
+    # New contexts are created without these fields
+    rerun = True
+
+    def update(self, doc):
+        missing = {field: [] for field in FIELDS if field not in doc}
+        return {"$set": missing} if missing else None
+
+
+MIGRATION = AddUserContextFields()
+
+
 def migrate():
-    print("Starting migration: 002_add_user_context_fields")
-    
-    MONGO_URI = os.getenv("MONGO_URI")
-    MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "recipe_crawler")
-    
-    if not MONGO_URI:
-        print("Error: MONGO_URI not set")
+    print(f"Starting migration: {MIGRATION.name}")
+    db = get_database()
+    if db is None:
         return
-
-    client = MongoClient(MONGO_URI)
-    db = client[MONGO_DB_NAME]
-    collection = db.recipe_contexts
-    
-    # Update documents adding user_scenarios if missing
-    print("Checking for missing user_scenarios...")
-    result_scenarios = collection.update_many(
-        {"user_scenarios": {"$exists": False}},
-        {"$set": {"user_scenarios": []}}
-    )
-    print(f"Added user_scenarios to {result_scenarios.modified_count} documents")
-
-    # Update documents adding user_details if missing
-    print("Checking for missing user_details...")
-    result_details = collection.update_many(
-        {"user_details": {"$exists": False}},
-        {"$set": {"user_details": []}}
-    )
-    print(f"Added user_details to {result_details.modified_count} documents")
-    
-    print("Migration complete.")
+    MigrationRunner(db, MIGRATION).run()
 
 if __name__ == "__main__":
-    migrate()
+    main([MIGRATION])
@@ -0,0 +1,277 @@
+import os
+import sys
+import time
+import argparse
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+from bson import ObjectId
+from pymongo import MongoClient, UpdateOne
+from dotenv import load_dotenv
+
+# Add project root to sys.path
+sys.path.append(os.getcwd())
+
+# Load environment variables
+load_dotenv()
+
+# Documents read and written per bulk_write
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "1000"))
+# Number of _id ranges scanned in parallel
+MIGRATION_WORKERS = int(os.getenv("MIGRATION_WORKERS", "1"))
+# Assumed bulk write throughput (updates per second) for dry-run estimates
+MIGRATION_WRITE_RATE = float(os.getenv("MIGRATION_WRITE_RATE", "5000"))
+# Documents read by a dry run to measure the scan rate
+DRY_RUN_SAMPLE = 1000
+# Seconds of ObjectIds before the last watermark a rerun scans again, for ids
+# generated with a slightly earlier clock on another client
+MIGRATION_RERUN_OVERLAP = int(os.getenv("MIGRATION_RERUN_OVERLAP", "3600"))
+
+STATE_COLLECTION = "migration_state"
+RUNNING = "running"
+DONE = "done"
+
+
+class Migration:
+    """
+    A resumable data migration.
+
+    Subclasses set `name` and `collection`, narrow the scan with `filter`
+    (documents that still need the change) and `projection`, and return
+    the update for one document from `update`. Updates must be idempotent:
+    a resumed range may see its last batch again.
+
+    Migrations with `rerun` set keep applying to documents written after
+    they finished (e.g. filling fields the pipeline does not set): every
+    later run scans the _ids above the last watermark.
+    """
+    name: str = ""
+    collection: str = ""
+    filter: dict = {}
+    projection: Optional[dict] = None
+    rerun: bool = False
+
+    def update(self, doc: dict) -> Optional[dict]:
+        """Update document for one document, or None to leave it unchanged."""
+        raise NotImplementedError
+
+
+def get_database():
+    MONGO_URI = os.getenv("MONGO_URI")
+    MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "recipe_crawler")
+    if not MONGO_URI:
+        print("Error: MONGO_URI not set")
+        return None
+    return MongoClient(MONGO_URI)[MONGO_DB_NAME]
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def split_ranges(collection, workers: int) -> List[dict]:
+    """
+    Split the _id space into `workers` contiguous ranges of roughly equal
+    size, using split points read from the _id index.
+    """
+    total = collection.estimated_document_count()
+    split_points = []
+    for i in range(1, workers):
+        doc = next(collection.find({}, {"_id": 1}).sort("_id", 1).skip(i * total // workers).limit(1), None)
+        if doc is not None and (not split_points or doc["_id"] > split_points[-1]):
+            split_points.append(doc["_id"])
+    bounds = [None] + split_points + [None]
+    return [
+        {"lower": lower, "upper": upper, "watermark": None, "scanned": 0, "updated": 0, "done": False}
+        for lower, upper in zip(bounds[:-1], bounds[1:])
+    ]
+
+
+def _range_query(migration: Migration, lower, upper, watermark) -> dict:
+    bounds = {}
+    if watermark is not None:
+        bounds["$gt"] = watermark
+    elif lower is not None:
+        bounds["$gte"] = lower
+    if upper is not None:
+        bounds["$lt"] = upper
+    return {"$and": [migration.filter, {"_id": bounds}]} if bounds else dict(migration.filter)
+
+
+class MigrationRunner:
+    """
+    Runs a Migration in batches of bulk_write updates over one or more _id
+    ranges, checkpointing each range's _id watermark in the
+    migration_state collection after every batch, so an interrupted run
+    continues where it stopped.
+    """
+
+    def __init__(self, db, migration: Migration, batch_size: int = MIGRATION_BATCH_SIZE):
+        self.db = db
+        self.migration = migration
+        self.collection = db[migration.collection]
+        self.state = db[STATE_COLLECTION]
+        self.batch_size = batch_size
+
+    def status(self) -> Optional[str]:
+        doc = self.state.find_one({"_id": self.migration.name}, {"status": 1})
+        return (doc or {}).get("status")
+
+    def _run_range(self, index: int, rng: dict) -> None:
+        watermark = rng["watermark"]
+        while True:
+            batch = list(
+                self.collection.find(
+                    _range_query(self.migration, rng["lower"], rng["upper"], watermark),
+                    self.migration.projection,
+                ).sort("_id", 1).limit(self.batch_size)
+            )
+            if not batch:
+                break
+
+            operations = []
+            for doc in batch:
+                update = self.migration.update(doc)
+                if update:
+                    # Re-check the filter so concurrent writers are not overwritten
+                    operations.append(UpdateOne({"$and": [{"_id": doc["_id"]}, self.migration.filter]}, update))
+            updated = self.collection.bulk_write(operations, ordered=False).modified_count if operations else 0
+
+            watermark = batch[-1]["_id"]
+            self.state.update_one(
+                {"_id": self.migration.name},
+                {
+                    "$set": {f"ranges.{index}.watermark": watermark, "updated_at": _now()},
+                    "$inc": {f"ranges.{index}.scanned": len(batch), f"ranges.{index}.updated": updated},
+                }
+            )
+            if len(batch) < self.batch_size:
+                break
+
+        self.state.update_one({"_id": self.migration.name}, {"$set": {f"ranges.{index}.done": True}})
+
+    def run(self, workers: int = MIGRATION_WORKERS, reset: bool = False) -> dict:
+        """
+        Run (or resume) the migration.
+
+        Args:
+            workers: Number of _id ranges scanned in parallel; only used
+                when the migration starts, a resumed run keeps its ranges.
+            reset: Discard saved progress and start over.
+
+        Returns:
+            The final migration state document.
+        """
+        name = self.migration.name
+        state = None if reset else self.state.find_one({"_id": name})
+        if state and state.get("status") == DONE:
+            if not self.migration.rerun:
+                print(f"Migration {name} already done.")
+                return state
+            state = self._next_pass(state)
+        elif state is None:
+            state = {"_id": name, "status": RUNNING, "ranges": split_ranges(self.collection, max(1, workers)), "started_at": _now()}
+            self.state.replace_one({"_id": name}, state, upsert=True)
+        else:
+            print(f"Resuming migration {name}")
+
+        pending = [(i, rng) for i, rng in enumerate(state["ranges"]) if not rng["done"]]
+        print(f"Running migration {name} over {len(pending)} _id ranges")
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, len(pending))) as executor:
+            for future in [executor.submit(self._run_range, i, rng) for i, rng in pending]:
+                future.result()
+
+        state = self.state.find_one_and_update(
+            {"_id": name},
+            {"$set": {"status": DONE, "finished_at": _now()}},
+            return_document=True
+        )
+        scanned = sum(r["scanned"] for r in state["ranges"])
+        updated = sum(r["updated"] for r in state["ranges"])
+        print(f"Migration {name} complete in {time.perf_counter() - start:.1f}s. Scanned {scanned} docs, updated {updated} docs.")
+        return state
+
+    def _next_pass(self, state: dict) -> dict:
+        """Start a pass of a finished migration over the documents added since."""
+        watermarks = [rng["watermark"] for rng in state["ranges"] if rng["watermark"] is not None]
+        start = max(watermarks) if watermarks else None
+        if isinstance(start, ObjectId):
+            start = ObjectId.from_datetime(start.generation_time - timedelta(seconds=MIGRATION_RERUN_OVERLAP))
+        print(f"Migration {self.migration.name} already done, scanning documents after {start}")
+        state = {
+            "_id": self.migration.name,
+            "status": RUNNING,
+            "ranges": [{"lower": None, "upper": None, "watermark": start, "scanned": 0, "updated": 0, "done": False}],
+            "started_at": _now(),
+        }
+        self.state.replace_one({"_id": self.migration.name}, state, upsert=True)
+        return state
+
+    def dry_run(self, write_rate: float = MIGRATION_WRITE_RATE) -> dict:
+        """
+        Count the documents the migration would touch without writing, and
+        estimate the run time from a sampled scan and the assumed write rate.
+        """
+        name = self.migration.name
+        matching = self.collection.count_documents(self.migration.filter)
+        start = time.perf_counter()
+        sample = list(self.collection.find(self.migration.filter, self.migration.projection).sort("_id", 1).limit(DRY_RUN_SAMPLE))
+        changed = sum(1 for doc in sample if self.migration.update(doc))
+        scan_seconds = time.perf_counter() - start
+
+        ratio = changed / len(sample) if sample else 0.0
+        estimated_updates = int(matching * ratio)
+        estimate = (scan_seconds / len(sample) * matching if sample else 0.0) + estimated_updates / write_rate
+        report = {
+            "migration": name,
+            "status": self.status(),
+            "matching": matching,
+            "sampled": len(sample),
+            "estimated_updates": estimated_updates,
+            "estimated_seconds": round(estimate, 1),
+        }
+        print(
+            f"[dry run] {name}: {matching} matching docs, ~{estimated_updates} to update, "
+            f"estimated {estimate:.1f}s (status: {report['status'] or 'not started'})"
+        )
+        return report
+
+
+def load_migrations(directory: str = os.path.dirname(os.path.abspath(__file__))) -> List[Migration]:
+    """All migrations in this directory (NNN_name.py files), in order."""
+    migrations = []
+    for filename in sorted(os.listdir(directory)):
+        if not (filename[:3].isdigit() and filename.endswith(".py")):
+            continue
+        spec = importlib.util.spec_from_file_location(f"migration_{filename[:-3]}", os.path.join(directory, filename))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        migrations.append(module.MIGRATION)
+    return migrations
+
+
+def main(migrations: Optional[List[Migration]] = None):
+    """Command line entry point shared by the runner and every migration file."""
+    parser = argparse.ArgumentParser(description="Run resumable data migrations.")
+    parser.add_argument("--dry-run", action="store_true", help="only report counts and the estimated time")
+    parser.add_argument("--workers", type=int, default=MIGRATION_WORKERS, help="_id ranges scanned in parallel")
+    parser.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE, help="documents per bulk write")
+    parser.add_argument("--reset", action="store_true", help="discard saved progress and start over")
+    args = parser.parse_args()
+
+    db = get_database()
+    if db is None:
+        return
+    for migration in migrations if migrations is not None else load_migrations():
+        runner = MigrationRunner(db, migration, batch_size=args.batch_size)
+        if args.dry_run:
+            runner.dry_run()
+        else:
+            print(f"Starting migration: {migration.name}")
+            runner.run(workers=args.workers, reset=args.reset)
+
+
+if __name__ == "__main__":
+    main()
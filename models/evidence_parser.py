@@ -0,0 +1,200 @@
+import re
+import json
+from dataclasses import dataclass, field
+from typing import Any, List, Optional
+from pydantic import ValidationError
+from models.recipe_context import Evidence, EvidenceQuery
+
+_FENCE = re.compile(r"```[a-zA-Z]*\s*")
+_CLOSERS = {"[": "]", "{": "}"}
+
+
+@dataclass
+class EvidenceParseResult:
+    """Outcome of parsing agent output into evidence."""
+    queries: List[EvidenceQuery] = field(default_factory=list)
+    # False when the JSON had to be repaired or invalid entries were dropped
+    complete: bool = True
+    dropped_groups: int = 0
+    dropped_items: int = 0
+
+
+def _strip_wrapping(text: str) -> str:
+    """Drop markdown fences and any prose before the first JSON value."""
+    text = _FENCE.sub("", text or "").strip()
+    starts = [i for i in (text.find("["), text.find("{")) if i >= 0]
+    return text[min(starts):] if starts else text
+
+
+def _remove_trailing_commas(text: str) -> str:
+    """Remove commas directly before a closing bracket (outside strings)."""
+    out = []
+    in_string = escaped = False
+    for ch in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "]}":
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+        out.append(ch)
+    return "".join(out)
+
+
+def _close_truncated(text: str) -> Optional[Any]:
+    """
+    Recover the longest prefix of truncated JSON that can be closed.
+
+    Every position right after a complete object or array is a candidate
+    cut; the latest cut whose open brackets can simply be closed wins.
+    """
+    stack: List[str] = []
+    cuts = []
+    in_string = escaped = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in _CLOSERS:
+            stack.append(_CLOSERS[ch])
+        elif ch in "]}" and stack:
+            stack.pop()
+            cuts.append((i + 1, "".join(reversed(stack))))
+
+    for end, closers in reversed(cuts):
+        try:
+            return json.loads(_remove_trailing_commas(text[:end].rstrip().rstrip(",") + closers))
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+def _load(text: str):
+    """Parse possibly malformed JSON; returns (value, repaired)."""
+    text = _strip_wrapping(text)
+    try:
+        return json.loads(text), False
+    except json.JSONDecodeError:
+        pass
+    try:
+        return json.loads(_remove_trailing_commas(text)), True
+    except json.JSONDecodeError:
+        return _close_truncated(text), True
+
+
+def parse_evidence(text: str) -> EvidenceParseResult:
+    """
+    Parse agent output into validated evidence, salvaging what it can.
+
+    Strips markdown fences and surrounding prose, closes truncated arrays
+    and objects, and validates every query group and evidence item on its
+    own, so one bad URL only drops that item instead of the whole result.
+    """
+    result = EvidenceParseResult()
+    data, repaired = _load(text)
+    result.complete = not repaired
+
+    if isinstance(data, dict):
+        # Either a single query group or an object wrapping the list
+        data = next((v for v in data.values() if isinstance(v, list)), None) if "query" not in data else [data]
+    if not isinstance(data, list):
+        result.complete = False
+        return result
+
+    for group in data:
+        _add_group(result, group)
+
+    if result.dropped_groups or result.dropped_items:
+        result.complete = False
+    return result
+
+
+def _add_group(result: EvidenceParseResult, group: Any) -> Optional[EvidenceQuery]:
+    """Validate one query group item by item and append it to the result."""
+    if not isinstance(group, dict) or not isinstance(group.get("query"), str):
+        result.dropped_groups += 1
+        return None
+    items = []
+    for item in group.get("evidence_items") or []:
+        try:
+            items.append(Evidence.model_validate(item))
+        except ValidationError:
+            result.dropped_items += 1
+    if not items:
+        result.dropped_groups += 1
+        return None
+    query = EvidenceQuery(query=group["query"], evidence_items=items)
+    result.queries.append(query)
+    return query
+
+
+class IncrementalEvidenceParser:
+    """
+    Extracts query groups from streamed agent output as soon as each
+    top-level object of the JSON list is complete.
+
+    Text before the opening bracket (prose, markdown fences) is ignored.
+    The final output is still parsed with parse_evidence; this only makes
+    the groups available early.
+    """
+
+    def __init__(self):
+        self.result = EvidenceParseResult()
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._current: Optional[List[str]] = None
+
+    def feed(self, chunk: str) -> List[EvidenceQuery]:
+        """Consume a chunk of output; returns the groups completed by it."""
+        completed = []
+        for ch in chunk:
+            if self._current is not None:
+                self._current.append(ch)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if self._depth == 0:
+                # Wait for the opening bracket of the list
+                if ch == "[":
+                    self._depth = 1
+                continue
+            if ch == '"':
+                self._in_string = True
+            elif ch in _CLOSERS:
+                self._depth += 1
+                if self._depth == 2 and ch == "{":
+                    self._current = [ch]
+            elif ch in "]}":
+                self._depth -= 1
+                if self._depth == 1 and self._current is not None:
+                    text, self._current = "".join(self._current), None
+                    try:
+                        group = json.loads(text)
+                    except json.JSONDecodeError:
+                        self.result.dropped_groups += 1
+                        continue
+                    query = _add_group(self.result, group)
+                    if query is not None:
+                        completed.append(query)
+        return completed
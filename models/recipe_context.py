@@ -12,9 +12,9 @@ class Lifestyle(str, Enum):
 class Evidence(BaseModel):
     notes: str = Field(..., description="Notes about the evidence")
     source_link: HttpUrl = Field(..., description="Source link of evidence")
-    link_status: bool = Field(..., description="True if link returned 200")
-    tfidf: float | None = Field(None, description="TF-IDF score (deprecated)")
-    contains_notes_in_content: bool | None = Field(None, description="Content validation (deprecated)")
+    link_status: bool | None = Field(..., description="True if link returned 200, None if it could not be checked")
+    tfidf: float | None = Field(None, description="Containment score of the notes in the retrieved content (0-1)")
+    contains_notes_in_content: bool | None = Field(None, description="True if the notes are grounded in the retrieved content")
 
 
 class EvidenceQuery(BaseModel):
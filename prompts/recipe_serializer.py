@@ -0,0 +1,157 @@
+import hashlib
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, List
+
+# Only the fields the serializer reads are fetched from MongoDB
+RECIPE_PROJECTION = {
+    "title": 1,
+    "type": 1,
+    "description": 1,
+    "prep_time": 1,
+    "cook_time": 1,
+    "cuisine_style": 1,
+    "ingredients": 1,
+    "preparation_steps": 1,
+    "nutrition": 1,
+    "allergens": 1,
+    "why_this_meal": 1,
+}
+
+RECIPE_QUERY_PREFIX = "Based on this recipe, please perform evidence collection.\n\n"
+
+NUTRITION_KEYS = ["calories", "protein", "carbs", "fat"]
+
+
+@dataclass(frozen=True)
+class SerializedRecipe:
+    """Agent input for one recipe."""
+    text: str
+    token_count: int
+    fingerprint: str
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # Encoding files unavailable (e.g. offline): fall back to an estimate
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Token count of text (cl100k_base, or ~4 characters per token without it)."""
+    encoding = _encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text))
+
+
+def _clean(value: Any) -> str:
+    """Deterministic single-line string for a field value ("" when empty)."""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return " ".join(str(value).split())
+
+
+def _clean_list(values: Any) -> List[str]:
+    if isinstance(values, str):
+        values = [values]
+    if not isinstance(values, list):
+        return []
+    return [v for v in (_clean(v) for v in values) if v]
+
+
+def serialize_recipe(meal: dict) -> SerializedRecipe:
+    """
+    Compact, deterministic agent input for a meal document.
+
+    Empty fields are dropped, ingredients and steps are plain lines
+    instead of dict reprs, and the same document always produces the same
+    bytes, so the fingerprint can be used as a cache key.
+    """
+    lines = []
+
+    def add(label: str, value: Any):
+        value = _clean(value)
+        if value:
+            lines.append(f"{label}: {value}")
+
+    add("Title", meal.get("title"))
+    add("Type", meal.get("type"))
+    add("Description", meal.get("description"))
+    times = [
+        f"{label} {_clean(meal.get(key))}"
+        for label, key in (("prep", "prep_time"), ("cook", "cook_time"))
+        if _clean(meal.get(key))
+    ]
+    if times:
+        lines.append(f"Time: {', '.join(times)}")
+    add("Cuisine", meal.get("cuisine_style"))
+
+    ingredients = []
+    for ing in meal.get("ingredients") or []:
+        if isinstance(ing, dict):
+            line = " ".join(p for p in (_clean(ing.get("portion")), _clean(ing.get("item"))) if p)
+        else:
+            line = _clean(ing)
+        if line:
+            ingredients.append(f"- {line}")
+    if ingredients:
+        lines.append("Ingredients:")
+        lines.extend(ingredients)
+
+    steps = []
+    for step in meal.get("preparation_steps") or []:
+        if isinstance(step, dict):
+            name, desc = _clean(step.get("step")), _clean(step.get("description"))
+            # Step numbers are implied by the list order
+            if name.isdigit():
+                name = ""
+            line = f"{name}: {desc}" if name and desc else (desc or name)
+        else:
+            line = _clean(step)
+        if line:
+            steps.append(f"{len(steps) + 1}. {line}")
+    if steps:
+        lines.append("Steps:")
+        lines.extend(steps)
+
+    nutrition = meal.get("nutrition") or {}
+    if isinstance(nutrition, dict):
+        facts = [f"{key} {_clean(nutrition.get(key))}" for key in NUTRITION_KEYS if _clean(nutrition.get(key))]
+        if facts:
+            lines.append(f"Nutrition: {', '.join(facts)}")
+
+    allergens = _clean_list(meal.get("allergens"))
+    if allergens:
+        lines.append(f"Allergens: {', '.join(allergens)}")
+    why = _clean_list(meal.get("why_this_meal"))
+    if why:
+        lines.append(f"Why: {', '.join(why)}")
+
+    text = RECIPE_QUERY_PREFIX + "\n".join(lines)
+    return SerializedRecipe(
+        text=text,
+        token_count=count_tokens(text),
+        fingerprint=hashlib.sha256(text.encode("utf-8")).hexdigest(),
+    )
+
+
+def with_collected_queries(text: str, queries: List[str]) -> str:
+    """
+    Agent input for a resumed run: tells the agent which evidence queries
+    an interrupted run already collected, so it only runs the rest.
+    """
+    queries = [q for q in (_clean(q) for q in queries) if q]
+    if not queries:
+        return text
+    listed = "\n".join(f"- {q}" for q in queries)
+    return (
+        f"{text}\n\nEvidence was already collected for these queries. Do not repeat them; "
+        f"collect and output only the remaining queries:\n{listed}"
+    )
@@ -0,0 +1,270 @@
+import os
+import math
+import time
+import signal
+import tempfile
+import multiprocessing
+from datetime import datetime, timezone
+from typing import List, Optional
+import redis
+from rq import Queue
+from dotenv import load_dotenv
+from extensions.metrics import metrics
+from extensions.streams import JobStream, JOB_BACKEND
+from worker import listen, start_worker, preload_jobs, WORKER_PRELOAD
+
+# Load env vars
+load_dotenv()
+
+# Pool bounds; SUPERVISOR_MAX_WORKERS=0 sizes the pool from cores and memory
+SUPERVISOR_MIN_WORKERS = int(os.getenv("SUPERVISOR_MIN_WORKERS", "1"))
+SUPERVISOR_MAX_WORKERS = int(os.getenv("SUPERVISOR_MAX_WORKERS", "0"))
+# Jobs spend most of their time waiting on the model and search APIs
+SUPERVISOR_WORKERS_PER_CORE = float(os.getenv("SUPERVISOR_WORKERS_PER_CORE", "2"))
+# Memory budget of one worker process and what is kept free for everything else
+WORKER_MEMORY_MB = int(os.getenv("WORKER_MEMORY_MB", "400"))
+SUPERVISOR_RESERVED_MEMORY_MB = int(os.getenv("SUPERVISOR_RESERVED_MEMORY_MB", "256"))
+# Queued jobs one worker is expected to absorb (raise it for WORKER_MODE=async)
+SUPERVISOR_JOBS_PER_WORKER = int(os.getenv("SUPERVISOR_JOBS_PER_WORKER", "10"))
+# Add a worker while the oldest queued job has waited longer than this (seconds)
+SUPERVISOR_MAX_JOB_AGE = float(os.getenv("SUPERVISOR_MAX_JOB_AGE", "60"))
+# Seconds between scaling decisions
+SUPERVISOR_INTERVAL = float(os.getenv("SUPERVISOR_INTERVAL", "5"))
+# Seconds the pool must be oversized before workers are stopped
+SUPERVISOR_SCALE_DOWN_DELAY = float(os.getenv("SUPERVISOR_SCALE_DOWN_DELAY", "120"))
+# Seconds workers get to finish their current job on shutdown before being killed
+SUPERVISOR_DRAIN_TIMEOUT = float(os.getenv("SUPERVISOR_DRAIN_TIMEOUT", "600"))
+# Worker starts (crash restarts and scale-ups) allowed per minute before backing off
+SUPERVISOR_MAX_RESTARTS_PER_MINUTE = int(os.getenv("SUPERVISOR_MAX_RESTARTS_PER_MINUTE", "10"))
+
+
+def available_cores() -> float:
+    """CPU cores this process may use (affinity and cgroup quota aware)."""
+    try:
+        cores = float(len(os.sched_getaffinity(0)))
+    except AttributeError:
+        cores = float(os.cpu_count() or 1)
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cores = min(cores, int(quota) / int(period))
+    except (OSError, ValueError):
+        pass
+    return max(cores, 1.0)
+
+
+def available_memory_mb() -> Optional[int]:
+    """Memory limit of the container (cgroup v2 or v1), else physical memory."""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # cgroup v1 reports "no limit" as a huge number
+        if value.isdigit() and int(value) < 1 << 50:
+            return int(value) // (1024 * 1024)
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def max_pool_size() -> int:
+    """Largest pool the machine can hold: bounded by cores and by memory."""
+    if SUPERVISOR_MAX_WORKERS > 0:
+        return SUPERVISOR_MAX_WORKERS
+    size = int(available_cores() * SUPERVISOR_WORKERS_PER_CORE)
+    memory = available_memory_mb()
+    if memory is not None:
+        size = min(size, (memory - SUPERVISOR_RESERVED_MEMORY_MB) // WORKER_MEMORY_MB)
+    return max(size, 1)
+
+
+def desired_workers(depth: int, oldest_age: float, current: int, min_workers: int, max_workers: int) -> int:
+    """
+    Pool size for the current backlog.
+
+    Args:
+        depth: Number of queued jobs.
+        oldest_age: Seconds the oldest queued job has been waiting.
+        current: Number of running workers.
+
+    Returns:
+        One worker per SUPERVISOR_JOBS_PER_WORKER queued jobs, plus one
+        more than now while jobs wait longer than SUPERVISOR_MAX_JOB_AGE,
+        clamped to [min_workers, max_workers].
+    """
+    desired = math.ceil(depth / SUPERVISOR_JOBS_PER_WORKER)
+    if depth and oldest_age > SUPERVISOR_MAX_JOB_AGE:
+        desired = max(desired, current + 1)
+    return max(min_workers, min(desired, max_workers))
+
+
+def queue_backlog(conn, queues: List[Queue]):
+    """Total queued jobs and the age in seconds of the oldest one."""
+    depth, oldest_age = 0, 0.0
+    now = datetime.now(timezone.utc)
+    for queue in queues:
+        depth += queue.count
+        job_ids = queue.get_job_ids(0, 1)
+        job = queue.fetch_job(job_ids[0]) if job_ids else None
+        if job is not None and job.enqueued_at is not None:
+            enqueued_at = job.enqueued_at
+            if enqueued_at.tzinfo is None:
+                enqueued_at = enqueued_at.replace(tzinfo=timezone.utc)
+            oldest_age = max(oldest_age, (now - enqueued_at).total_seconds())
+    return depth, oldest_age
+
+
+def _run_worker():
+    # Forked with the supervisor's handlers; the worker installs its own
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    # The supervisor serves the metrics of the whole pool
+    start_worker(serve_metrics=False)
+
+
+class Supervisor:
+    """
+    Runs a pool of worker processes and resizes it to the queue backlog.
+
+    Workers are forked from this process after the job code is preloaded,
+    so they share its memory and start in milliseconds. Crashed workers are
+    restarted; every start, restart or scale-up, counts against
+    SUPERVISOR_MAX_RESTARTS_PER_MINUTE so a crash loop cannot fork-bomb the
+    host. Scaling down and shutdown send SIGTERM, on which a worker
+    finishes its current job (RQ warm shutdown) or batch (async mode).
+    """
+
+    def __init__(self, conn, min_workers: int = SUPERVISOR_MIN_WORKERS, max_workers: Optional[int] = None):
+        self.conn = conn
+        self.queues = [Queue(name, connection=conn) for name in listen]
+        self.stream = JobStream(conn) if JOB_BACKEND == "streams" else None
+        self.max_workers = max_workers or max_pool_size()
+        self.min_workers = min(min_workers, self.max_workers)
+        self.context = multiprocessing.get_context("fork")
+        self.workers: List[multiprocessing.Process] = []
+        # Workers sent SIGTERM that are finishing their current job
+        self.stopping: List[multiprocessing.Process] = []
+        # Start times of the workers started within the last minute
+        self.starts: List[float] = []
+        self.oversized_since: Optional[float] = None
+        self.shutdown_requested = False
+
+    def _start_worker(self) -> bool:
+        """Start a worker unless the per-minute start budget is used up."""
+        now = time.monotonic()
+        self.starts = [t for t in self.starts if now - t < 60]
+        if len(self.starts) >= SUPERVISOR_MAX_RESTARTS_PER_MINUTE:
+            return False
+        self.starts.append(now)
+        process = self.context.Process(target=_run_worker, daemon=False)
+        process.start()
+        self.workers.append(process)
+        return True
+
+    def _stop_worker(self) -> None:
+        # Newest first: the oldest workers keep their warm caches
+        process = self.workers.pop()
+        process.terminate()
+        self.stopping.append(process)
+
+    def _reap(self) -> None:
+        """Restart workers that exited without being asked to."""
+        self.stopping = [p for p in self.stopping if p.is_alive()]
+        for process in [p for p in self.workers if not p.is_alive()]:
+            self.workers.remove(process)
+            print(f"Worker {process.pid} exited unexpectedly (exit code {process.exitcode})")
+
+        while len(self.workers) < self.min_workers:
+            if not self._start_worker():
+                print(f"Worker start limit reached, {len(self.workers)}/{self.min_workers} workers running")
+                break
+
+    def _scale(self) -> None:
+        if self.stream is not None:
+            depth, oldest_age = self.stream.backlog()
+        else:
+            depth, oldest_age = queue_backlog(self.conn, self.queues)
+        current = len(self.workers)
+        desired = desired_workers(depth, oldest_age, current, self.min_workers, self.max_workers)
+
+        if desired > current:
+            self.oversized_since = None
+            print(f"Scaling up {current} -> {desired} workers ({depth} queued, oldest {oldest_age:.0f}s)")
+            for _ in range(desired - current):
+                if not self._start_worker():
+                    print(f"Worker start limit reached, scaling up to {len(self.workers)} workers for now")
+                    break
+        elif desired < current:
+            # Only shrink once the backlog has stayed low for a while
+            now = time.monotonic()
+            self.oversized_since = self.oversized_since or now
+            if now - self.oversized_since >= SUPERVISOR_SCALE_DOWN_DELAY:
+                print(f"Scaling down {current} -> {desired} workers ({depth} queued)")
+                for _ in range(current - desired):
+                    self._stop_worker()
+                self.oversized_since = None
+        else:
+            self.oversized_since = None
+
+    def _request_shutdown(self, signum, frame) -> None:
+        self.shutdown_requested = True
+
+    def drain(self, timeout: float = SUPERVISOR_DRAIN_TIMEOUT) -> None:
+        """Stop every worker after its current job; kill what is left after timeout."""
+        while self.workers:
+            self._stop_worker()
+        print(f"Draining {len(self.stopping)} workers...")
+        deadline = time.monotonic() + timeout
+        for process in self.stopping:
+            process.join(max(deadline - time.monotonic(), 0))
+        for process in self.stopping:
+            if process.is_alive():
+                print(f"Killing worker {process.pid} after the drain timeout")
+                process.kill()
+                process.join()
+        self.stopping = []
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self._request_shutdown)
+        signal.signal(signal.SIGINT, self._request_shutdown)
+        print(f"Starting supervisor ({self.min_workers}-{self.max_workers} workers)...")
+
+        while not self.shutdown_requested:
+            try:
+                self._reap()
+                self._scale()
+            except redis.RedisError as e:
+                # Keep the current pool until Redis is reachable again
+                print(f"Could not read the queue backlog: {e}")
+            deadline = time.monotonic() + SUPERVISOR_INTERVAL
+            while not self.shutdown_requested and time.monotonic() < deadline:
+                time.sleep(0.2)
+
+        self.drain()
+        print("Supervisor stopped.")
+
+
+def start_supervisor():
+    REDIS_URL = os.getenv("REDIS_URL")
+    if not REDIS_URL:
+        print("Error: REDIS_URL not set in .env")
+        return
+
+    conn = redis.from_url(REDIS_URL)
+    if not metrics.path:
+        # Workers only report through the shared file, so supervising always needs one
+        metrics.path = os.path.join(tempfile.gettempdir(), f"recipe-metrics-{os.getpid()}.prom")
+        print(f"METRICS_FILE not set, workers report to {metrics.path}")
+    metrics.start_http_server()
+    if WORKER_PRELOAD:
+        # Forked workers inherit the loaded job code
+        preload_jobs()
+    Supervisor(conn).run()
+
+
+if __name__ == "__main__":
+    start_supervisor()
@@ -0,0 +1,41 @@
+import sys
+import os
+sys.path.append(os.getcwd())
+from models.evidence_parser import parse_evidence
+import traceback
+
+item = '{"notes": "Oats lower LDL", "source_link": "https://example.com/%d", "link_status": true}'
+group = '{"query": "q%d", "evidence_items": [%s, %s]}'
+valid = "[" + ", ".join(group % (g, item % (2 * g), item % (2 * g + 1)) for g in range(3)) + "]"
+
+try:
+    # Well-formed output parses as complete
+    result = parse_evidence(valid)
+    assert result.complete and len(result.queries) == 3
+
+    # Markdown fences and surrounding prose are stripped
+    result = parse_evidence("Here is the evidence:\n```json\n" + valid + "\n```")
+    assert [q.query for q in result.queries] == ["q0", "q1", "q2"]
+
+    # Truncated output keeps every complete group and item
+    result = parse_evidence(valid[:-60])
+    assert not result.complete
+    assert [len(q.evidence_items) for q in result.queries] == [2, 2, 1]
+
+    # Invalid URLs only drop their own item; empty groups are dropped
+    bad = valid.replace("https://example.com/1", "not a url").replace('"q2", "evidence_items": [', '"q2", "evidence_items": [], "x": [')
+    result = parse_evidence(bad)
+    assert [q.query for q in result.queries] == ["q0", "q1"]
+    assert result.dropped_items == 1 and result.dropped_groups == 1
+
+    # Trailing commas are tolerated
+    result = parse_evidence(valid[:-1] + ",]")
+    assert len(result.queries) == 3
+
+    # Nothing recoverable
+    assert parse_evidence("I could not find any evidence.").queries == []
+    print("Validation Successful")
+except Exception as e:
+    print("Validation Failed")
+    print(e)
+    traceback.print_exc()
@@ -0,0 +1,29 @@
+import sys
+import os
+sys.path.append(os.getcwd())
+from tools.query_optimizer import QueryOptimizer
+import traceback
+
+try:
+    optimizer = QueryOptimizer(max_terms=5)
+
+    # Word order and stopwords do not change the search
+    a, b = optimizer.optimize_batch(["is salmon good for diabetes", "diabetes and salmon"])
+    assert a is b and a.text == "diabetes salmon"
+
+    # Queries negating different terms are never collapsed
+    with_sugar, sugar_free = optimizer.optimize_batch(["diabetes dessert with sugar", "diabetes dessert sugar free"])
+    assert with_sugar.key != sugar_free.key
+    assert with_sugar.text == "dessert diabetes sugar" and "sugar free" in sugar_free.text
+    optimizer.remember(with_sugar)
+    assert optimizer.optimize_batch(["sugar free diabetes dessert"])[0].key == sugar_free.key
+
+    # Trimming keeps a negation together with the term it negates
+    query = optimizer.optimize("high protein breakfast eggs without dairy")
+    assert "without dairy" in query.text and len(query.terms) == 5, query
+
+    print("Validation Successful")
+except Exception as e:
+    print("Validation Failed")
+    print(e)
+    traceback.print_exc()
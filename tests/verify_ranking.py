@@ -0,0 +1,36 @@
+import sys
+import os
+sys.path.append(os.getcwd())
+import re
+import random
+from rank_bm25 import BM25Okapi
+from tools.ranking_tool import RankingTool
+import traceback
+
+WORDS = "salmon omega fish diabetes sugar blood low glycemic index protein fat healthy diet heart".split()
+
+
+def reference_rank(query, results, top_k):
+    tokenize = lambda text: re.sub(r'[^a-z0-9\s]', '', text.lower()).split()
+    corpus = [tokenize(r["content"]) for r in results]
+    scores = BM25Okapi(corpus).get_scores(tokenize(query))
+    return [r for r, _ in sorted(zip(results, scores), key=lambda x: x[1], reverse=True)[:top_k]]
+
+
+try:
+    random.seed(0)
+    ranker = RankingTool()
+    queries = [" ".join(random.choices(WORDS, k=3)) for _ in range(5)]
+    result_sets = [
+        [{"url": f"http://example.com/{i}", "content": " ".join(random.choices(WORDS, k=40))} for i in range(10)]
+        for _ in queries
+    ]
+    ranked = ranker.rank_batch(queries, result_sets, top_k=5)
+    for query, results, got in zip(queries, result_sets, ranked):
+        expected = reference_rank(query, results, 5)
+        assert [r["url"] for r in got] == [r["url"] for r in expected], query
+    print("Validation Successful")
+except Exception as e:
+    print("Validation Failed")
+    print(e)
+    traceback.print_exc()
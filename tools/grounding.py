@@ -0,0 +1,100 @@
+import os
+import re
+from typing import Dict, List, Optional
+import numpy as np
+from tools.urls import canonical_url
+
+# Character n-gram size and the containment score above which a note counts as grounded
+GROUNDING_NGRAM = int(os.getenv("GROUNDING_NGRAM", "5"))
+GROUNDING_THRESHOLD = float(os.getenv("GROUNDING_THRESHOLD", "0.6"))
+
+_NON_ALNUM = re.compile(r'[^a-z0-9]+')
+_EMPTY = np.zeros(0, dtype=np.int64)
+
+
+def _normalize(text: str) -> bytes:
+    return _NON_ALNUM.sub(' ', (text or '').lower()).strip().encode('ascii', 'ignore')
+
+
+def _shingles(text: str, n: int = GROUNDING_NGRAM) -> np.ndarray:
+    """Hashes of every character n-gram of the normalized text, computed with NumPy."""
+    data = np.frombuffer(_normalize(text), dtype=np.uint8).astype(np.int64)
+    if len(data) < n:
+        return np.unique(data.sum(keepdims=True)) if len(data) else _EMPTY
+    # Polynomial rolling hash over all windows at once (int64 overflow wraps)
+    weights = np.power(np.int64(257), np.arange(n - 1, -1, -1, dtype=np.int64))
+    windows = np.lib.stride_tricks.sliding_window_view(data, n)
+    return np.unique(windows @ weights)
+
+
+class GroundingVerifier:
+    """
+    Scores how much of each evidence note is contained in the page
+    content retrieved by the search tool during the same job.
+
+    The score is the fraction of the note's character n-grams that also
+    occur in the source document. Notes whose source link was not
+    retrieved score 0: content found on another page does not support a
+    claim attributed to this one.
+    """
+
+    def __init__(self, ngram: int = GROUNDING_NGRAM, threshold: float = GROUNDING_THRESHOLD):
+        self.ngram = ngram
+        self.threshold = threshold
+
+    def score(self, notes: List[str], sources: List[Optional[str]], documents: Dict[str, str]) -> np.ndarray:
+        """
+        Containment score in [0, 1] for every note (0 when its source was not retrieved).
+
+        Args:
+            notes: Evidence notes.
+            sources: Source link of each note.
+            documents: Retrieved content keyed by canonical URL.
+        """
+        scores = np.zeros(len(notes))
+        if not notes or not documents:
+            return scores
+
+        # Group notes by the document they are checked against
+        groups: Dict[str, List[int]] = {}
+        for i, source in enumerate(sources):
+            url = canonical_url(source) if source else ""
+            if url in documents:
+                groups.setdefault(url, []).append(i)
+
+        for url, note_ids in groups.items():
+            target = _shingles(documents[url], self.ngram)
+            note_shingles = [_shingles(notes[i], self.ngram) for i in note_ids]
+            lengths = np.array([len(s) for s in note_shingles])
+            if not lengths.sum():
+                continue
+            owner = np.repeat(np.arange(len(note_ids)), lengths)
+            hits = np.isin(np.concatenate(note_shingles), target, assume_unique=False)
+            matched = np.bincount(owner, weights=hits, minlength=len(note_ids))
+            scores[note_ids] = np.divide(matched, lengths, out=np.zeros(len(note_ids)), where=lengths > 0)
+
+        return scores
+
+
+def score_evidence_grounding(evidence: List[dict], documents: Dict[str, str]) -> List[dict]:
+    """
+    Fill tfidf (containment score) and contains_notes_in_content on every
+    evidence item of the parsed agent output, in place.
+    """
+    if not isinstance(evidence, list) or not documents:
+        return evidence
+    items = [
+        item
+        for group in evidence if isinstance(group, dict)
+        for item in (group.get("evidence_items") or []) if isinstance(item, dict)
+    ]
+    verifier = GroundingVerifier()
+    scores = verifier.score(
+        [str(item.get("notes") or "") for item in items],
+        [item.get("source_link") for item in items],
+        documents
+    )
+    for item, score in zip(items, scores):
+        item["tfidf"] = round(float(score), 4)
+        item["contains_notes_in_content"] = bool(score >= verifier.threshold)
+    return evidence
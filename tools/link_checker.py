@@ -0,0 +1,166 @@
+import os
+import time
+import asyncio
+import hashlib
+import weakref
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urlsplit
+import httpx
+
+# Per-request timeout, per-host connection limit (per process) and overall budget (seconds)
+LINK_CHECK_TIMEOUT = float(os.getenv("LINK_CHECK_TIMEOUT", "0.4"))
+LINK_CHECK_PER_HOST = int(os.getenv("LINK_CHECK_PER_HOST", "4"))
+# Default: time for a HEAD plus the GET fallback, kept under a second of job latency
+LINK_CHECK_BUDGET = float(os.getenv("LINK_CHECK_BUDGET", str(2 * LINK_CHECK_TIMEOUT)))
+# How long a verified status is reused across jobs and workers
+LINK_CHECK_TTL = int(os.getenv("LINK_CHECK_TTL", str(24 * 3600)))
+LINK_CHECK_FAILURE_TTL = int(os.getenv("LINK_CHECK_FAILURE_TTL", "3600"))
+
+# Status codes for which HEAD is unreliable and a GET is retried
+_HEAD_FALLBACK_STATUSES = {403, 404, 405, 406, 429, 500, 501, 503}
+
+# Per-host semaphores shared by every check of the process, per event loop
+# (asyncio primitives cannot be shared across loops, e.g. successive RQ jobs)
+_host_limits: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _host_limit(host: str, per_host: int) -> asyncio.Semaphore:
+    limits = _host_limits.setdefault(asyncio.get_running_loop(), {})
+    return limits.setdefault(host, asyncio.Semaphore(per_host))
+
+
+class LinkChecker:
+    """
+    Verifies that source links are reachable.
+
+    Sends a HEAD request and falls back to a streamed GET when servers
+    reject HEAD. Results are cached in Redis so popular sources are only
+    checked once per TTL across the whole fleet.
+    """
+
+    def __init__(
+        self,
+        http_client: httpx.AsyncClient,
+        redis_client=None,
+        timeout: float = LINK_CHECK_TIMEOUT,
+        per_host: int = LINK_CHECK_PER_HOST,
+        budget: float = LINK_CHECK_BUDGET,
+    ):
+        self.http_client = http_client
+        self.redis_client = redis_client
+        self.timeout = timeout
+        self.per_host = per_host
+        self.budget = budget
+
+    @staticmethod
+    def _cache_key(url: str) -> str:
+        return f"link_status:{hashlib.sha1(url.encode('utf-8')).hexdigest()}"
+
+    async def _check(self, url: str, deadline: float) -> Optional[bool]:
+        """
+        Status of one URL, or None when it is not known in time. Every
+        request is bounded by what is left of the budget, including the
+        time spent waiting for the host's connection limit.
+        """
+        host = urlsplit(url).netloc.lower()
+        async with _host_limit(host, self.per_host):
+            try:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                response = await self.http_client.head(url, timeout=min(self.timeout, remaining))
+                if response.status_code < 400:
+                    return True
+                if response.status_code not in _HEAD_FALLBACK_STATUSES:
+                    return False
+                # The GET fallback only gets what is left of the budget
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                # Only the status line is needed, never download the body
+                async with self.http_client.stream("GET", url, timeout=min(self.timeout, remaining)) as response:
+                    return response.status_code < 400
+            except httpx.TimeoutException:
+                # A sub-second timeout says nothing about the link; leave it unknown (and uncached)
+                return None
+            except Exception:
+                return False
+
+    async def check_many(self, urls: Iterable[str]) -> Dict[str, bool]:
+        """
+        Check every URL once.
+
+        Returns:
+            Mapping of URL to True if it answered with a non-error status.
+            URLs that could not be checked within the budget are absent.
+        """
+        unique = list(dict.fromkeys(u for u in urls if u))
+        if not unique:
+            return {}
+
+        statuses: Dict[str, bool] = {}
+        if self.redis_client is not None:
+            try:
+                cached = await self.redis_client.mget([self._cache_key(u) for u in unique])
+                for url, value in zip(unique, cached):
+                    if value is not None:
+                        statuses[url] = value in ("1", b"1")
+            except Exception as e:
+                print(f"Link status cache read failed: {e}")
+
+        pending = [u for u in unique if u not in statuses]
+        if pending:
+            deadline = time.monotonic() + self.budget
+            tasks = {asyncio.ensure_future(self._check(u, deadline)): u for u in pending}
+            done, not_done = await asyncio.wait(tasks, timeout=self.budget)
+            for task in not_done:
+                task.cancel()
+            # Links still pending when the budget ran out stay unknown (and uncached)
+            checked = {tasks[task]: task.result() for task in done if task.result() is not None}
+            statuses.update(checked)
+
+            if self.redis_client is not None and checked:
+                try:
+                    async with self.redis_client.pipeline(transaction=False) as pipe:
+                        for url, ok in checked.items():
+                            ttl = LINK_CHECK_TTL if ok else LINK_CHECK_FAILURE_TTL
+                            pipe.set(self._cache_key(url), "1" if ok else "0", ex=ttl)
+                        await pipe.execute()
+                except Exception as e:
+                    print(f"Link status cache write failed: {e}")
+
+        return statuses
+
+
+async def verify_evidence_links(
+    evidence: List[dict],
+    http_client: httpx.AsyncClient,
+    redis_client=None,
+) -> List[dict]:
+    """
+    Overwrite link_status on every evidence item with the verified status
+    (None when the link could not be checked in time).
+
+    Args:
+        evidence: Parsed agent output (list of query groups with evidence_items).
+        http_client: Shared async HTTP client.
+        redis_client: Async Redis client used for the status cache (optional).
+
+    Returns:
+        The same evidence list, updated in place.
+    """
+    if not isinstance(evidence, list):
+        return evidence
+    items = [
+        item
+        for group in evidence if isinstance(group, dict)
+        for item in (group.get("evidence_items") or []) if isinstance(item, dict)
+    ]
+    checker = LinkChecker(http_client, redis_client)
+    statuses = await checker.check_many(str(item.get("source_link") or "") for item in items)
+    for item in items:
+        link = str(item.get("source_link") or "")
+        item["link_status"] = statuses.get(link) if link else False
+    return evidence
@@ -0,0 +1,148 @@
+import os
+import re
+from typing import Any, Dict, List, Optional
+from tools.ranking_tool import RankingTool
+from tools.urls import canonical_url
+
+# Characters of page content returned per optimized_search call (0 returns full content)
+SEARCH_CONTEXT_CHAR_BUDGET = int(os.getenv("SEARCH_CONTEXT_CHAR_BUDGET", "6000"))
+# Target passage length; content is split on sentence boundaries up to this size
+PASSAGE_MAX_CHARS = int(os.getenv("PASSAGE_MAX_CHARS", "400"))
+# Passages kept per result, so one long page cannot take a query's whole share
+PASSAGES_PER_RESULT = int(os.getenv("PASSAGES_PER_RESULT", "2"))
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+PASSAGE_SEPARATOR = " ... "
+
+
+def split_passages(text: str, max_chars: int = PASSAGE_MAX_CHARS) -> List[str]:
+    """
+    Split text into passages of whole sentences, each at most max_chars
+    (sentences longer than that are cut between words).
+    """
+    passages: List[str] = []
+    current = ""
+    for sentence in _SENTENCE_END.split(" ".join((text or "").split())):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars + 1)
+            cut = cut if cut > 0 else max_chars
+            if current:
+                passages.append(current)
+                current = ""
+            passages.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        if not sentence:
+            continue
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            passages.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        passages.append(current)
+    return passages
+
+
+class PassageSelector:
+    """
+    Post-ranking stage that trims ranked search results to what the agent
+    needs to read.
+
+    URLs are de-duplicated across the whole batch (a page returned for
+    several queries is shown once, under the query where it ranks best),
+    each page is split into passages, passages are BM25-scored against
+    their query, and the best ones are taken round-robin across queries
+    until the character budget is spent. Results are returned with only
+    their selected passages as content; results with none are dropped.
+    """
+
+    def __init__(
+        self,
+        ranker: Optional[RankingTool] = None,
+        char_budget: int = SEARCH_CONTEXT_CHAR_BUDGET,
+        passage_chars: int = PASSAGE_MAX_CHARS,
+        passages_per_result: int = PASSAGES_PER_RESULT,
+    ):
+        self.ranker = ranker or RankingTool()
+        self.char_budget = char_budget
+        self.passage_chars = passage_chars
+        self.passages_per_result = passages_per_result
+
+    @staticmethod
+    def _dedupe(result_sets: List[List[Dict[str, Any]]]) -> List[List[Dict[str, Any]]]:
+        """Keep each URL once, visiting results rank by rank across queries."""
+        kept: List[List[Dict[str, Any]]] = [[] for _ in result_sets]
+        seen = set()
+        for rank in range(max((len(results) for results in result_sets), default=0)):
+            for i, results in enumerate(result_sets):
+                if rank >= len(results):
+                    continue
+                result = results[rank]
+                key = canonical_url(result.get("url")) or result.get("content") or result.get("title")
+                if key in seen:
+                    continue
+                seen.add(key)
+                kept[i].append(result)
+        return kept
+
+    def select(self, queries: List[str], result_sets: List[List[Dict[str, Any]]]) -> List[List[Dict[str, Any]]]:
+        """
+        Select the passages shown to the agent.
+
+        Args:
+            queries: One search query per result set.
+            result_sets: Ranked results of each query, best first.
+
+        Returns:
+            The de-duplicated results of every query, in rank order, with
+            their content reduced to the selected passages.
+        """
+        result_sets = self._dedupe(result_sets)
+        if self.char_budget <= 0:
+            return result_sets
+
+        # Passages of every result, scored against their query in one batch
+        passage_sets = []
+        for results in result_sets:
+            passage_sets.append([
+                (r, position, passage)
+                for r, result in enumerate(results)
+                for position, passage in enumerate(split_passages(result.get("content") or "", self.passage_chars))
+            ])
+        score_sets = self.ranker.score_batch(
+            queries, [[{"content": passage} for _, _, passage in passages] for passages in passage_sets]
+        )
+
+        # Best passages first; ties go to the better ranked result, then the earlier passage
+        candidates = [
+            sorted(range(len(passages)), key=lambda j: (-scores[j], passages[j][0], passages[j][1]))
+            for passages, scores in zip(passage_sets, score_sets)
+        ]
+
+        # Round-robin across queries so every query gets its share of the budget
+        chosen = [dict() for _ in result_sets]
+        taken = [[0] * len(results) for results in result_sets]
+        budget = self.char_budget
+        cursors = [0] * len(result_sets)
+        progress = True
+        while progress and budget > 0:
+            progress = False
+            for i, order in enumerate(candidates):
+                while cursors[i] < len(order):
+                    r, position, passage = passage_sets[i][order[cursors[i]]]
+                    cursors[i] += 1
+                    if taken[i][r] >= self.passages_per_result or len(passage) > budget:
+                        continue
+                    chosen[i].setdefault(r, []).append((position, passage))
+                    taken[i][r] += 1
+                    budget -= len(passage)
+                    progress = True
+                    break
+
+        selected = []
+        for results, passages_by_result in zip(result_sets, chosen):
+            selected.append([
+                {**results[r], "content": PASSAGE_SEPARATOR.join(passage for _, passage in sorted(passages_by_result[r]))}
+                for r in sorted(passages_by_result)
+            ])
+        return selected
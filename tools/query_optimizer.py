@@ -0,0 +1,285 @@
+import os
+import re
+import math
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+# Keywords kept per query
+QUERY_MAX_TERMS = int(os.getenv("QUERY_MAX_TERMS", "5"))
+# Token-set (Jaccard) similarity from which two queries are the same search
+QUERY_SIMILARITY_THRESHOLD = float(os.getenv("QUERY_SIMILARITY_THRESHOLD", "0.75"))
+# Recently searched queries remembered per process for near-duplicate matching
+QUERY_RECENT_MAX_ENTRIES = int(os.getenv("QUERY_RECENT_MAX_ENTRIES", "4096"))
+# Seconds between reloads of the term statistics shared by every worker
+QUERY_STATS_REFRESH_SECONDS = float(os.getenv("QUERY_STATS_REFRESH_SECONDS", "300"))
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+# Function words, question words and filler that never change what a search finds
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "but", "if", "of", "for", "with", "to", "in", "on", "at",
+    "by", "from", "about", "as", "into", "than", "then", "vs", "versus", "per", "via",
+    "is", "are", "was", "were", "be", "been", "being", "am", "do", "does", "did", "doing", "have",
+    "has", "had", "can", "could", "should", "would", "will", "may", "might", "must", "shall",
+    "what", "which", "who", "whom", "whose", "how", "why", "when", "where", "whether",
+    "it", "its", "it's", "this", "that", "these", "those", "there", "their", "they", "them",
+    "i", "me", "my", "we", "our", "you", "your", "he", "she", "his", "her", "one", "ones",
+    "so", "too", "very", "really", "just", "also", "any", "some", "much", "many",
+    "more", "most", "other", "such", "own", "same", "all", "each", "both",
+    "good", "bad", "best", "people", "person", "someone", "anyone", "thing", "things",
+    "actually", "eat", "eating", "ok", "okay", "safe",
+}
+# Words that invert what a query asks for, before ("without sugar") or after ("sugar free")
+# the keyword they negate; the pair is one term, never dropped whatever its frequency
+PREFIX_NEGATIONS = {"no", "not", "without", "non", "nor", "never"}
+POSTFIX_NEGATIONS = {"free"}
+# Stem prefix of a negated term
+NEGATED = "!"
+
+
+def _stem(word: str) -> str:
+    """Light plural folding, so "apples" and "apple" match."""
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def query_terms(query: str) -> List[Tuple[str, str]]:
+    """
+    (stem, word) pairs of the distinct keywords in a query, in order.
+
+    A negation and the keyword it applies to make one term, whose stem is
+    the keyword's prefixed with NEGATED and whose word is the phrase
+    ("without dairy"). Stopwords are dropped; when a query has nothing
+    else, its words are kept as they are.
+    """
+    words = _TOKEN.findall(query.lower())
+    units: List[Tuple[str, str]] = []
+    negation, previous_keyword = None, False
+    for word in words:
+        if word in PREFIX_NEGATIONS:
+            negation, previous_keyword = word, False
+        elif word in POSTFIX_NEGATIONS and previous_keyword and not units[-1][0].startswith(NEGATED):
+            stem, phrase = units.pop()
+            units.append((NEGATED + stem, f"{phrase} {word}"))
+            previous_keyword = False
+        elif word in STOPWORDS:
+            previous_keyword = False
+        elif negation is not None:
+            units.append((NEGATED + _stem(word), f"{negation} {word}"))
+            negation, previous_keyword = None, False
+        else:
+            units.append((_stem(word), word))
+            previous_keyword = True
+    if negation is not None:
+        units.append((negation, negation))
+    if not units:
+        units = [(_stem(word), word) for word in words]
+
+    terms, seen = [], set()
+    for stem, word in units:
+        if stem not in seen:
+            seen.add(stem)
+            terms.append((stem, word))
+    return terms
+
+
+def negated_terms(terms: FrozenSet[str]) -> FrozenSet[str]:
+    return frozenset(stem for stem in terms if stem.startswith(NEGATED))
+
+
+def similar(a: FrozenSet[str], b: FrozenSet[str], threshold: float) -> bool:
+    """Near-duplicate keyword sets: similar enough, and negating exactly the same terms."""
+    return jaccard(a, b) >= threshold and negated_terms(a) == negated_terms(b)
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+@dataclass(frozen=True)
+class OptimizedQuery:
+    """A normalized query: the text sent to the search API and its canonical key."""
+    text: str
+    key: str
+    terms: FrozenSet[str]
+
+
+class QueryTermStats:
+    """
+    Document frequencies of terms across past queries.
+
+    Counts are kept locally and shared by every worker through a Redis
+    hash: new observations are flushed and the shared counts reloaded
+    (every QUERY_STATS_REFRESH_SECONDS) by `sync`. Without Redis, the
+    statistics of this process are used.
+    """
+
+    def __init__(self, namespace: str = "query_terms"):
+        self.df_key = f"{namespace}:df"
+        self.count_key = f"{namespace}:count"
+        self.queries = 0
+        self.df: Counter = Counter()
+        self._pending: Counter = Counter()
+        self._pending_queries = 0
+        self._loaded_at: Optional[float] = None
+
+    def weight(self, stem: str) -> float:
+        """Inverse document frequency: terms most past queries contain weigh least."""
+        return math.log((1 + self.queries) / (1 + self.df[stem])) + 1
+
+    def observe(self, stems: Set[str]) -> None:
+        self.queries += 1
+        self._pending_queries += 1
+        for stem in stems:
+            self.df[stem] += 1
+            self._pending[stem] += 1
+
+    async def sync(self, redis_client) -> None:
+        """Flush new observations to Redis and reload the shared counts when due."""
+        if redis_client is None:
+            return
+        reload = self._loaded_at is None or time.monotonic() - self._loaded_at >= QUERY_STATS_REFRESH_SECONDS
+        if not self._pending_queries and not reload:
+            return
+        pending, pending_queries = self._pending, self._pending_queries
+        self._pending, self._pending_queries = Counter(), 0
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for stem, count in pending.items():
+                    pipe.hincrby(self.df_key, stem, count)
+                if pending_queries:
+                    pipe.incrby(self.count_key, pending_queries)
+                if reload:
+                    pipe.get(self.count_key)
+                    pipe.hgetall(self.df_key)
+                replies = await pipe.execute()
+        except Exception as e:
+            print(f"Query term statistics sync failed: {e}")
+            return
+        if reload:
+            count, df = replies[-2:]
+            self.queries = int(count or 0)
+            self.df = Counter({
+                (k.decode() if isinstance(k, bytes) else k): int(v) for k, v in df.items()
+            })
+            self._loaded_at = time.monotonic()
+
+
+class RecentQueries:
+    """
+    Bounded LRU of recently searched queries with an inverted index from
+    term to query, for finding a near-duplicate of a new query.
+    """
+
+    def __init__(self, max_entries: int = QUERY_RECENT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._queries: "OrderedDict[str, OptimizedQuery]" = OrderedDict()
+        self._postings: Dict[str, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._queries)
+
+    def add(self, query: OptimizedQuery) -> None:
+        if query.key in self._queries:
+            self._queries.move_to_end(query.key)
+            return
+        self._queries[query.key] = query
+        for stem in query.terms:
+            self._postings.setdefault(stem, set()).add(query.key)
+        while len(self._queries) > self.max_entries:
+            _, old = self._queries.popitem(last=False)
+            for stem in old.terms:
+                keys = self._postings.get(stem)
+                if keys is not None:
+                    keys.discard(old.key)
+                    if not keys:
+                        del self._postings[stem]
+
+    def match(self, terms: FrozenSet[str], threshold: float) -> Optional[OptimizedQuery]:
+        """Most similar remembered query with a token-set similarity of at least threshold."""
+        candidates = set()
+        for stem in terms:
+            candidates.update(self._postings.get(stem, ()))
+        best, best_score = None, threshold
+        for key in candidates:
+            query = self._queries[key]
+            score = jaccard(terms, query.terms)
+            if score >= best_score and similar(terms, query.terms, threshold):
+                best, best_score = query, score
+        if best is not None:
+            self._queries.move_to_end(best.key)
+        return best
+
+
+class QueryOptimizer:
+    """
+    Normalizes search queries so equivalent searches share a cache entry.
+
+    Stopwords are removed, the QUERY_MAX_TERMS most salient keywords are
+    kept (negated terms first, then by inverse frequency across past
+    queries, earlier words first on ties), and their order is canonicalized.
+    Queries whose keyword sets are near-duplicates of one earlier in the
+    batch, or of a recently searched one, are replaced by it; queries that
+    negate different terms never are.
+    """
+
+    def __init__(self, max_terms: int = QUERY_MAX_TERMS, threshold: float = QUERY_SIMILARITY_THRESHOLD):
+        self.max_terms = max_terms
+        self.threshold = threshold
+        self.stats = QueryTermStats()
+        self.recent = RecentQueries()
+        self.collapsed = 0
+
+    def optimize(self, query: str) -> OptimizedQuery:
+        terms = query_terms(query)
+        if len(terms) > self.max_terms:
+            ranked = sorted(
+                range(len(terms)),
+                key=lambda i: (not terms[i][0].startswith(NEGATED), -self.stats.weight(terms[i][0]), i),
+            )
+            terms = [terms[i] for i in sorted(ranked[:self.max_terms])]
+        if not terms:
+            text = query.strip()
+            return OptimizedQuery(text, text.lower(), frozenset())
+        # Canonical order: the same keywords make the same query whatever their order
+        terms = sorted(terms)
+        return OptimizedQuery(
+            " ".join(word for _, word in terms),
+            " ".join(stem for stem, _ in terms),
+            frozenset(stem for stem, _ in terms),
+        )
+
+    def optimize_batch(self, queries: List[str]) -> List[OptimizedQuery]:
+        """
+        Optimize a batch of queries and collapse near-duplicates.
+
+        Returns:
+            One query per input; near-duplicates are the same object.
+        """
+        optimized = []
+        batch: List[OptimizedQuery] = []
+        for query in queries:
+            candidate = self.optimize(query)
+            self.stats.observe(set(candidate.terms))
+            match = next((q for q in batch if q.key == candidate.key), None)
+            if match is None and candidate.terms:
+                matches = [q for q in batch if similar(candidate.terms, q.terms, self.threshold)]
+                match = max(matches, key=lambda q: jaccard(candidate.terms, q.terms), default=None)
+                match = match or self.recent.match(candidate.terms, self.threshold)
+            if match is not None:
+                if match.key != candidate.key:
+                    self.collapsed += 1
+                candidate = match
+            if candidate not in batch:
+                batch.append(candidate)
+            optimized.append(candidate)
+        return optimized
+
+    def remember(self, query: OptimizedQuery) -> None:
+        """Record a query whose results are now cached."""
+        if query.terms:
+            self.recent.add(query)
@@ -1,56 +1,188 @@
 from typing import List, Dict, Any
-from rank_bm25 import BM25Okapi
 import re
+import numpy as np
+from extensions.metrics import metrics, RANKING_SECONDS
+
+_NON_ALNUM = re.compile(r'[^a-z0-9\s]')
+
+
+def tokenize(text: str) -> List[str]:
+    """Simple tokenization: lowercase and remove non-alphanumeric."""
+    text = text.lower()
+    # Keep only alphanumeric
+    text = _NON_ALNUM.sub('', text)
+    return text.split()
+
 
 class RankingTool:
     """Tool for ranking documents using BM25."""
-    
+
+    # Same parameters as rank_bm25.BM25Okapi
+    k1 = 1.5
+    b = 0.75
+    epsilon = 0.25
+
     def __init__(self):
         pass
-        
+
     def _tokenize(self, text: str) -> List[str]:
-        """Simple tokenization: lowercase and remove non-alphanumeric."""
-        text = text.lower()
-        # Keep only alphanumeric
-        text = re.sub(r'[^a-z0-9\s]', '', text)
-        return text.split()
-    
+        return tokenize(text)
+
+    @staticmethod
+    def _document_text(result: Dict[str, Any]) -> str:
+        # Use content if available, otherwise title + url
+        return result.get("content") or (result.get("title") or "") + " " + (result.get("url") or "")
+
+    def _top_k(self, scores: np.ndarray, top_k: int) -> np.ndarray:
+        """
+        Indices of the top_k scores, highest first.
+        Ties keep their original order, like a stable sort would.
+        """
+        n = len(scores)
+        if top_k >= n:
+            return np.lexsort((np.arange(n), -scores))
+        # argpartition finds the k-th best score in O(n), then only the
+        # candidates at or above it are sorted
+        threshold = scores[np.argpartition(-scores, top_k - 1)[top_k - 1]]
+        above = np.flatnonzero(scores > threshold)
+        ties = np.flatnonzero(scores == threshold)[:top_k - len(above)]
+        candidates = np.concatenate([above, ties])
+        return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+    @staticmethod
+    def _term_ids(vocab: np.ndarray, terms: List[str]) -> List[int]:
+        """Column of each term in the hashed vocabulary, -1 if absent."""
+        if not terms or not len(vocab):
+            return [-1] * len(terms)
+        hashes = np.fromiter(map(hash, terms), dtype=np.int64, count=len(terms))
+        pos = np.minimum(np.searchsorted(vocab, hashes), len(vocab) - 1)
+        return np.where(vocab[pos] == hashes, pos, -1).tolist()
+
+    def rank_batch(
+        self,
+        queries: List[str],
+        result_sets: List[List[Dict[str, Any]]],
+        top_k: int = 5
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Rank several result sets, each against its own query, in one pass.
+
+        Every distinct document is tokenized once into a shared sparse
+        term matrix; BM25 statistics are then computed per result set so
+        the scores match a separate BM25Okapi per query.
+
+        Args:
+            queries: One search query per result set.
+            result_sets: Lists of search result dictionaries.
+            top_k: Number of top results to return per query.
+
+        Returns:
+            The top_k ranked results for every query, in input order.
+        """
+        with metrics.timer(RANKING_SECONDS):
+            return self._rank_batch(queries, result_sets, top_k)
+
+    def score_batch(self, queries: List[str], result_sets: List[List[Dict[str, Any]]]) -> List[np.ndarray]:
+        """
+        BM25 score of every result against its own query, batched like rank_batch.
+
+        Returns:
+            One array of scores per result set, in result order.
+        """
+        # Tokenize every distinct document once
+        doc_index: Dict[str, int] = {}
+        tokens: List[str] = []
+        doc_lengths: List[int] = []
+        set_docs = []
+        for results in result_sets:
+            rows = []
+            for r in results:
+                text = self._document_text(r)
+                row = doc_index.get(text)
+                if row is None:
+                    row = doc_index[text] = len(doc_index)
+                    doc_tokens = self._tokenize(text)
+                    tokens.extend(doc_tokens)
+                    doc_lengths.append(len(doc_tokens))
+                rows.append(row)
+            set_docs.append(np.asarray(rows, dtype=np.int64))
+
+        if not doc_index:
+            return [np.zeros(0) for _ in result_sets]
+
+        # Shared vocabulary and CSR term matrix over all distinct documents:
+        # one sort over (doc, term) keys yields the rows, columns and counts
+        n_docs = len(doc_index)
+        # Terms are identified by their (64-bit) string hash
+        vocab, token_ids = np.unique(
+            np.fromiter(map(hash, tokens), dtype=np.int64, count=len(tokens)), return_inverse=True
+        )
+        n_terms = max(len(vocab), 1)
+        token_docs = np.repeat(np.arange(n_docs), doc_lengths)
+        keys, counts = np.unique(token_docs * n_terms + token_ids, return_counts=True)
+        indices = keys % n_terms
+        counts = counts.astype(np.float64)
+        row_lengths = np.bincount(keys // n_terms, minlength=n_docs)
+        indptr = np.concatenate([[0], np.cumsum(row_lengths)])
+        doc_len = np.asarray(doc_lengths, dtype=np.float64)
+
+        score_sets = []
+        for query, results, rows in zip(queries, result_sets, set_docs):
+            if not results:
+                score_sets.append(np.zeros(0))
+                continue
+
+            # Rows of this result set (duplicates count twice, as in BM25Okapi)
+            starts, lengths = indptr[rows], row_lengths[rows]
+            offsets = np.cumsum(lengths) - lengths
+            flat = np.arange(lengths.sum()) - np.repeat(offsets - starts, lengths)
+            row_of = np.repeat(np.arange(len(rows)), lengths)
+            term_of = indices[flat]
+
+            corpus_size = len(rows)
+            dl = doc_len[rows]
+            avgdl = dl.sum() / corpus_size
+
+            # Document frequencies and IDF over every term of this result set
+            set_terms, df = np.unique(term_of, return_counts=True)
+            idf = np.log(corpus_size - df + 0.5) - np.log(df + 0.5)
+            eps = self.epsilon * (idf.sum() / len(idf)) if len(idf) else 0.0
+            idf[idf < 0] = eps
+
+            # Dense (docs x query terms) frequency matrix for just the query terms
+            term_idf = dict(zip(set_terms.tolist(), idf.tolist()))
+            query_ids = self._term_ids(vocab, self._tokenize(query))
+            scores = np.zeros(corpus_size)
+            if query_ids and avgdl > 0:
+                tf = np.zeros((corpus_size, len(query_ids)))
+                for col, term_id in enumerate(query_ids):
+                    mask = term_of == term_id
+                    tf[row_of[mask], col] = counts[flat[mask]]
+                q_idf = np.array([term_idf.get(term_id, 0.0) for term_id in query_ids])
+                norm = self.k1 * (1 - self.b + self.b * dl / avgdl)
+                scores = (tf * (self.k1 + 1) / (tf + norm[:, None])) @ q_idf
+            score_sets.append(scores)
+
+        return score_sets
+
+    def _rank_batch(self, queries, result_sets, top_k):
+        return [
+            [results[i] for i in self._top_k(scores, top_k)]
+            for results, scores in zip(result_sets, self.score_batch(queries, result_sets))
+        ]
+
     def rank_results(self, query: str, results: List[Dict[str, Any]], top_k: int = 5) -> List[Dict[str, Any]]:
         """
         Rank search results using BM25.
-        
+
         Args:
             query: The search query.
             results: List of search result dictionaries. Must contain 'content' or 'snippet'.
             top_k: Number of top results to return.
-            
+
         Returns:
             List of top_k ranked results.
         """
         if not results:
             return []
-            
-        # Prepare corpus
-        # Use content if available, otherwise title + url
-        corpus = []
-        for r in results:
-            content = r.get("content") or r.get("title", "") + " " + r.get("url", "")
-            corpus.append(self._tokenize(content))
-            
-        # Tokenize query
-        tokenized_query = self._tokenize(query)
-        
-        # Initialize BM25
-        bm25 = BM25Okapi(corpus)
-        
-        # Get scores
-        scores = bm25.get_scores(tokenized_query)
-        
-        # Zip scores with results
-        scored_results = list(zip(results, scores))
-        
-        # Sort by score descending
-        scored_results.sort(key=lambda x: x[1], reverse=True)
-        
-        # Return top_k results
-        return [r[0] for r in scored_results[:top_k]]
+        return self.rank_batch([query], [results], top_k=top_k)[0]
@@ -0,0 +1,174 @@
+import os
+import time
+import json
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# In-process tier size and TTLs for cached search results
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "2048"))
+SEARCH_CACHE_LOCAL_TTL = int(os.getenv("SEARCH_CACHE_LOCAL_TTL", "3600"))
+SEARCH_CACHE_SHARED_TTL = int(os.getenv("SEARCH_CACHE_SHARED_TTL", str(7 * 24 * 3600)))
+
+
+class LRUCache:
+    """Size-bounded in-process LRU with per-entry expiry."""
+
+    def __init__(self, max_entries: int = SEARCH_CACHE_MAX_ENTRIES, ttl: int = SEARCH_CACHE_LOCAL_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictions = 0
+        self._data: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+
+class SearchResultCache:
+    """
+    Two-tier cache for ranked search results.
+
+    Tier 1 is an in-process LRU. Tier 2 is Redis, shared by every worker,
+    with a TTL so stale results age out. Concurrent misses for the same key
+    inside a process are coalesced so only one search is issued.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = SEARCH_CACHE_MAX_ENTRIES,
+        local_ttl: int = SEARCH_CACHE_LOCAL_TTL,
+        shared_ttl: int = SEARCH_CACHE_SHARED_TTL,
+        namespace: str = "search_cache",
+    ):
+        self.local = LRUCache(max_entries, local_ttl)
+        self.shared_ttl = shared_ttl
+        self.namespace = namespace
+        self.hits_local = 0
+        self.hits_shared = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def _shared_key(self, key: str) -> str:
+        return f"{self.namespace}:{hashlib.sha1(key.encode('utf-8')).hexdigest()}"
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss/eviction counters for this process."""
+        return {
+            "hits_local": self.hits_local,
+            "hits_shared": self.hits_shared,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.local.evictions,
+            "local_entries": len(self.local),
+        }
+
+    async def _get_shared(self, redis_client, keys: List[str]) -> Dict[str, Any]:
+        try:
+            raw = await redis_client.mget([self._shared_key(k) for k in keys])
+        except Exception as e:
+            print(f"Search cache read failed: {e}")
+            return {}
+        return {k: json.loads(v) for k, v in zip(keys, raw) if v is not None}
+
+    async def _set_shared(self, redis_client, values: Dict[str, Any]) -> None:
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for k, v in values.items():
+                    pipe.set(self._shared_key(k), json.dumps(v), ex=self.shared_ttl)
+                await pipe.execute()
+        except Exception as e:
+            print(f"Search cache write failed: {e}")
+
+    async def get_or_fetch(
+        self,
+        keys: List[str],
+        fetch: Callable[[List[str]], Awaitable[Dict[str, Any]]],
+        redis_client=None,
+        cacheable: Callable[[Any], bool] = lambda value: True,
+    ) -> Dict[str, Any]:
+        """
+        Resolve keys from the local tier, then Redis, then fetch().
+
+        Args:
+            keys: Unique cache keys to resolve.
+            fetch: Coroutine called with the keys missing from both tiers.
+            redis_client: Async Redis client for the shared tier (optional).
+            cacheable: Predicate deciding whether a fetched value is stored.
+
+        Returns:
+            Mapping of key to value; keys that could not be resolved are absent.
+        """
+        found: Dict[str, Any] = {}
+        missing = []
+        for key in keys:
+            value = self.local.get(key)
+            if value is not None:
+                found[key] = value
+                self.hits_local += 1
+            else:
+                missing.append(key)
+
+        if missing and redis_client is not None:
+            shared = await self._get_shared(redis_client, missing)
+            for key, value in shared.items():
+                found[key] = value
+                self.local.set(key, value)
+            self.hits_shared += len(shared)
+            missing = [key for key in missing if key not in shared]
+
+        # Single-flight: only one fetch per key is in progress at a time
+        waiting: Dict[str, asyncio.Future] = {}
+        owned = []
+        loop = asyncio.get_running_loop()
+        for key in missing:
+            future = self._inflight.get(key)
+            if future is not None and not future.done():
+                waiting[key] = future
+                self.coalesced += 1
+            else:
+                self._inflight[key] = loop.create_future()
+                owned.append(key)
+        self.misses += len(owned)
+
+        if owned:
+            fetched: Dict[str, Any] = {}
+            try:
+                fetched = await fetch(owned)
+                to_store = {k: v for k, v in fetched.items() if cacheable(v)}
+                for key, value in to_store.items():
+                    self.local.set(key, value)
+                if redis_client is not None and to_store:
+                    await self._set_shared(redis_client, to_store)
+                found.update(fetched)
+            finally:
+                for key in owned:
+                    future = self._inflight.pop(key)
+                    if not future.done():
+                        future.set_result(fetched.get(key))
+
+        for key, future in waiting.items():
+            value = await future
+            if value is not None:
+                found[key] = value
+
+        return found
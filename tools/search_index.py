@@ -0,0 +1,361 @@
+import os
+import json
+import time
+import mmap
+import fcntl
+import shutil
+import hashlib
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from tools.ranking_tool import RankingTool, tokenize
+from tools.urls import canonical_url
+
+SEARCH_INDEX_ENABLED = os.getenv("SEARCH_INDEX_ENABLED", "true").lower() in ("1", "true", "yes")
+# Directory of the on-disk index, shared by every worker on the machine
+SEARCH_INDEX_DIR = os.getenv(
+    "SEARCH_INDEX_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "search_index")
+)
+# Local results needed to skip the live search, and the score each must reach
+# (1.0 is about an average-length page containing every query term once)
+SEARCH_INDEX_MIN_RESULTS = int(os.getenv("SEARCH_INDEX_MIN_RESULTS", "5"))
+SEARCH_INDEX_MIN_SCORE = float(os.getenv("SEARCH_INDEX_MIN_SCORE", "0.75"))
+# Documents fetched longer ago than this are not served (and dropped on compaction)
+SEARCH_INDEX_MAX_AGE_DAYS = float(os.getenv("SEARCH_INDEX_MAX_AGE_DAYS", "30"))
+# Write a new segment once this many documents are buffered, or when the oldest is this old
+SEARCH_INDEX_FLUSH_DOCS = int(os.getenv("SEARCH_INDEX_FLUSH_DOCS", "200"))
+SEARCH_INDEX_FLUSH_SECONDS = float(os.getenv("SEARCH_INDEX_FLUSH_SECONDS", "60"))
+# Segments are merged into one above this count
+SEARCH_INDEX_MAX_SEGMENTS = int(os.getenv("SEARCH_INDEX_MAX_SEGMENTS", "8"))
+
+MANIFEST = "manifest.json"
+_ARRAYS = ("terms", "offsets", "post_docs", "post_tf", "doc_len", "fetched_at", "doc_offsets")
+
+
+def _term_hash(term: str) -> int:
+    """Stable 64-bit term id (the built-in hash() differs between processes)."""
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+
+def _index_text(doc: Dict[str, Any]) -> str:
+    return f"{doc.get('title') or ''} {doc.get('content') or ''}"
+
+
+def _doc_key(doc: Dict[str, Any]) -> str:
+    """Identity of a page: its canonical URL, or its content when it has none."""
+    return canonical_url(doc.get("url")) or doc.get("content")
+
+
+class _Segment:
+    """One immutable segment, memory-mapped read-only."""
+
+    def __init__(self, path: str):
+        self.path = path
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in _ARRAYS}
+        self.terms = arrays["terms"]
+        self.offsets = arrays["offsets"]
+        self.post_docs = arrays["post_docs"]
+        self.post_tf = arrays["post_tf"]
+        self.doc_len = arrays["doc_len"]
+        self.fetched_at = arrays["fetched_at"]
+        self.doc_offsets = arrays["doc_offsets"]
+        with open(os.path.join(path, "docs.bin"), "rb") as f:
+            self._docs = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if os.path.exists(os.path.join(path, "url_hash.npy")):
+            self.url_hash = np.load(os.path.join(path, "url_hash.npy"), mmap_mode="r")
+        else:
+            # Segments written before URL ids were stored
+            self.url_hash = np.fromiter(
+                (_term_hash(_doc_key(doc)) for doc in self.documents()), dtype=np.int64, count=len(self.doc_len)
+            )
+        self.total_len = int(self.doc_len.sum())
+
+    def __len__(self) -> int:
+        return len(self.doc_len)
+
+    def postings(self, hashes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Start and end of the postings of every term (equal when absent)."""
+        if not len(self.terms):
+            empty = np.zeros(len(hashes), dtype=np.int64)
+            return empty, empty
+        pos = np.minimum(np.searchsorted(self.terms, hashes), len(self.terms) - 1)
+        found = self.terms[pos] == hashes
+        starts = np.where(found, self.offsets[pos], 0)
+        ends = np.where(found, self.offsets[pos + 1], 0)
+        return starts, ends
+
+    def document(self, i: int) -> Dict[str, Any]:
+        return json.loads(self._docs[int(self.doc_offsets[i]):int(self.doc_offsets[i + 1])])
+
+    def documents(self) -> List[Dict[str, Any]]:
+        return [self.document(i) for i in range(len(self))]
+
+
+def write_segment(path: str, docs: List[Dict[str, Any]]) -> None:
+    """
+    Write documents (title, url, content, fetched_at) as a segment:
+    sorted term ids with CSR postings (doc, term frequency), document
+    lengths, fetch times and URL ids as .npy arrays, and the documents as
+    JSON in docs.bin. The directory is renamed into place once complete.
+    """
+    term_ids: Dict[str, int] = {}
+    post_terms, post_docs, post_tf, doc_len = [], [], [], []
+    for i, doc in enumerate(docs):
+        counts = Counter(tokenize(_index_text(doc)))
+        doc_len.append(sum(counts.values()))
+        for term, tf in counts.items():
+            post_terms.append(term_ids.setdefault(term, len(term_ids)))
+            post_docs.append(i)
+            post_tf.append(tf)
+
+    hashes = np.fromiter((_term_hash(t) for t in term_ids), dtype=np.int64, count=len(term_ids))
+    post_hashes = hashes[np.asarray(post_terms, dtype=np.int64)] if post_terms else np.zeros(0, dtype=np.int64)
+    order = np.lexsort((np.asarray(post_docs, dtype=np.int64), post_hashes))
+    terms, counts = np.unique(post_hashes[order], return_counts=True)
+
+    encoded = [json.dumps(doc).encode("utf-8") for doc in docs]
+    arrays = {
+        "terms": terms,
+        "offsets": np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+        "post_docs": np.asarray(post_docs, dtype=np.int32)[order],
+        "post_tf": np.asarray(post_tf, dtype=np.int32)[order],
+        "doc_len": np.asarray(doc_len, dtype=np.int32),
+        "fetched_at": np.asarray([doc["fetched_at"] for doc in docs], dtype=np.float64),
+        "doc_offsets": np.concatenate([[0], np.cumsum([len(e) for e in encoded])]).astype(np.int64),
+        "url_hash": np.fromiter((_term_hash(_doc_key(doc)) for doc in docs), dtype=np.int64, count=len(docs)),
+    }
+
+    tmp = f"{path}.tmp"
+    os.makedirs(tmp)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp, f"{name}.npy"), array)
+    with open(os.path.join(tmp, "docs.bin"), "wb") as f:
+        f.write(b"".join(encoded))
+    os.rename(tmp, path)
+
+
+class SearchIndex:
+    """
+    Persistent BM25 index of every page the search tool has retrieved.
+
+    The index is a list of immutable segments named in a manifest. Each
+    process buffers the pages it fetches and writes them as a new segment
+    under an exclusive file lock; segments are merged into one (keeping
+    the newest fetch of each URL) once there are more than max_segments.
+    Readers memory-map the segments read-only and reopen them when the
+    manifest changes, so every worker on the machine searches everything
+    any of them has fetched.
+    """
+
+    k1 = RankingTool.k1
+    b = RankingTool.b
+
+    def __init__(
+        self,
+        path: str = SEARCH_INDEX_DIR,
+        flush_docs: int = SEARCH_INDEX_FLUSH_DOCS,
+        flush_interval: float = SEARCH_INDEX_FLUSH_SECONDS,
+        max_segments: int = SEARCH_INDEX_MAX_SEGMENTS,
+        max_age_days: float = SEARCH_INDEX_MAX_AGE_DAYS,
+    ):
+        self.path = path
+        self.flush_docs = flush_docs
+        self.flush_interval = flush_interval
+        self.max_segments = max_segments
+        self.max_age = max_age_days * 86400
+        self._buffer: Dict[str, dict] = {}
+        self._oldest = None
+        self._lock = threading.Lock()
+        # (segments, documents, total document length), replaced as a whole
+        # so searches running in other threads see a consistent view
+        self._view: Tuple[Tuple[_Segment, ...], int, int] = ((), 0, 0)
+        self._manifest_version = None
+
+    def __len__(self) -> int:
+        self._refresh()
+        return self._view[1]
+
+    def _refresh(self) -> None:
+        """Reopen the segments when the manifest has changed."""
+        try:
+            stat = os.stat(os.path.join(self.path, MANIFEST))
+        except FileNotFoundError:
+            return
+        # The manifest is replaced on every change, so its inode changes too
+        version = (stat.st_ino, stat.st_mtime_ns)
+        if version == self._manifest_version:
+            return
+        try:
+            with open(os.path.join(self.path, MANIFEST)) as f:
+                names = json.load(f)["segments"]
+            opened = {segment.path: segment for segment in self._view[0]}
+            segments = tuple(
+                opened.get(os.path.join(self.path, name)) or _Segment(os.path.join(self.path, name))
+                for name in names
+            )
+        except (OSError, ValueError, KeyError) as e:
+            # A compaction removed a segment between reading the manifest and opening it
+            print(f"Search index reload failed, retrying on the next search: {e}")
+            return
+        self._view = (
+            segments, sum(len(segment) for segment in segments), sum(segment.total_len for segment in segments)
+        )
+        self._manifest_version = version
+
+    def search(self, query: str, top_k: int = 5) -> List[Tuple[float, Dict[str, Any]]]:
+        """
+        BM25 search over every segment, with statistics of the whole index.
+
+        Returns:
+            Up to top_k (score, document) pairs, best first, fetched within
+            the max age. Only the newest fetch of each URL is served. Scores
+            are divided by the sum of the query term IDFs.
+        """
+        self._refresh()
+        segments, n_docs, total_len = self._view
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not segments or not terms or not n_docs:
+            return []
+
+        hashes = np.fromiter((_term_hash(t) for t in terms), dtype=np.int64, count=len(terms))
+        ranges = [segment.postings(hashes) for segment in segments]
+        df = sum(ends - starts for starts, ends in ranges)
+        idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+        avgdl = total_len / n_docs
+        min_fetched_at = time.time() - self.max_age
+
+        candidates = []
+        for s, (segment, (starts, ends)) in enumerate(zip(segments, ranges)):
+            docs, contributions = [], []
+            for j in np.flatnonzero(ends > starts):
+                d = np.asarray(segment.post_docs[starts[j]:ends[j]])
+                tf = np.asarray(segment.post_tf[starts[j]:ends[j]], dtype=np.float64)
+                norm = self.k1 * (1 - self.b + self.b * segment.doc_len[d] / avgdl)
+                docs.append(d)
+                contributions.append(idf[j] * tf * (self.k1 + 1) / (tf + norm))
+            if not docs:
+                continue
+            doc_ids, inverse = np.unique(np.concatenate(docs), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(contributions))
+            fresh = segment.fetched_at[doc_ids] >= min_fetched_at
+            doc_ids, scores = doc_ids[fresh], scores[fresh]
+            # Extra candidates make up for stale copies of URLs fetched again later
+            for i in np.argsort(-scores, kind="stable")[:top_k * 2]:
+                candidates.append((float(scores[i]), s, int(doc_ids[i])))
+        if not candidates:
+            return []
+
+        # Newest fetch of every candidate URL across all segments; older copies are skipped
+        url_hashes = np.asarray([segments[s].url_hash[i] for _, s, i in candidates], dtype=np.int64)
+        newest: Dict[int, float] = {}
+        for segment in segments:
+            matches = np.flatnonzero(np.isin(segment.url_hash, url_hashes))
+            for url_hash, fetched_at in zip(segment.url_hash[matches].tolist(), segment.fetched_at[matches].tolist()):
+                newest[url_hash] = max(newest.get(url_hash, fetched_at), fetched_at)
+
+        results, seen = [], set()
+        norm = float(idf.sum()) or 1.0
+        for score, s, i in sorted(candidates, key=lambda c: (-c[0], -c[1])):
+            url_hash = int(segments[s].url_hash[i])
+            if url_hash in seen or segments[s].fetched_at[i] < newest[url_hash]:
+                continue
+            seen.add(url_hash)
+            results.append((score / norm, segments[s].document(i)))
+            if len(results) == top_k:
+                break
+        return results
+
+    def add(self, documents: List[Dict[str, Any]]) -> None:
+        """Buffer retrieved pages (title, url, content); writes a segment when due."""
+        now = time.time()
+        with self._lock:
+            for doc in documents:
+                if not doc.get("content"):
+                    continue
+                self._buffer[_doc_key(doc)] = {
+                    "title": doc.get("title"), "url": doc.get("url"), "content": doc["content"], "fetched_at": now
+                }
+            if self._oldest is None and self._buffer:
+                self._oldest = time.monotonic()
+            due = self._buffer and (
+                len(self._buffer) >= self.flush_docs
+                or time.monotonic() - self._oldest >= self.flush_interval
+            )
+        if due:
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Write all buffered pages as a new segment, merging segments when
+        there are too many.
+
+        Returns:
+            Number of pages written.
+        """
+        with self._lock:
+            batch, self._buffer, self._oldest = list(self._buffer.values()), {}, None
+        if not batch:
+            return 0
+
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, "index.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            names = self._read_manifest()
+            name = f"segment-{time.time_ns()}-{os.getpid()}"
+            write_segment(os.path.join(self.path, name), batch)
+            names.append(name)
+            merged = self._merge_candidates(names) if len(names) > self.max_segments else []
+            if merged:
+                names = [n for n in names if n not in merged] + self._compact(merged)
+            self._write_manifest(names)
+            # Processes that still map a removed segment keep reading it until they reload
+            for old in merged:
+                shutil.rmtree(os.path.join(self.path, old), ignore_errors=True)
+        return len(batch)
+
+    def _read_manifest(self) -> List[str]:
+        try:
+            with open(os.path.join(self.path, MANIFEST)) as f:
+                return json.load(f)["segments"]
+        except FileNotFoundError:
+            return []
+
+    def _write_manifest(self, names: List[str]) -> None:
+        tmp = os.path.join(self.path, f"{MANIFEST}.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"segments": names}, f)
+        os.replace(tmp, os.path.join(self.path, MANIFEST))
+
+    def _merge_candidates(self, names: List[str]) -> List[str]:
+        """
+        Segments to merge: all but the largest while it holds more pages than
+        the rest together, so the bulk of the index is rewritten only when
+        the newer segments have grown as large (amortized O(n log n) writes).
+        """
+        sizes = {name: len(np.load(os.path.join(self.path, name, "doc_len.npy"), mmap_mode="r")) for name in names}
+        largest = max(names, key=sizes.get)
+        if sizes[largest] > sum(sizes.values()) - sizes[largest]:
+            return [name for name in names if name != largest]
+        return names
+
+    def _compact(self, names: List[str]) -> List[str]:
+        """Merge segments into one, keeping the newest fetch of each URL and dropping expired pages."""
+        min_fetched_at = time.time() - self.max_age
+        latest: Dict[str, dict] = {}
+        for name in names:
+            for doc in _Segment(os.path.join(self.path, name)).documents():
+                if doc["fetched_at"] < min_fetched_at:
+                    continue
+                key = _doc_key(doc)
+                if key not in latest or doc["fetched_at"] >= latest[key]["fetched_at"]:
+                    latest[key] = doc
+        if not latest:
+            return []
+        name = f"segment-{time.time_ns()}-{os.getpid()}"
+        write_segment(os.path.join(self.path, name), list(latest.values()))
+        print(f"Search index compacted {len(names)} segments into {len(latest)} pages")
+        return [name]
+
+
+search_index = SearchIndex()
@@ -0,0 +1,125 @@
+import os
+import asyncio
+from typing import Any, Dict, Optional
+import httpx
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+TAVILY_BASE_URL = os.getenv("TAVILY_BASE_URL", "https://api.tavily.com")
+# Per-query timeout in seconds
+SEARCH_TIMEOUT = float(os.getenv("SEARCH_TIMEOUT", "15"))
+SEARCH_KEEPALIVE_EXPIRY = float(os.getenv("SEARCH_KEEPALIVE_EXPIRY", "60"))
+
+
+class AsyncTavilySearch:
+    """
+    Native asyncio Tavily search client.
+
+    Uses one pooled httpx.AsyncClient (HTTP/2 when `h2` is installed) per
+    event loop and a semaphore to bound the number of in-flight searches.
+    Owners of short-lived loops should `aclose` it before closing the loop;
+    a client left open on a previous loop is closed when the next loop
+    replaces it.
+    """
+
+    def __init__(self, api_key: str, max_concurrency: int = 20, timeout: float = SEARCH_TIMEOUT):
+        self.api_key = api_key
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def _ensure_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop or self._client.is_closed:
+            # httpx connections and semaphores are bound to the loop that created them.
+            # The new client is in place before the first await, so concurrent
+            # searches share it; the previous one is closed afterwards.
+            previous = self._client
+            self._client = httpx.AsyncClient(
+                base_url=TAVILY_BASE_URL,
+                headers={
+                    "Content-Type": "application/json",
+                    "Authorization": f"Bearer {self.api_key}",
+                    "X-Client-Source": "tavily-python",
+                },
+                http2=HTTP2_AVAILABLE,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency,
+                    keepalive_expiry=SEARCH_KEEPALIVE_EXPIRY,
+                ),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+            if previous is not None and not previous.is_closed:
+                try:
+                    await previous.aclose()
+                except Exception as e:
+                    # Its loop is already closed: the sockets are released when it is collected
+                    print(f"Closing the previous search client failed: {e}")
+        return self._client
+
+    async def search(self, query: str, timeout: Optional[float] = None, **params) -> Dict[str, Any]:
+        """
+        Run a single Tavily search.
+
+        Args:
+            query: The search query.
+            timeout: Per-query timeout in seconds (defaults to the client timeout).
+            **params: Extra Tavily search parameters (max_results, search_depth, ...).
+
+        Returns:
+            The decoded Tavily response.
+        """
+        client = await self._ensure_client()
+        data = {"query": query, **{k: v for k, v in params.items() if v is not None}}
+
+        async with self._semaphore:
+            response = await client.post(
+                "/search",
+                json=data,
+                timeout=timeout if timeout is not None else self.timeout,
+            )
+
+        if response.status_code == 200:
+            return response.json()
+
+        detail = ""
+        try:
+            detail = response.json().get("detail", {}).get("error", None)
+        except Exception:
+            pass
+
+        # Imported on the error path only: the tavily package pulls in heavy
+        # optional dependencies at import time
+        from tavily.errors import (
+            BadRequestError,
+            ForbiddenError,
+            InvalidAPIKeyError,
+            UsageLimitExceededError,
+        )
+
+        if response.status_code == 429:
+            raise UsageLimitExceededError(detail)
+        elif response.status_code in [403, 432, 433]:
+            raise ForbiddenError(detail)
+        elif response.status_code == 401:
+            raise InvalidAPIKeyError(detail)
+        elif response.status_code == 400:
+            raise BadRequestError(detail)
+        response.raise_for_status()
+        return {}
+
+    async def aclose(self) -> None:
+        """Close the pooled HTTP client."""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+        self._loop = None
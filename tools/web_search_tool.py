@@ -1,138 +1,240 @@
 import os
 import asyncio
-from typing import List, Dict, Any
 from concurrent.futures import ThreadPoolExecutor
-from tavily import TavilyClient
+from typing import List, Dict, Any, Optional
 from pydantic_ai import RunContext
 from tools.ranking_tool import RankingTool
+from tools.search_cache import SearchResultCache
+from tools.query_optimizer import QueryOptimizer
+from tools.passage_selector import PassageSelector, SEARCH_CONTEXT_CHAR_BUDGET
+from tools.search_index import search_index, SEARCH_INDEX_ENABLED, SEARCH_INDEX_MIN_RESULTS, SEARCH_INDEX_MIN_SCORE
+from tools.tavily_client import AsyncTavilySearch, SEARCH_TIMEOUT
+from tools.urls import canonical_url
+from extensions.metrics import (
+    metrics,
+    SEARCH_QUERIES_TOTAL,
+    SEARCH_ERRORS_TOTAL,
+    SEARCH_FANOUT_SECONDS,
+    SEARCH_CONTEXT_CHARS,
+    TOKEN_BUCKETS,
+)
+from extensions.rate_limiter import search_limiter
 
 class OptimizedBatchSearchTool:
-    """Advanced batch search with parallel ranking."""
-    
-    def __init__(self, max_results=10, max_workers=20):
+    """Advanced batch search with batched ranking."""
+
+    def __init__(self, max_results=10, max_concurrency=20, timeout: float = SEARCH_TIMEOUT, char_budget: int = SEARCH_CONTEXT_CHAR_BUDGET):
         api_key = os.getenv("TAVILY_API_KEY")
         if not api_key:
             raise ValueError("TAVILY_API_KEY must be set")
-        self.client = TavilyClient(api_key=api_key)
+        self.client = AsyncTavilySearch(api_key, max_concurrency=max_concurrency, timeout=timeout)
         self.max_results = max_results
-        self.max_workers = max_workers
-        self._cache = {}
-        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.cache = SearchResultCache()
         self.ranker = RankingTool()
-    
+        self.optimizer = QueryOptimizer()
+        self.passages = PassageSelector(self.ranker, char_budget)
+        self.index = search_index if SEARCH_INDEX_ENABLED else None
+        # Index lookups get their own thread so they never queue behind Mongo or Redis calls
+        self._index_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search-index")
+
     def _optimize_query(self, query: str) -> str:
-        """Optimize query for faster search (3-5 keywords)."""
-        words = query.split()
-        if len(words) > 5:
-            return ' '.join(words[:5])
-        return query
-    
-    def _search_and_rank_batch_sync(
-        self, 
-        queries_with_indices: List[tuple[int, str]]
-    ) -> List[tuple[int, Dict[str, Any]]]:
+        """Optimize query for faster search (salient keywords in canonical order)."""
+        return self.optimizer.optimize(query).text
+
+    def _cache_key(self, query: str) -> str:
+        return f"{self.max_results}:{query.lower().strip()}"
+
+    def _search_local(self, queries: List[str]) -> List[Optional[Dict[str, Any]]]:
         """
-        Execute batch of searches+rankings in a single thread.
-        Returns list of (original_index, result) tuples for correct ordering.
+        Results of each query from the persistent index, or None when it does
+        not hold SEARCH_INDEX_MIN_RESULTS fresh pages scoring at least
+        SEARCH_INDEX_MIN_SCORE. Blocking (disk reads); run off the event loop.
         """
-        results = []
-        
-        for idx, query in queries_with_indices:
-            cache_key = query.lower().strip()
-            
-            if cache_key in self._cache:
-                results.append((idx, self._cache[cache_key]))
-                continue
-            
+        found = []
+        for query in queries:
             try:
-                resp = self.client.search(
+                hits = self.index.search(query, top_k=5)
+            except Exception as e:
+                print(f"Search index lookup failed: {e}")
+                hits = []
+            hits = [doc for score, doc in hits if score >= SEARCH_INDEX_MIN_SCORE]
+            if len(hits) < SEARCH_INDEX_MIN_RESULTS:
+                found.append(None)
+                continue
+            found.append({
+                "results": [{"title": doc.get("title"), "url": doc.get("url"), "content": doc.get("content")} for doc in hits]
+            })
+        return found
+
+    async def _add_to_index(self, results: List[Dict[str, Any]]) -> None:
+        """Add freshly retrieved pages to the persistent index (writes happen off the event loop)."""
+        documents = [r for result in results if "error" not in result for r in result["results"]]
+        if self.index is None or not documents:
+            return
+        try:
+            await asyncio.to_thread(self.index.add, documents)
+        except OSError as e:
+            print(f"Search index update failed: {e}")
+
+    async def _search(self, query: str, redis_client=None) -> Dict[str, Any]:
+        """
+        Execute a single search on the event loop, within the fleet-wide
+        Tavily rate limit (shared through redis_client when given).
+        """
+        try:
+            resp = await search_limiter.call(
+                redis_client,
+                lambda: self.client.search(
                     query,
                     max_results=self.max_results,
                     include_answer=False,
-                    search_depth="basic"
-                )
-                
-                raw_results = [
-                    {
-                        "title": r.get("title"),
-                        "url": r.get("url"),
-                        "content": r.get("content")
-                    }
-                    for r in resp.get("results", [])
-                ]
-                
-                
-                ranked = self.ranker.rank_results(query, raw_results, top_k=5)
-                filtered = {"results": ranked}
-                
-                self._cache[cache_key] = filtered
-                results.append((idx, filtered))
-                
-            except Exception as e:
-                results.append((idx, {
-                    "error": f"Search failed for '{query}': {str(e)}",
-                    "results": []
-                }))
-        
-        return results
-    
+                    search_depth="basic",
+                    timeout=self.timeout
+                ),
+                requests=1,
+            )
+
+            raw_results = [
+                {
+                    "title": r.get("title"),
+                    "url": r.get("url"),
+                    "content": r.get("content")
+                }
+                for r in resp.get("results", [])
+            ]
+            return {"results": raw_results}
+
+        except Exception as e:
+            metrics.inc(SEARCH_ERRORS_TOTAL, error=type(e).__name__)
+            return {
+                "error": f"Search failed for '{query}': {str(e) or type(e).__name__}",
+                "results": []
+            }
+
     async def __call__(
-        self, 
-        ctx: RunContext, 
+        self,
+        ctx: Optional[RunContext],
         queries: List[str],
         optimize: bool = True
     ) -> List[Dict[str, Any]]:
-        """Execute optimized batch searches with parallel ranking."""
+        """Execute optimized batch searches with batched ranking."""
         if not queries:
             return []
-        
-        # Optimize queries
-        if optimize:
-            queries = [self._optimize_query(q) for q in queries]
-        
+
+        with metrics.timer(SEARCH_FANOUT_SECONDS):
+            return await self._search_batch(ctx, queries, optimize)
+
+    async def _search_batch(self, ctx: Optional[RunContext], queries: List[str], optimize: bool) -> List[Dict[str, Any]]:
+        deps = getattr(ctx, "deps", None)
+        redis_client = getattr(deps, "redis_client", None)
+        misses = 0
+        local = 0
+
         # Deduplicate while preserving order mapping
-        seen = set()
-        unique_queries_with_idx = []
-        for i, q in enumerate(queries):
-            q_normalized = q.lower().strip()
-            if q_normalized not in seen:
-                seen.add(q_normalized)
-                unique_queries_with_idx.append((i, q))
-        
-        # Split into batches for parallel processing
-        batch_size = max(1, len(unique_queries_with_idx) // self.max_workers)
-        batches = [
-            unique_queries_with_idx[i:i + batch_size]
-            for i in range(0, len(unique_queries_with_idx), batch_size)
-        ]
-        
-        # Execute batches in parallel
-        loop = asyncio.get_event_loop()
-        futures = [
-            loop.run_in_executor(
-                self._executor, 
-                self._search_and_rank_batch_sync, 
-                batch
+        query_by_key = {}
+        optimized_by_key = {}
+        input_keys = []
+        if optimize:
+            # Keywords in canonical order; near-duplicates share one search
+            await self.optimizer.stats.sync(redis_client)
+            collapsed = self.optimizer.collapsed
+            for q in self.optimizer.optimize_batch(queries):
+                key = self._cache_key(q.key)
+                query_by_key.setdefault(key, q.text)
+                optimized_by_key.setdefault(key, q)
+                input_keys.append(key)
+            metrics.inc(SEARCH_QUERIES_TOTAL, self.optimizer.collapsed - collapsed, result="collapsed")
+        else:
+            for q in queries:
+                key = self._cache_key(q)
+                query_by_key.setdefault(key, q)
+                input_keys.append(key)
+
+        async def fetch(missing_keys: List[str]) -> Dict[str, Dict[str, Any]]:
+            nonlocal misses, local
+            # Pages already in the persistent index make the live search unnecessary
+            found = {}
+            if self.index is not None and missing_keys:
+                local_results = await asyncio.get_running_loop().run_in_executor(
+                    self._index_executor, self._search_local, [query_by_key[k] for k in missing_keys]
+                )
+                found = {k: result for k, result in zip(missing_keys, local_results) if result is not None}
+            local += len(found)
+            missing_keys = [k for k in missing_keys if k not in found]
+            misses += len(missing_keys)
+
+            # Concurrency is bounded by the client's semaphore
+            results = await asyncio.gather(
+                *(self._search(query_by_key[k], redis_client) for k in missing_keys)
             )
-            for batch in batches
-        ]
-        
-        # Gather results
-        batch_results = await asyncio.gather(*futures, return_exceptions=True)
-        
-        # Flatten and sort by original index
-        all_results_with_idx = []
-        for batch_result in batch_results:
-            if isinstance(batch_result, Exception):
-                continue  # Skip failed batches
-            all_results_with_idx.extend(batch_result)
-        
-        # Sort by original index to maintain order
-        all_results_with_idx.sort(key=lambda x: x[0])
-        
-        # Return just the results (strip indices)
-        return [result for _, result in all_results_with_idx]
-    
-    def __del__(self):
-        """Cleanup thread pool."""
-        self._executor.shutdown(wait=False)
\ No newline at end of file
+            await self._add_to_index(results)
+
+            # Rank every successful result set in one vectorized pass
+            ok = [i for i, r in enumerate(results) if "error" not in r]
+            ranked = self.ranker.rank_batch(
+                [query_by_key[missing_keys[i]] for i in ok],
+                [results[i]["results"] for i in ok],
+                top_k=5
+            )
+            for i, ranked_results in zip(ok, ranked):
+                results[i] = {"results": ranked_results}
+            found.update(zip(missing_keys, results))
+            return found
+
+        # Local LRU -> shared Redis tier -> live search
+        resolved = await self.cache.get_or_fetch(
+            list(query_by_key),
+            fetch,
+            redis_client=redis_client,
+            cacheable=lambda result: "error" not in result,
+        )
+
+        # Keep original query order
+        keys = [k for k in query_by_key if k in resolved]
+        results = [resolved[k] for k in keys]
+        for key, q in optimized_by_key.items():
+            if "error" not in resolved.get(key, {"error": None}):
+                self.optimizer.remember(q)
+        metrics.inc(SEARCH_QUERIES_TOTAL, misses, result="miss")
+        metrics.inc(SEARCH_QUERIES_TOTAL, local, result="index")
+        metrics.inc(SEARCH_QUERIES_TOTAL, len(query_by_key) - misses - local, result="hit")
+        if deps is not None:
+            deps.search_calls += misses
+
+        # Keep the full pages, which the agent's notes are checked against
+        documents = getattr(deps, "retrieved_documents", None)
+        if documents is not None:
+            for result in results:
+                for r in result.get("results", []):
+                    if r.get("url") and r.get("content"):
+                        documents[canonical_url(r["url"])] = r["content"]
+
+        # Only the best passages of each page go to the model, within the character budget
+        selected = self.passages.select([query_by_key[k] for k in keys], [result.get("results", []) for result in results])
+        results_by_key = {k: {**result, "results": passages} for k, result, passages in zip(keys, results, selected)}
+        metrics.observe(
+            SEARCH_CONTEXT_CHARS,
+            sum(len(r.get("content") or "") for result in results_by_key.values() for r in result["results"]),
+            buckets=TOKEN_BUCKETS,
+        )
+
+        # One entry per input query, in order; a query answered by the same
+        # search as an earlier one points to it instead of repeating its results
+        answered_by = {}
+        output = []
+        for query, key in zip(queries, input_keys):
+            if key in answered_by:
+                output.append({"query": query, "duplicate_of": answered_by[key], "results": []})
+            elif key in results_by_key:
+                answered_by[key] = query
+                output.append({"query": query, **results_by_key[key]})
+        return output
+
+    async def aclose(self):
+        """Close the pooled search client and write the pages not yet indexed."""
+        await self.client.aclose()
+        if self.index is not None:
+            await asyncio.to_thread(self.index.flush)
+        self._index_executor.shutdown(wait=False)
@@ -1,64 +1,342 @@
 import os
+import argparse
+import time
+import multiprocessing
+from datetime import datetime, timedelta, timezone
+from itertools import islice
 import redis
 from rq import Queue
+from rq.job import Job, JobStatus
 from dotenv import load_dotenv
-from extensions.mongo import meals_collection, recipe_contexts_collection
-from jobs import process_meal
+from pymongo import UpdateMany
+from pymongo.errors import OperationFailure, PyMongoError
+from extensions.mongo import (
+    meals_collection,
+    recipe_contexts_collection,
+    trigger_state_collection,
+    ensure_indexes,
+)
+from extensions.meal_status import mark_meals, QUEUED, DONE, FAILED
+from extensions.context_writer import EVIDENCE_PARTIAL
+from extensions.evidence_categories import group_meals
+from extensions.streams import JobStream, JOB_BACKEND
+from prompts.recipe_serializer import RECIPE_PROJECTION
+from jobs import process_meal, process_category, meal_job_id
 
 
 load_dotenv()
 
-def trigger_jobs():
-    """
-    Uses an aggregation pipeline to fetch meals that do NOT have
-    a matching recipe_context. 
-    """
+# Meals fetched per cursor batch (and enqueued per round)
+TRIGGER_BATCH_SIZE = int(os.getenv("TRIGGER_BATCH_SIZE", "500"))
+# Meals stuck in "queued" longer than this (hours) are enqueued again
+TRIGGER_REQUEUE_AFTER_HOURS = float(os.getenv("TRIGGER_REQUEUE_AFTER_HOURS", "24"))
+# Max seconds the change-stream mode waits before flushing a partial batch
+TRIGGER_WATCH_FLUSH_SECONDS = float(os.getenv("TRIGGER_WATCH_FLUSH_SECONDS", "1"))
+# Seconds a trigger holds its claim on a job id while enqueueing it
+ENQUEUE_CLAIM_TTL = int(os.getenv("ENQUEUE_CLAIM_TTL", "60"))
+
+WATCH_STATE_ID = "meals_change_stream"
+
+# Jobs in these states are already waiting or running and must not be enqueued again
+ACTIVE_JOB_STATUSES = {JobStatus.QUEUED, JobStatus.STARTED, JobStatus.DEFERRED, JobStatus.SCHEDULED}
+
 
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _get_queue():
     REDIS_URL = os.getenv("REDIS_URL")
     if not REDIS_URL:
         print("Error: REDIS_URL not set in .env")
-        return
+        return None
 
     # Connect to Redis queue
     conn = redis.from_url(REDIS_URL)
-    q = Queue(connection=conn)
+    if JOB_BACKEND == "streams":
+        stream = JobStream(conn)
+        stream.ensure_group()
+        return stream
+    return Queue(connection=conn)
+
+
+def _claim_key(job_id: str) -> str:
+    return f"enqueue_claim:{job_id}"
+
+
+def _enqueue_jobs(q, func, jobs) -> list:
+    """
+    Enqueue (arg, job_id) pairs with deterministic job ids, skipping jobs
+    that are already queued or running.
+
+    On RQ, each job id is first claimed with SET NX, so triggers running
+    concurrently (e.g. backfill shards) never both pass the status check
+    and enqueue the same job twice. Claims are released once the jobs are
+    enqueued, and expire after ENQUEUE_CLAIM_TTL if the trigger dies.
+
+    Returns:
+        The (arg, job_id) pairs that were enqueued.
+    """
+    if isinstance(q, JobStream):
+        enqueued = q.enqueue(f"{func.__module__}.{func.__name__}", jobs)
+        if len(enqueued) < len(jobs):
+            print(f"Skipped {len(jobs) - len(enqueued)} jobs that are already queued or running.")
+        return enqueued
+
+    with q.connection.pipeline(transaction=False) as pipe:
+        for _, job_id in jobs:
+            pipe.set(_claim_key(job_id), os.getpid(), nx=True, ex=ENQUEUE_CLAIM_TTL)
+        claimed = [(arg, job_id) for (arg, job_id), ok in zip(jobs, pipe.execute()) if ok]
+
+    job_ids = [job_id for _, job_id in claimed]
+    existing = Job.fetch_many(job_ids, connection=q.connection)
+    active = {job.id for job in existing if job is not None and job.get_status(refresh=False) in ACTIVE_JOB_STATUSES}
+    to_enqueue = [(arg, job_id) for arg, job_id in claimed if job_id not in active]
+
+    # One pipelined round-trip for the whole batch. A finished or failed job
+    # under the same id is deleted first: enqueueing only rewrites its fields,
+    # so the hash would keep the result_ttl expiry and vanish while queued.
+    with q.connection.pipeline() as pipe:
+        for job in existing:
+            if job is not None and job.id not in active:
+                q.finished_job_registry.remove(job.id, pipeline=pipe)
+                q.failed_job_registry.remove(job.id, pipeline=pipe)
+                pipe.delete(job.key)
+        q.enqueue_many(
+            [
+                Queue.prepare_data(func, args=(arg,), timeout=600, job_id=job_id)
+                for arg, job_id in to_enqueue
+            ],
+            pipeline=pipe
+        )
+        if job_ids:
+            pipe.delete(*(_claim_key(job_id) for job_id in job_ids))
+        pipe.execute()
+
+    if len(to_enqueue) < len(jobs):
+        print(f"Skipped {len(jobs) - len(to_enqueue)} jobs that are already queued or running.")
+    return to_enqueue
+
+
+def _without_context(meals) -> list:
+    """Meals processed before processing state existed are only marked done."""
+    meal_ids = [meal["_id"] for meal in meals]
+    already_done = set(recipe_contexts_collection.distinct(
+        "meal_id", {"meal_id": {"$in": meal_ids}, "evidence_status": {"$ne": EVIDENCE_PARTIAL}}
+    ))
+    mark_meals(already_done, DONE)
+    return [meal for meal in meals if meal["_id"] not in already_done]
+
+
+def enqueue_meals(q, meals) -> int:
+    """
+    Enqueue a batch of meals and mark them as queued.
+    Meals processed before processing state existed are only marked done.
+    """
+    candidates = _without_context(meals)
+    titles = {meal["_id"]: meal.get("title", meal["_id"]) for meal in candidates}
+
+    # Marked before enqueueing, so a fast worker's done/failed is never overwritten;
+    # meals with an active job are queued too, just not by this run
+    mark_meals(list(titles), QUEUED)
+
+    # Deterministic job ids: skip meals whose job is already queued or running
+    enqueued = _enqueue_jobs(q, process_meal, [(meal["_id"], meal_job_id(meal["_id"])) for meal in candidates])
+    for meal_id, _ in enqueued:
+        print(f"Enqueueing meal: {titles[meal_id]}")
+    return len(enqueued)
+
+
+def enqueue_categories(q, meals) -> int:
+    """
+    Group a batch of meals into categories and enqueue one job per
+    category instead of one per meal.
+
+    Each meal gets its `category_key`, which the category job uses to fan
+    the shared evidence out to every member.
+    """
+    groups = group_meals(_without_context(meals))
+    if not groups:
+        return 0
+
+    meals_collection.bulk_write(
+        [
+            UpdateMany({"_id": {"$in": [meal["_id"] for meal in members]}}, {"$set": {"category_key": key}})
+            for key, (_, members) in groups.items()
+        ],
+        ordered=False
+    )
+
+    # Marked before enqueueing, so a fast worker's done/failed is never overwritten
+    mark_meals([meal["_id"] for _, members in groups.values() for meal in members], QUEUED)
+
+    enqueued = _enqueue_jobs(q, process_category, [(key, f"category-{key}") for key in groups])
+    for key, _ in enqueued:
+        features, members = groups[key]
+        print(f"Enqueueing category {key} ({len(members)} meals): {', '.join(features)}")
+    return len(enqueued)
 
+
+def trigger_jobs(id_range=None, categories=False):
+    """
+    Enqueue meals that have not been processed yet.
+
+    Uses the indexed `context_status` field on meals instead of a
+    $lookup over the whole collection, so the cost is proportional to the
+    number of new, failed or stale meals.
+
+    Args:
+        id_range: Optional (lower, upper) _id bounds (inclusive lower,
+            exclusive upper, None for open) restricting this run to a shard.
+        categories: Enqueue one job per recipe category instead of one
+            per meal.
+    """
+    q = _get_queue()
+    if q is None:
+        return
+
+    ensure_indexes()
     print("Checking for unprocessed meals...")
 
+    stale_before = datetime.now(timezone.utc) - timedelta(hours=TRIGGER_REQUEUE_AFTER_HOURS)
+    query = {
+        "$or": [
+            {"context_status": {"$in": [None, FAILED]}},
+            {"context_status": QUEUED, "context_queued_at": {"$lt": stale_before}},
+        ]
+    }
+    if id_range is not None:
+        lower, upper = id_range
+        bounds = {}
+        if lower is not None:
+            bounds["$gte"] = lower
+        if upper is not None:
+            bounds["$lt"] = upper
+        if bounds:
+            query["_id"] = bounds
+
+    # Categories are computed from the recipe itself
+    projection = RECIPE_PROJECTION if categories else {"_id": 1, "title": 1}
+    enqueue = enqueue_categories if categories else enqueue_meals
+    unprocessed_meals = meals_collection.find(query, projection, batch_size=TRIGGER_BATCH_SIZE)
 
-    pipeline = [
-        {
-            "$lookup": {
-                "from": "recipe_contexts",
-                "localField": "_id",
-                "foreignField": "meal_id",
-                "as": "ctx"
-            }
-        },
-        {
-            "$match": {
-                "ctx": {"$size": 0}   
-            }
-        },
-        {
-            "$project": {
-                "_id": 1,
-                "title": 1
-            }
-        }
-    ]
-
-    unprocessed_meals = meals_collection.aggregate(pipeline)
     count_enqueued = 0
+    for batch in _batched(unprocessed_meals, TRIGGER_BATCH_SIZE):
+        count_enqueued += enqueue(q, batch)
+
+    print(f"Trigger complete. Enqueued {count_enqueued} new jobs.")
 
-    for meal in unprocessed_meals:
-        meal_id = meal["_id"]
 
-        print(f"Enqueueing meal: {meal.get('title', meal_id)}")
-        q.enqueue(process_meal, meal_id, job_timeout='10m')
-        count_enqueued += 1
+def shard_ranges(shards: int) -> list:
+    """
+    Split the meals _id space into `shards` contiguous ranges of roughly
+    equal size, using split points read from the _id index.
+    """
+    total = meals_collection.estimated_document_count()
+    split_points = []
+    for i in range(1, shards):
+        doc = next(
+            meals_collection.find({}, {"_id": 1}).sort("_id", 1).skip(i * total // shards).limit(1),
+            None
+        )
+        if doc is not None and (not split_points or doc["_id"] > split_points[-1]):
+            split_points.append(doc["_id"])
+    bounds = [None] + split_points + [None]
+    return list(zip(bounds[:-1], bounds[1:]))
 
-    print(f"Trigger complete. Enqueued {count_enqueued} new jobs.")
 
-if __name__ == "__main__":
+def backfill(shards: int, shard=None, categories=False):
+    """
+    Seed a large backfill in parallel.
+
+    With `shard` set, only that range is processed, so separate trigger
+    processes (or machines) can each take one shard. Without it, one
+    local process is started per shard. Deterministic job ids make
+    overlapping or repeated runs harmless.
+
+    Local shard processes are spawned rather than forked: this process
+    has already used the Mongo client, which is not fork-safe, so each
+    child imports the modules again and opens its own connections.
+    """
+    ranges = shard_ranges(shards)
+    if shard is not None:
+        print(f"Backfilling shard {shard + 1}/{len(ranges)}: {ranges[shard]}")
+        trigger_jobs(ranges[shard], categories)
+        return
+
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=trigger_jobs, args=(id_range, categories)) for id_range in ranges]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+def watch_new_meals():
+    """
+    Long-running mode: enqueue meals as soon as they are inserted.
+
+    Follows a change stream on meals (requires a replica set) and persists
+    the resume token, so a restart continues where it stopped.
+    """
+    q = _get_queue()
+    if q is None:
+        return
+
+    # Catch up on anything inserted while nothing was watching
     trigger_jobs()
+
+    state = trigger_state_collection.find_one({"_id": WATCH_STATE_ID}) or {}
+    pipeline = [{"$match": {"operationType": "insert"}}]
+    print("Watching for new meals...")
+
+    try:
+        with meals_collection.watch(pipeline, resume_after=state.get("resume_token")) as stream:
+            pending = []
+            saved_token = state.get("resume_token")
+            last_flush = time.monotonic()
+            while stream.alive:
+                change = stream.try_next()
+                if change is not None:
+                    doc = change["fullDocument"]
+                    pending.append({"_id": doc["_id"], "title": doc.get("title")})
+
+                due = time.monotonic() - last_flush >= TRIGGER_WATCH_FLUSH_SECONDS
+                if pending and (len(pending) >= TRIGGER_BATCH_SIZE or due or change is None):
+                    count = enqueue_meals(q, pending)
+                    print(f"Enqueued {count} new jobs.")
+                    pending = []
+                    last_flush = time.monotonic()
+
+                # Only persist the resume token once everything before it is enqueued
+                if not pending and stream.resume_token != saved_token:
+                    saved_token = stream.resume_token
+                    trigger_state_collection.update_one(
+                        {"_id": WATCH_STATE_ID},
+                        {"$set": {"resume_token": saved_token}},
+                        upsert=True
+                    )
+                if change is None:
+                    time.sleep(0.2)
+    except OperationFailure as e:
+        print(f"Change streams unavailable (replica set required): {e}")
+    except PyMongoError as e:
+        print(f"Change stream stopped: {e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Enqueue agent jobs for unprocessed meals.")
+    parser.add_argument("--watch", action="store_true", help="keep running and enqueue new meals from a change stream")
+    parser.add_argument("--shards", type=int, default=0, help="backfill: split the _id space into N ranges")
+    parser.add_argument("--shard", type=int, default=None, help="backfill: only process this shard (0-based)")
+    parser.add_argument("--categories", action="store_true", help="run the agent once per recipe category and share its evidence")
+    args = parser.parse_args()
+
+    if args.watch:
+        watch_new_meals()
+    elif args.shards > 1:
+        backfill(args.shards, args.shard, args.categories)
+    else:
+        trigger_jobs(categories=args.categories)
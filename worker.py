@@ -1,14 +1,51 @@
 import os
+import math
+import time
+import signal
+import socket
+import asyncio
+import traceback
+from typing import Optional
 import redis
-from rq import Worker, Queue
+from rq import Worker, SimpleWorker, Queue
+from rq.job import Job, JobStatus
+from rq.executions import Execution
+from rq.registry import clean_registries
+from rq.defaults import DEFAULT_RESULT_TTL
 from dotenv import load_dotenv
+from extensions.metrics import metrics, WORKER_STARTUP_SECONDS
+from extensions.streams import JobStream, JOB_BACKEND, STREAM_VISIBILITY_TIMEOUT
 
 # Load env vars
 load_dotenv()
 
 listen = ['default']
 
-def start_worker():
+# "rq" runs the default forking RQ worker, "simple" runs RQ jobs in the worker
+# process itself (no fork), "async" runs many meals in one event loop.
+# With JOB_BACKEND=streams the worker always consumes the job stream.
+WORKER_MODE = os.getenv("WORKER_MODE", "rq")
+# Import and initialize the job code once in the worker process, so forked
+# work horses inherit it instead of paying the startup cost on every job
+WORKER_PRELOAD = os.getenv("WORKER_PRELOAD", "true").lower() in ("1", "true", "yes")
+# Max number of meal jobs pulled from the queue at once in async mode
+WORKER_BATCH_SIZE = int(os.getenv("WORKER_BATCH_SIZE", "16"))
+# Seconds to block waiting for new jobs when the queue is empty
+WORKER_POLL_TIMEOUT = int(os.getenv("WORKER_POLL_TIMEOUT", "5"))
+# Seconds between sweeps of the RQ registries (abandoned jobs of dead workers are failed)
+WORKER_MAINTENANCE_INTERVAL = int(os.getenv("WORKER_MAINTENANCE_INTERVAL", "600"))
+# Extra seconds a started job stays registered beyond its timeout, like RQ's own workers
+STARTED_JOB_TTL_MARGIN = 60
+
+
+def start_worker(serve_metrics: bool = True):
+    """
+    Run one worker in the configured WORKER_MODE until it is stopped.
+
+    Args:
+        serve_metrics: Serve the metrics endpoint from this process (the
+            supervisor serves it for the workers it starts).
+    """
     REDIS_URL = os.getenv("REDIS_URL")
     if not REDIS_URL:
         print("Error: REDIS_URL not set in .env")
@@ -16,12 +53,322 @@ def start_worker():
 
     conn = redis.from_url(REDIS_URL)
 
-    print("Starting RQ worker...")
+    if serve_metrics:
+        # Work horses and batches merge their metrics into METRICS_FILE; this serves the total
+        metrics.start_http_server()
+
+    if WORKER_PRELOAD:
+        preload_jobs()
+
+    if JOB_BACKEND == "streams":
+        asyncio.run(run_stream_worker(conn))
+        return
+
+    if WORKER_MODE == "async":
+        asyncio.run(run_async_worker(conn))
+        return
+
+    print(f"Starting RQ worker ({WORKER_MODE} mode)...")
     # Instantiate queues with the connection
     queues = [Queue(name, connection=conn) for name in listen]
     # Instantiate worker with the connection
-    worker = Worker(queues, connection=conn)
-    worker.work()
+    worker_class = SimpleWorker if WORKER_MODE == "simple" else Worker
+    worker = worker_class(queues, connection=conn)
+    try:
+        worker.work()
+    finally:
+        if WORKER_MODE == "simple":
+            # Jobs ran in this process, on one event loop with pooled connections
+            from jobs import close_job_loop
+            close_job_loop()
+
+
+def preload_jobs() -> float:
+    """
+    Import the job modules and build the agent and search tool in this
+    process. Nothing connects here (clients open on first use), so forked
+    work horses can safely inherit the result.
+
+    Returns:
+        The startup time in seconds.
+    """
+    start = time.perf_counter()
+    import jobs  # noqa: F401
+    from agents.truth_seeking_agent import init_agent
+    from prompts.recipe_serializer import count_tokens
+
+    init_agent()
+    # Loads the tokenizer files
+    count_tokens("warm up")
+
+    elapsed = time.perf_counter() - start
+    print(f"Preloaded job code in {elapsed:.2f}s")
+    metrics.observe(WORKER_STARTUP_SECONDS, elapsed, mode=WORKER_MODE)
+    # Into the shared file, which is what a supervisor serves for its workers
+    metrics.flush_to_file()
+    return elapsed
+
+
+def _pop_jobs(conn, queue: Queue, batch_size: int, timeout: int) -> list:
+    """
+    Pop up to batch_size jobs from an RQ queue.
+    Blocks up to timeout seconds for the first one, then drains without blocking.
+    Ids of jobs that no longer exist are dropped.
+    """
+    first = conn.blpop([queue.key], timeout=timeout)
+    if not first:
+        return []
+    job_ids = [first[1]]
+    if batch_size > 1:
+        job_ids.extend(conn.lpop(queue.key, batch_size - 1) or [])
+    job_ids = [job_id.decode() if isinstance(job_id, bytes) else job_id for job_id in job_ids]
+    return [job for job in Job.fetch_many(job_ids, connection=conn) if job is not None]
+
+
+async def run_async_worker(conn, batch_size: int = WORKER_BATCH_SIZE):
+    """
+    Long-lived worker loop that pulls batches of process_meal and
+    process_category jobs from the RQ queues and runs them concurrently in
+    a single event loop. SIGTERM/SIGINT stop it after the current batch.
+    """
+    # Already loaded when preloading; imported here so worker.py stays light
+    from jobs import process_meals, process_categories, MAX_IN_FLIGHT
+    from deps.dependencies import init_dependency_pool, close_dependency_pool
+
+    queues = [Queue(name, connection=conn) for name in listen]
+    print(f"Starting async worker (batch size {batch_size}, max in flight {MAX_IN_FLIGHT})...")
+
+    stop = _stop_on_signals()
+
+    await init_dependency_pool()
+    try:
+        handlers = {"jobs.process_meal": process_meals, "jobs.process_category": process_categories}
+        await _async_worker_loop(conn, queues, batch_size, handlers, MAX_IN_FLIGHT, stop)
+        print("Async worker stopped.")
+    finally:
+        await _close_worker_resources(close_dependency_pool)
+
+
+async def run_stream_worker(conn, batch_size: int = WORKER_BATCH_SIZE):
+    """
+    Long-lived worker consuming the Redis Streams job backend
+    (JOB_BACKEND=streams): claims batches of entries, runs them
+    concurrently in one event loop like the async worker and acknowledges
+    them when done. Entries of a worker that dies are reclaimed by the
+    others. SIGTERM/SIGINT stop it after the current batch.
+    """
+    from jobs import process_meals, process_categories, MAX_IN_FLIGHT
+    from deps.dependencies import init_dependency_pool, close_dependency_pool
+
+    stream = JobStream(conn)
+    stream.ensure_group()
+    consumer = f"{socket.gethostname()}-{os.getpid()}"
+    print(f"Starting stream worker {consumer} (batch size {batch_size}, max in flight {MAX_IN_FLIGHT})...")
+    stop = _stop_on_signals()
+
+    await init_dependency_pool()
+    try:
+        handlers = {"jobs.process_meal": process_meals, "jobs.process_category": process_categories}
+        await _stream_worker_loop(stream, consumer, batch_size, handlers, MAX_IN_FLIGHT, stop)
+        print("Stream worker stopped.")
+    finally:
+        await _close_worker_resources(close_dependency_pool)
+
+
+def _stop_on_signals() -> asyncio.Event:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    return stop
+
+
+async def _close_worker_resources(close_dependency_pool) -> None:
+    from extensions.context_writer import context_writer
+    from agents.truth_seeking_agent import optimized_tool
+    await asyncio.to_thread(context_writer.flush)
+    await optimized_tool.aclose()
+    await close_dependency_pool()
+
+
+async def _run_handler(handlers, func_name, args, max_in_flight, timeout: Optional[float] = None) -> dict:
+    """
+    Run one batch handler; a failing batch, or one still running after
+    timeout seconds, counts as failed for every argument.
+    """
+    try:
+        return await asyncio.wait_for(handlers[func_name](list(args), max_in_flight=max_in_flight), timeout)
+    except asyncio.TimeoutError:
+        print(f"Batch of {func_name} timed out after {timeout:.0f}s")
+        return {}
+    except Exception as e:
+        traceback.print_exc()
+        print(f"Batch failed: {str(e)}")
+        return {}
+
+
+def _batch_timeout(jobs: list, max_in_flight: int) -> Optional[float]:
+    """
+    Timeout of a batch: its longest job timeout for every round of
+    max_in_flight jobs (None when a job has no timeout).
+    """
+    timeouts = [job.timeout or Queue.DEFAULT_TIMEOUT for job in jobs]
+    if any(timeout < 0 for timeout in timeouts):
+        return None
+    return max(timeouts) * math.ceil(len(jobs) / max_in_flight)
+
+
+def _start_jobs(conn, queue: Queue, batches: dict, timeouts: dict, unsupported: list) -> dict:
+    """
+    Mark a popped batch as started in one round trip: every job goes into
+    the StartedJobRegistry until its batch timeout, so the jobs of a worker
+    that dies are failed by registry cleanup instead of being lost. Jobs
+    this worker cannot run are failed.
+
+    Returns:
+        The RQ execution of every started job, by job id.
+    """
+    executions = {}
+    with conn.pipeline() as pipe:
+        for func_name, arg_jobs in batches.items():
+            timeout = timeouts[func_name]
+            ttl = int(timeout) + STARTED_JOB_TTL_MARGIN if timeout is not None else -1
+            for job_list in arg_jobs.values():
+                for job in job_list:
+                    job.set_status(JobStatus.STARTED, pipeline=pipe)
+                    executions[job.id] = Execution.create(job, ttl, pipe)
+        for job in unsupported:
+            print(f"Failing unsupported job {job.id} ({job.func_name})")
+            job.set_status(JobStatus.FAILED, pipeline=pipe)
+            queue.failed_job_registry.add(
+                job, exc_string=f"Unsupported by the async worker: {job.func_name}", pipeline=pipe
+            )
+        pipe.execute()
+    return executions
+
+
+async def _async_worker_loop(conn, queues, batch_size, handlers, max_in_flight, stop: Optional[asyncio.Event] = None):
+    """
+    Pull job batches, run them and record their outcome, until stop is set.
+
+    Args:
+        handlers: Batch handler per job function name; each takes the list
+            of first job arguments and returns whether each one succeeded.
+        stop: Set to finish the current batch and return.
+    """
+    stop = stop or asyncio.Event()
+    last_maintenance = 0.0
+    while not stop.is_set():
+        if time.monotonic() - last_maintenance >= WORKER_MAINTENANCE_INTERVAL:
+            for queue in queues:
+                await asyncio.to_thread(clean_registries, queue)
+            last_maintenance = time.monotonic()
+
+        for queue in queues:
+            if stop.is_set():
+                break
+            jobs = await asyncio.to_thread(
+                _pop_jobs, conn, queue, batch_size, WORKER_POLL_TIMEOUT
+            )
+            if not jobs:
+                continue
+
+            batches, unsupported = {}, []
+            for job in jobs:
+                if job.func_name not in handlers or not job.args:
+                    unsupported.append(job)
+                    continue
+                batches.setdefault(job.func_name, {}).setdefault(job.args[0], []).append(job)
+            timeouts = {
+                name: _batch_timeout([job for job_list in arg_jobs.values() for job in job_list], max_in_flight)
+                for name, arg_jobs in batches.items()
+            }
+            executions = await asyncio.to_thread(_start_jobs, conn, queue, batches, timeouts, unsupported)
+
+            results = await asyncio.gather(
+                *(
+                    _run_handler(handlers, name, arg_jobs, max_in_flight, timeouts[name])
+                    for name, arg_jobs in batches.items()
+                )
+            )
+            await asyncio.to_thread(metrics.flush_to_file)
+
+            with conn.pipeline() as pipe:
+                for (func_name, arg_jobs), outcomes in zip(batches.items(), results):
+                    for arg, job_list in arg_jobs.items():
+                        for job in job_list:
+                            executions[job.id].delete(job, pipe)
+                            if outcomes.get(arg):
+                                # Expire the job hash with its registry entry, like RQ's own workers
+                                result_ttl = job.get_result_ttl(DEFAULT_RESULT_TTL)
+                                job.set_status(JobStatus.FINISHED, pipeline=pipe)
+                                queue.finished_job_registry.add(job, result_ttl, pipeline=pipe)
+                                job.cleanup(result_ttl, pipeline=pipe)
+                            else:
+                                # The failed registry expires the job hash after its failure_ttl
+                                job.set_status(JobStatus.FAILED, pipeline=pipe)
+                                queue.failed_job_registry.add(
+                                    job, job.failure_ttl, exc_string=f"{func_name.split('.')[-1]} failed", pipeline=pipe
+                                )
+                pipe.execute()
+
+
+
+async def _keep_claimed(stream: JobStream, consumer: str, entry_ids: list) -> None:
+    """Heartbeat claimed entries while their batch runs."""
+    while True:
+        await asyncio.sleep(STREAM_VISIBILITY_TIMEOUT / 4)
+        try:
+            await asyncio.to_thread(stream.heartbeat, consumer, entry_ids)
+        except redis.RedisError as e:
+            print(f"Stream heartbeat failed: {e}")
+
+
+async def _run_claimed(stream: JobStream, consumer: str, handlers, func_name, arg_jobs, max_in_flight) -> dict:
+    """
+    Run one batch of claimed entries, heartbeating them until it finishes
+    or times out like an RQ batch; a timed out batch counts as failed.
+    """
+    jobs = [job for job_list in arg_jobs.values() for job in job_list]
+    heartbeat = asyncio.create_task(_keep_claimed(stream, consumer, [job.entry_id for job in jobs]))
+    try:
+        return await _run_handler(handlers, func_name, arg_jobs, max_in_flight, _batch_timeout(jobs, max_in_flight))
+    finally:
+        heartbeat.cancel()
+
+
+async def _stream_worker_loop(stream: JobStream, consumer: str, batch_size, handlers, max_in_flight, stop: Optional[asyncio.Event] = None):
+    """
+    Claim job batches from the stream, run them and acknowledge them,
+    until stop is set. Failed jobs go to the dead-letter stream.
+    """
+    stop = stop or asyncio.Event()
+    while not stop.is_set():
+        claimed = await asyncio.to_thread(stream.claim, consumer, batch_size, WORKER_POLL_TIMEOUT * 1000)
+        if not claimed:
+            continue
+
+        batches, unsupported = {}, []
+        for job in claimed:
+            if job.func_name not in handlers:
+                print(f"Skipping unsupported job {job.job_id} ({job.func_name})")
+                unsupported.append(job)
+                continue
+            batches.setdefault(job.func_name, {}).setdefault(job.arg, []).append(job)
+        await asyncio.to_thread(stream.dead_letter, unsupported, "unsupported job")
+
+        results = await asyncio.gather(
+            *(_run_claimed(stream, consumer, handlers, name, arg_jobs, max_in_flight) for name, arg_jobs in batches.items())
+        )
+        await asyncio.to_thread(metrics.flush_to_file)
+
+        done, failed = [], []
+        for (func_name, arg_jobs), outcomes in zip(batches.items(), results):
+            for arg, job_list in arg_jobs.items():
+                (done if outcomes.get(arg) else failed).extend(job_list)
+        await asyncio.to_thread(stream.ack, done)
+        await asyncio.to_thread(stream.dead_letter, failed, "failed")
+
 
 if __name__ == "__main__":
     start_worker()